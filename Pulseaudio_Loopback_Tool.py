@@ -1,14 +1,21 @@
 '''
 Simple(ish) program to allow a user to quickly make basic virtual sinks and loopbacks in Pulseaudio
 using a GUI and not having to interact with the command line.
-Uses shell commands to interact with Pulseaudio.
+Talks to Pulseaudio through the backend selected in backends, one long-lived pacmd process when started with --old.
 Developed and tested on Ubuntu 18.10, everything else is untested.
 The GUI is created via tkinter.
 '''
 
 import subprocess as sp
 import tkinter as tk
-from Logger import log, INFO, WARNING, ERROR
+
+import pulsectl
+
+import backends
+from Logger import log, INFO, WARNING
+
+CLIENT_NAME = "pulseaudio-loopback-tool"
+PA_INVALID_INDEX = 0xFFFFFFFF
 
 
 def main():
@@ -26,6 +33,10 @@ def setup_window():
     has. For example, a button and 2 entries that all function together to create a loopback should be titled something
     like "Loopback Creation"
     '''
+    # Connection to the server that every list and action goes through.
+    global backend
+    backend = backends.connect(CLIENT_NAME)
+
     # Main window that everything hooks to.
     window = tk.Tk()
     window.title("Pulseaudio Bridging Utility")
@@ -219,40 +230,58 @@ def setup_window():
     entry_create_sink.insert(0, "Default_Sink_Name")
     entry_remap_source_name.insert(0, "Default_Remap_Name")
 
-    window.mainloop()
+    try:
+        window.mainloop()
+    finally:
+        backend.close()
 
 
 def list_sinks():
-    output = sp.getoutput("pactl list sinks short")
-    return output
+    return backend.sink_list()
 
 
 def list_sources():
-    output = sp.getoutput("pactl list sources short")
-    return output
+    return backend.source_list()
 
 
 def list_modules():
-    output = sp.getoutput("pactl list modules short")
-    return output
+    return backend.module_list()
 
 
-def process_list(inputlist):
+def load_module(name, arguments):
     '''
-    Takes an input list and processes it to make it easier to work with later on. Used with the list_*() functions.
-    :param inputlist: A string that consists of at least 1 line and 1 tab, typically from the list_*() functions.
-    :return: A 2D list, with each sentence being the first dimension and each part of the sentence separated by tabs
-    being the second dimension.
+    Loads a module through the backend.
+    :param name: Module name, for example module-loopback.
+    :param arguments: Module argument string.
+    :return: Index of the new module.
     '''
-    splitlinelist = inputlist.splitlines()
-    output = []
-    for line in splitlinelist:
-        attachment = []
-        splitline = line.split("\t")
-        for part in splitline:
-            attachment.append(part)
-        output.append(attachment)
-    return output
+    index = backend.module_load(name, arguments)
+    # pulsectl 20.5 reports a refused load by returning PA_INVALID_INDEX instead of raising.
+    if index == PA_INVALID_INDEX:
+        raise pulsectl.PulseOperationFailed("The server refused to load " + name)
+    return index
+
+
+def device_to_row(device):
+    '''
+    Turns a sink or source from the backend into the columns of a "pactl list sinks short" line, followed by the
+    details only the long listings have.
+    :param device: pulsectl sink or source info.
+    :return: A list of strings: id, name, driver, sample rate, state, description, latency.
+    '''
+    rate = "{} Hz".format(device.sample_spec.rate) if device.sample_spec is not None else ""
+    latency = "{:.1f} ms".format(device.latency / 1000) if device.latency is not None else ""
+    return [str(device.index), device.name, device.driver or "", rate, device.state._value.upper(),
+            device.description or "", latency]
+
+
+def module_to_row(module):
+    '''
+    Turns a module from the backend into the columns of a "pactl list modules short" line.
+    :param module: pulsectl module info.
+    :return: A list of strings: id, module name, attributes.
+    '''
+    return [str(module.index), module.name, module.argument or ""]
 
 
 def color_tag(state):
@@ -274,17 +303,27 @@ def color_tag(state):
     return output
 
 
-def process_short_list(input_list):
+def process_devices(processed_list):
     '''
-    This function is passed a string input from pactl list short command, and organizes it as needed.
-    :param input_list: A string with at least 1 line, and at least 5 different items separated by tabs.
+    Organizes devices for displaying.
+    :param processed_list: A list of devices, each a list of at least 5 strings as made by device_to_row().
+    Description, sample rate and latency are shown when given.
     :return: A list of shortened names of the devices in output[0], and colors for those devices in output[1].
     '''
-    processed_list = process_list(input_list)
     devices = []
     colors = []
     for item in processed_list:
+        if len(item) < 5:
+            log(WARNING, "process_devices", "Device with less than 5 items found: \"" + str(item) + "\"")
+            continue
         temp = item[0] + "   " + item[1] + "   " + item[4]
+        # device_to_row() adds the details of the long listings, which the short ones do not have.
+        if len(item) > 6:
+            if item[5] and item[5] != item[1]:
+                temp += "   " + item[5]
+            for detail in (item[3], item[6]):
+                if detail:
+                    temp += "   " + detail
         devices.append(temp)
         colors.append(color_tag(item[4]))
     output = []
@@ -328,17 +367,16 @@ def process_module(input_module, *args):
     return output
 
 
-def process_module_list(input_list):
+def process_modules(processed_list):
     '''
-    This function is passed a string input from "pactl list modules short" and organizes it as needed.
-    :param input_list: A string with at least 1 line, and at least 2 different items separated by tabs.
+    Picks the modules this program cares about and names them for displaying.
+    :param processed_list: A list of modules, each a list of strings as made by module_to_row().
     :return: A list of shortened names of applicable modules.
     '''
-    processed_list = process_list(input_list)
     devices = []
     for item in processed_list:
         if len(item) < 2:
-            log(WARNING, "process_module_list", "Module with less than 2 items found: \"" + str(item) + "\"")
+            log(WARNING, "process_modules", "Module with less than 2 items found: \"" + str(item) + "\"")
         # If the item is some sort of null sink (because it could be made via this program):
         elif item[1] == "module-null-sink":
             temp = process_module(item, "sink_name")
@@ -363,8 +401,8 @@ def process_module_list(input_list):
 
 def refresh_lists():
     '''
-    Uses process_short_list() to get information about sinks + sources and forwards that information to the user via
-    listbox_sink_list + listbox_source_list, and uses process_module_list() to get information about relevant modules
+    Uses process_devices() to get information about sinks + sources and forwards that information to the user via
+    listbox_sink_list + listbox_source_list, and uses process_modules() to get information about relevant modules
     and forwards that information to the user via listbox_module_list. For every listbox, this function will delete
     the information in the listbox and replace it with the newly gathered information. The listbox's for both sinks
     and sources have entries colored based on what state they are in. For color information, see color_tag().
@@ -377,7 +415,7 @@ def refresh_lists():
 
     # Get the sinks processed, delete the old list, make a new list, and get the colors all nice.
     sink_list = list_sinks()
-    sinks = process_short_list(sink_list)
+    sinks = process_devices([device_to_row(sink) for sink in sink_list])
     listbox_sink_list.delete(0, tk.END)
     for sink in sinks[0]:
         listbox_sink_list.insert(tk.END, sink)
@@ -387,7 +425,7 @@ def refresh_lists():
 
     # Get the sources processed, delete the old list, make a new list, and get the colors all nice.
     source_list = list_sources()
-    sources = process_short_list(source_list)
+    sources = process_devices([device_to_row(source) for source in source_list])
     listbox_source_list.delete(0, tk.END)
     for source in sources[0]:
         listbox_source_list.insert(tk.END, source)
@@ -397,7 +435,7 @@ def refresh_lists():
 
     # Get the modules processed, delete the old list, and make a new list. No colors here.
     module_list = list_modules()
-    modules = process_module_list(module_list)
+    modules = process_modules([module_to_row(module) for module in module_list])
     listbox_module_list.delete(0, tk.END)
     for module in modules:
         listbox_module_list.insert(tk.END, module)
@@ -484,19 +522,17 @@ def create_virtual_sink():
     '''
     global entry_create_sink
     input_name = entry_create_sink.get()
-    command = ("pactl load-module module-null-sink sink_name=" + input_name +
-               " sink_properties=device.description=" + input_name + " rate=48000")
+    arguments = ("sink_name=" + input_name + " sink_properties=device.description=" + input_name + " rate=48000")
     log(INFO, "create_virtual_sink", "Attempting to create virtual sink with name \"" + input_name + "\"")
-    returned_value = sp.call(command, shell=True, stdout=sp.PIPE)
-    if returned_value is 1:
+    try:
+        load_module("module-null-sink", arguments)
+    except pulsectl.PulseError as error:
         entry_create_sink.delete(0, tk.END)
         entry_create_sink.insert(0, "Invalid Name!")
         log(WARNING, "create_virtual_sink", "Creation of virtual sink with name \"" + input_name +
-            "\" was not successful.")
-    elif returned_value is 0:
-        log(INFO, "create_virtual_sink", "Creation of virtual sink with name \"" + input_name + "\" was successful.")
+            "\" was not successful:", error)
     else:
-        log(ERROR, "create_virtual_sink", "Unexpected Error Value:", returned_value)
+        log(INFO, "create_virtual_sink", "Creation of virtual sink with name \"" + input_name + "\" was successful.")
     refresh_lists()
 
 
@@ -516,21 +552,19 @@ def create_remapped_source():
     entry_remap_name = entry_remap_source_name.get()
     log(INFO, "create_remapped_source", "Attempting to remap source \"" + entry_source_id + "\" with name \"" +
         entry_remap_name + "\"")
-    returned_value = sp.call("pactl load-module module-remap-source master=" + entry_source_id + " source_name=" +
-                             entry_remap_name + " source_properties=device.description=" + entry_remap_name, shell=True,
-                             stdout=sp.PIPE)
-    if returned_value is 1:
+    try:
+        load_module("module-remap-source", "master=" + entry_source_id + " source_name=" + entry_remap_name +
+                            " source_properties=device.description=" + entry_remap_name)
+    except pulsectl.PulseError as error:
         entry_remap_source_source.delete(0, tk.END)
         entry_remap_source_source.insert(0, "ERR")
         entry_remap_source_name.delete(0, tk.END)
         entry_remap_source_name.insert(0, "Error or Invalid Name!")
         log(WARNING, "create_remapped_source", "Attempt to remap source \"" + entry_source_id + "\" with name \"" +
-            entry_remap_name + "\" was not successful.")
-    elif returned_value is 0:
+            entry_remap_name + "\" was not successful:", error)
+    else:
         log(INFO, "create_remapped_source", "Attempt to remap source \"" + entry_source_id + "\" with name \"" +
             entry_remap_name + "\" was successful.")
-    else:
-        log(ERROR, "create_remapped_source", "Unexpected Error Value:", returned_value)
     refresh_lists()
 
 
@@ -550,20 +584,18 @@ def create_loopback():
     entry_source = entry_create_loopback_source.get()
     log(INFO, "create_loopback", "Attempting to create loopback from \"" + entry_source + "\" to \"" +
         entry_sink + "\"")
-    returned_value = sp.call("pactl load-module module-loopback sink=" + entry_sink + " source=" + entry_source +
-                             " latency_msec=5", shell=True, stdout=sp.PIPE)
-    if returned_value is 1:
+    try:
+        load_module("module-loopback", "sink=" + entry_sink + " source=" + entry_source + " latency_msec=5")
+    except pulsectl.PulseError as error:
         entry_create_loopback_source.delete(0, tk.END)
         entry_create_loopback_source.insert(0, "ERR")
         entry_create_loopback_sink.delete(0, tk.END)
         entry_create_loopback_sink.insert(0, "ERR")
         log(WARNING, "create_loopback", "Creation of loopback from \"" + entry_source + "\" to \"" + entry_sink +
-            "\" was not successful.")
-    elif returned_value is 0:
+            "\" was not successful:", error)
+    else:
         log(INFO, "create_loopback", "Creation of loopback from \"" + entry_source + "\" to \"" + entry_sink +
             "\" was successful.")
-    else:
-        log(ERROR, "create_loopback", "Unexpected Error Value:", returned_value)
     refresh_lists()
 
 
@@ -578,15 +610,14 @@ def remove_module():
     global entry_remove_module
     entry = entry_remove_module.get()
     log(INFO, "remove_module", "Attempting to remove module \"" + entry + "\"")
-    returned_value = sp.call("pactl unload-module " + entry, shell=True, stdout=sp.PIPE)
-    if returned_value is 1:
+    try:
+        backend.module_unload(int(entry))
+    except (ValueError, pulsectl.PulseError) as error:
         entry_remove_module.delete(0, tk.END)
         entry_remove_module.insert(0, "ERR")
-        log(WARNING, "remove_module", "Removal of module \"" + entry + "\" was not successful.")
-    elif returned_value is 0:
-        log(INFO, "remove_module", "Removal of module \"" + entry + "\" was successful.")
+        log(WARNING, "remove_module", "Removal of module \"" + entry + "\" was not successful:", error)
     else:
-        log(ERROR, "remove_module", "Unexpected Error Value:", returned_value)
+        log(INFO, "remove_module", "Removal of module \"" + entry + "\" was successful.")
     refresh_lists()
 
 
@@ -0,0 +1,707 @@
+"""
+Backends that connect the program to a sound server.
+Everything the program needs from the server, listing objects and loading and unloading modules first of all, goes
+through an object offering the methods of pulsectl.Pulse that Backend lists, returning pulsectl info objects and
+raising pulsectl errors. program_logic, both GUIs and the headless commands therefore run unchanged on any of:
+- "pulsectl": pulsectl.Pulse itself, one native connection.
+- "pactl": runs pactl for every operation, parsing its long listings, and pactl subscribe for events, for systems where
+  pulsectl cannot be used.
+- "pacmd": keeps one pacmd process open and sends it every operation, the default of the old GUI.
+- "fake": fake_pulse.FakePulse, an in-memory server whose modules create sinks, sources and streams, so the program
+  and its performance can be tested deterministically without a daemon.
+The backend is chosen once per process with select_backend(); connect() then opens connections to it.
+"""
+import abc
+import logging
+import os
+import re
+import select
+import subprocess
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional, Union
+
+import pulsectl
+
+import listing_parser
+
+logger = logging.getLogger("Main")
+
+PULSECTL = "pulsectl"
+PACTL = "pactl"
+PACMD = "pacmd"
+FAKE = "fake"
+BACKEND_NAMES = [PULSECTL, PACTL, PACMD, FAKE]
+DEFAULT_BACKEND = PULSECTL
+# Hardware sinks and sources, and modules, the fake server starts out with.
+FAKE_OBJECT_COUNT = 8
+
+_selected_backend = DEFAULT_BACKEND
+_fake_server = None
+
+
+class SampleSpec(NamedTuple):
+    """
+    Sample spec of a device or stream, in place of the ctypes structure pulsectl gives its own info objects.
+    """
+    # Format name, for example "s16le", or pa_sample_format_t value.
+    format: Union[str, int]
+    rate: int
+    channels: int
+
+
+def make_info(info_class, **fields):
+    """
+    Builds a pulsectl info object from keyword fields, leaving the fields this program never reads as None.
+    :param info_class: A pulsectl info class, for example pulsectl.PulseSinkInfo.
+    :param fields: Field values. state is given by name, for example "running".
+    :return:
+    """
+    fields = dict(dict.fromkeys(info_class.c_struct_fields.split()
+                                if isinstance(info_class.c_struct_fields, str)
+                                else info_class.c_struct_fields), **fields)
+    state = fields.pop("state", None)
+    info = info_class(**fields)
+    if state is not None:
+        info.state = pulsectl.PulseStateEnum[state]
+    return info
+
+
+class Backend(abc.ABC):
+    """
+    The part of the pulsectl.Pulse interface the program uses, for backends other than pulsectl itself.
+    Listing, loading and unloading are what every backend must offer. The per object lookups, stream moves, server
+    info and events are needed by the GUI and the long running headless commands; a backend that cannot offer one
+    raises pulsectl.PulseError from it.
+    """
+    connected = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+
+    def close(self):
+        self.connected = False
+
+    @abc.abstractmethod
+    def sink_list(self) -> List[pulsectl.PulseSinkInfo]:
+        """
+        :return: Every sink.
+        """
+
+    @abc.abstractmethod
+    def source_list(self) -> List[pulsectl.PulseSourceInfo]:
+        """
+        :return: Every source, monitors included.
+        """
+
+    @abc.abstractmethod
+    def module_list(self) -> List[pulsectl.PulseModuleInfo]:
+        """
+        :return: Every loaded module.
+        """
+
+    @abc.abstractmethod
+    def sink_input_list(self) -> List[pulsectl.PulseSinkInputInfo]:
+        """
+        :return: Every playback stream.
+        """
+
+    @abc.abstractmethod
+    def source_output_list(self) -> List[pulsectl.PulseSourceOutputInfo]:
+        """
+        :return: Every recording stream.
+        """
+
+    @abc.abstractmethod
+    def module_load(self, name: str, args: str = "") -> int:
+        """
+        :return: Index of the new module.
+        :raises pulsectl.PulseOperationFailed: The server refused to load it.
+        """
+
+    @abc.abstractmethod
+    def module_unload(self, index: int):
+        """
+        :raises pulsectl.PulseOperationFailed: There is no such module or it could not be unloaded.
+        """
+
+    @staticmethod
+    def _find(items: List, index: int):
+        for item in items:
+            if item.index == index:
+                return item
+        raise pulsectl.PulseIndexError(index)
+
+    def sink_info(self, index: int) -> pulsectl.PulseSinkInfo:
+        return self._find(self.sink_list(), index)
+
+    def source_info(self, index: int) -> pulsectl.PulseSourceInfo:
+        return self._find(self.source_list(), index)
+
+    def module_info(self, index: int) -> pulsectl.PulseModuleInfo:
+        return self._find(self.module_list(), index)
+
+    def sink_input_info(self, index: int) -> pulsectl.PulseSinkInputInfo:
+        return self._find(self.sink_input_list(), index)
+
+    def source_output_info(self, index: int) -> pulsectl.PulseSourceOutputInfo:
+        return self._find(self.source_output_list(), index)
+
+    def get_sink_by_name(self, name: str) -> pulsectl.PulseSinkInfo:
+        for sink in self.sink_list():
+            if sink.name == name:
+                return sink
+        raise pulsectl.PulseIndexError(name)
+
+    @abc.abstractmethod
+    def server_info(self) -> pulsectl.PulseServerInfo:
+        """
+        :return: Server info with at least the default sink and source names.
+        """
+
+    @abc.abstractmethod
+    def sink_input_move(self, obj_index: int, sink_index: int):
+        """
+        Moves a playback stream to another sink.
+        """
+
+    @abc.abstractmethod
+    def source_output_move(self, obj_index: int, source_index: int):
+        """
+        Moves a recording stream to another source.
+        """
+
+    @abc.abstractmethod
+    def event_mask_set(self, *masks):
+        """
+        Chooses the facilities, for example "sink", whose events are delivered.
+        """
+
+    @abc.abstractmethod
+    def event_callback_set(self, function: Optional[Callable]):
+        """
+        Sets the function event_listen() calls with each pulsectl.PulseEventInfo.
+        """
+
+    @abc.abstractmethod
+    def event_listen(self, timeout: float = None, raise_on_disconnect: bool = True):
+        """
+        Delivers events until the timeout passes, event_listen_stop() is called or the callback raises
+        pulsectl.PulseLoopStop.
+        """
+
+    @abc.abstractmethod
+    def event_listen_stop(self):
+        """
+        Makes a running event_listen() return. Safe to call from any thread.
+        """
+
+
+DEVICE_STATES = ["running", "idle", "suspended"]
+_SAMPLE_SPEC_PATTERN = re.compile(r"(\S+) (\d+)ch (\d+)Hz")
+# Facility names in pactl subscribe output that differ from pulsectl's.
+_PACTL_FACILITIES = {"sink-input": "sink_input", "source-output": "source_output"}
+_EVENT_PATTERN = re.compile(r"Event '(\w+)' on ([\w-]+) #(\d+)")
+# Characters read from pactl at a time for its JSON listings, which are printed on a single line.
+PACTL_READ_SIZE = 65536
+
+
+def _parse_sample_spec(text: str) -> Optional[SampleSpec]:
+    match = _SAMPLE_SPEC_PATTERN.match(text)
+    if match is None:
+        return None
+    return SampleSpec(format=match.group(1), rate=int(match.group(3)), channels=int(match.group(2)))
+
+
+def _parse_index(text: str) -> Optional[int]:
+    return int(text) if text.isdigit() else None
+
+
+def _leading_index(text: Optional[str]) -> Optional[int]:
+    # pacmd follows indices with the name, as in "sink: 0 <alsa_output.pci-0000_00_1f.3.analog-stereo>".
+    if not text:
+        return None
+    return _parse_index(text.split(" ", 1)[0])
+
+
+def _device_state(text: Optional[str]) -> str:
+    state = (text or "").lower()
+    return state if state in DEVICE_STATES else "suspended"
+
+
+_LATENCY_PATTERN = re.compile(r"([\d.]+) (usec|ms)")
+
+
+def _parse_latency(text: Optional[str]) -> Optional[int]:
+    """
+    :param text: Latency as pactl prints it, "1234 usec, configured 2000 usec", or as pacmd does, "1.23 ms".
+    :return: The current latency in microseconds, like pulsectl gives it.
+    """
+    match = _LATENCY_PATTERN.search(text or "")
+    if match is None:
+        return None
+    value = float(match.group(1))
+    return int(value * 1000 if match.group(2) == "ms" else value)
+
+
+def record_to_info(record: listing_parser.ListingRecord):
+    """
+    Converts a record of a long listing into the pulsectl info object of its kind.
+    :param record: Record from one of the listing_parser parsers.
+    :return:
+    """
+    fields = record.fields
+    if record.kind == listing_parser.MODULE:
+        info = make_info(pulsectl.PulseModuleInfo, index=record.index, name=fields.get("name", ""),
+                         argument=fields.get("argument", ""), n_used=-1)
+    elif record.kind in (listing_parser.SINK, listing_parser.SOURCE):
+        name = fields.get("name", "")
+        device_fields = dict(index=record.index, name=name, driver=fields.get("driver"),
+                             description=fields.get("description") or record.properties.get("device.description",
+                                                                                           name),
+                             sample_spec=_parse_sample_spec(fields.get("sample_spec", "")),
+                             latency=_parse_latency(fields.get("latency")),
+                             owner_module=_leading_index(fields.get("owner_module")),
+                             state=_device_state(fields.get("state")))
+        if record.kind == listing_parser.SINK:
+            info = make_info(pulsectl.PulseSinkInfo, **device_fields)
+        else:
+            # pacmd gives the index of the sink a monitor belongs to, pactl its name or "n/a".
+            monitor_of_sink = fields.get("monitor_of_sink")
+            monitor_of_sink_index = _leading_index(monitor_of_sink)
+            info = make_info(pulsectl.PulseSourceInfo, monitor_of_sink=monitor_of_sink_index,
+                             monitor_of_sink_name=(monitor_of_sink if monitor_of_sink_index is None
+                                                   and monitor_of_sink not in (None, "", "n/a") else None),
+                             **device_fields)
+    else:
+        device_field, info_class = (("sink", pulsectl.PulseSinkInputInfo) if record.kind == listing_parser.SINK_INPUT
+                                    else ("source", pulsectl.PulseSourceOutputInfo))
+        info = make_info(info_class, index=record.index, name=record.properties.get("media.name", ""),
+                         driver=fields.get("driver"),
+                         corked=fields.get("corked") == "yes" or fields.get("state", "").upper() == "CORKED",
+                         owner_module=_leading_index(fields.get("owner_module")),
+                         client=_leading_index(fields.get("client")),
+                         sample_spec=_parse_sample_spec(fields.get("sample_spec", "")),
+                         **{device_field: _leading_index(fields.get(device_field))})
+    info.proplist = dict(record.properties)
+    return info
+
+
+class PactlBackend(Backend):
+    """
+    Runs one pactl process per operation. Listings are the JSON ones of pactl 16 and later, or the long text ones of
+    older versions, parsed while pactl prints them. Events come from a pactl subscribe process that runs while events
+    are wanted. pactl translates its output, so it always runs in the C locale.
+    """
+    def __init__(self, client_name: str = "pulseaudio-loopback-tool", command: str = "pactl"):
+        self.client_name = client_name
+        self.command = command
+        self.event_callback: Optional[Callable] = None
+        self._environment = dict(os.environ, LC_ALL="C")
+        self._event_facilities: List[str] = []
+        self._subscriber: Optional[subprocess.Popen] = None
+        self._event_buffer = b""
+        self._stop_reader, self._stop_writer = os.pipe()
+        os.set_blocking(self._stop_writer, False)
+        # Fails like pulsectl.Pulse() does when there is no server to talk to. Versions without --format fail the
+        # first try.
+        try:
+            try:
+                self._run("--format=json", "info")
+                self.json_listings = True
+            except pulsectl.PulseOperationFailed:
+                self._run("info")
+                self.json_listings = False
+        except pulsectl.PulseError:
+            self.close()
+            raise
+
+    def close(self):
+        super().close()
+        if self._subscriber is not None:
+            self._subscriber.terminate()
+            self._subscriber.wait()
+            self._subscriber = None
+        for descriptor in (self._stop_reader, self._stop_writer):
+            try:
+                os.close(descriptor)
+            except OSError:
+                pass
+
+    def _command_line(self, args) -> List[str]:
+        return [self.command, "--client-name={}".format(self.client_name)] + list(args)
+
+    def _run(self, *args: str) -> str:
+        """
+        Runs pactl with the given arguments.
+        :return: Its standard output.
+        :raises pulsectl.PulseOperationFailed: pactl failed.
+        """
+        try:
+            process = subprocess.run(self._command_line(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     universal_newlines=True, env=self._environment)
+        except OSError as error:
+            raise pulsectl.PulseError("Running {} failed: {}".format(self.command, error)) from error
+        if process.returncode != 0:
+            raise pulsectl.PulseOperationFailed("pactl {} failed: {}".format(" ".join(args), process.stderr.strip()))
+        return process.stdout
+
+    def _stream(self, *args: str, chunked: bool = False) -> Iterator[str]:
+        """
+        Runs pactl with the given arguments and reads its output while it is printed.
+        :param chunked: Yields the output in pieces of PACTL_READ_SIZE characters instead of line by line.
+        :return: Generator of the output.
+        :raises pulsectl.PulseOperationFailed: pactl failed.
+        """
+        try:
+            process = subprocess.Popen(self._command_line(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       universal_newlines=True, env=self._environment)
+        except OSError as error:
+            raise pulsectl.PulseError("Running {} failed: {}".format(self.command, error)) from error
+        try:
+            if chunked:
+                yield from iter(lambda: process.stdout.read(PACTL_READ_SIZE), "")
+            else:
+                yield from process.stdout
+            errors = process.stderr.read()
+            if process.wait() != 0:
+                raise pulsectl.PulseOperationFailed("pactl {} failed: {}".format(" ".join(args), errors.strip()))
+        finally:
+            # Also reached when the reader stops early.
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    def _list(self, kind: str, record_kind: str) -> List:
+        """
+        :param kind: What to list, as pactl names it, for example "sink-inputs".
+        :param record_kind: The same as a listing_parser kind, for example listing_parser.SINK_INPUT.
+        :return: pulsectl info objects of the listed objects.
+        """
+        if self.json_listings:
+            records = listing_parser.parse_pactl_json(self._stream("--format=json", "list", kind, chunked=True),
+                                                      record_kind)
+        else:
+            records = listing_parser.parse_pactl_list(self._stream("list", kind))
+        try:
+            return [record_to_info(record) for record in records if record.kind == record_kind]
+        except ValueError as error:
+            raise pulsectl.PulseOperationFailed("Unexpected output of pactl list {}: {}".format(kind, error)) \
+                from error
+
+    def sink_list(self) -> List[pulsectl.PulseSinkInfo]:
+        return self._list("sinks", listing_parser.SINK)
+
+    def source_list(self) -> List[pulsectl.PulseSourceInfo]:
+        sources = self._list("sources", listing_parser.SOURCE)
+        # pactl names the sink a monitor belongs to instead of giving its index.
+        if any(source.monitor_of_sink_name is not None for source in sources):
+            sink_indices = {sink.name: sink.index for sink in self.sink_list()}
+            for source in sources:
+                if source.monitor_of_sink is None:
+                    source.monitor_of_sink = sink_indices.get(source.monitor_of_sink_name)
+        return sources
+
+    def module_list(self) -> List[pulsectl.PulseModuleInfo]:
+        return self._list("modules", listing_parser.MODULE)
+
+    def sink_input_list(self) -> List[pulsectl.PulseSinkInputInfo]:
+        return self._list("sink-inputs", listing_parser.SINK_INPUT)
+
+    def source_output_list(self) -> List[pulsectl.PulseSourceOutputInfo]:
+        return self._list("source-outputs", listing_parser.SOURCE_OUTPUT)
+
+    def module_load(self, name: str, args: str = "") -> int:
+        output = self._run("load-module", name, *([args] if args else []))
+        try:
+            return int(output.strip())
+        except ValueError as error:
+            raise pulsectl.PulseOperationFailed("Unexpected output of pactl load-module: {!r}".format(output)) \
+                from error
+
+    def module_unload(self, index: int):
+        self._run("unload-module", str(index))
+
+    def server_info(self) -> pulsectl.PulseServerInfo:
+        fields = {}
+        for line in self._run("info").splitlines():
+            name, separator, value = line.partition(": ")
+            if separator:
+                fields[name.strip()] = value.strip()
+        return make_info(pulsectl.PulseServerInfo, server_name=fields.get("Server Name"),
+                         server_version=fields.get("Server Version"), default_sink_name=fields.get("Default Sink"),
+                         default_source_name=fields.get("Default Source"))
+
+    def sink_input_move(self, obj_index: int, sink_index: int):
+        self._run("move-sink-input", str(obj_index), str(sink_index))
+
+    def source_output_move(self, obj_index: int, source_index: int):
+        self._run("move-source-output", str(obj_index), str(source_index))
+
+    def event_mask_set(self, *masks):
+        self._event_facilities = list(masks)
+
+    def event_callback_set(self, function: Optional[Callable]):
+        self.event_callback = function
+
+    def _start_subscriber(self):
+        self._subscriber = subprocess.Popen(self._command_line(["subscribe"]), stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, env=self._environment)
+        os.set_blocking(self._subscriber.stdout.fileno(), False)
+
+    def event_listen(self, timeout: float = None, raise_on_disconnect: bool = True):
+        """
+        Delivers events from pactl subscribe until the timeout passes, event_listen_stop() is called or the callback
+        raises pulsectl.PulseLoopStop.
+        """
+        if self._subscriber is None:
+            self._start_subscriber()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events_fd = self._subscriber.stdout.fileno()
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([events_fd, self._stop_reader], [], [], remaining)
+            if self._stop_reader in readable:
+                os.read(self._stop_reader, 4096)
+                return
+            if not readable:
+                return
+
+            data = os.read(events_fd, 65536)
+            if not data:
+                self._subscriber.wait()
+                self._subscriber = None
+                self.connected = False
+                if raise_on_disconnect:
+                    raise pulsectl.PulseDisconnected()
+                return
+            *lines, self._event_buffer = (self._event_buffer + data).split(b"\n")
+            for line in lines:
+                try:
+                    self._deliver(line.decode("utf-8", "replace"))
+                except pulsectl.PulseLoopStop:
+                    return
+
+    def _deliver(self, line: str):
+        match = _EVENT_PATTERN.match(line)
+        if match is None or self.event_callback is None:
+            return
+        event_type, facility, index = match.groups()
+        facility = _PACTL_FACILITIES.get(facility, facility)
+        if facility not in self._event_facilities and "all" not in self._event_facilities:
+            return
+        self.event_callback(pulsectl.PulseEventInfo(pulsectl.PulseEventTypeEnum[event_type],
+                                                    pulsectl.PulseEventFacilityEnum[facility], int(index)))
+
+    def event_listen_stop(self):
+        try:
+            os.write(self._stop_writer, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+
+class PacmdSession:
+    """
+    One long-lived pacmd process that commands are written to and responses read from through pipes.
+    pacmd only prints its ">>> " prompt on a terminal, so the session makes its own: after every command it sends
+    END_MARKER, which is not a command, and the server's complaint about it ends the response. Responses are read
+    line by line as they arrive, and only one response can be read at a time.
+    """
+    END_MARKER = "palt-end-of-response"
+    PROMPT = ">>> "
+
+    def __init__(self, command: str = "pacmd"):
+        try:
+            self._process = subprocess.Popen([command], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        except OSError as error:
+            raise pulsectl.PulseError("Running {} failed: {}".format(command, error)) from error
+        self._pending: Optional[Iterator[str]] = None
+        # Skips the welcome message, and fails like pulsectl.Pulse() does when there is no server to talk to.
+        try:
+            greeting = list(self.execute(""))
+        except pulsectl.PulseDisconnected as error:
+            self.close()
+            raise pulsectl.PulseError("pacmd exited: {}".format(error)) from error
+        logger.debug("pacmd session started: {}".format(" ".join(greeting)))
+
+    @property
+    def running(self) -> bool:
+        return self._process.poll() is None
+
+    def close(self):
+        if self._process.poll() is None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self._process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process.stdout.close()
+
+    def execute(self, command: str) -> Iterator[str]:
+        """
+        Sends a command to pacmd.
+        :param command: One pacmd command line, for example "list-sinks".
+        :return: Generator of the lines of the response, without line endings or prompts, read as they arrive.
+        :raises pulsectl.PulseDisconnected: pacmd exited.
+        """
+        if self._pending is not None:
+            # The previous response has to be read past before this one starts.
+            for _ in self._pending:
+                pass
+        try:
+            self._process.stdin.write("{}\n{}\n".format(command, self.END_MARKER) if command
+                                      else "{}\n".format(self.END_MARKER))
+            self._process.stdin.flush()
+        except OSError as error:
+            raise pulsectl.PulseDisconnected("Writing to pacmd failed: {}".format(error)) from error
+        self._pending = self._read_response()
+        return self._pending
+
+    def _read_response(self) -> Iterator[str]:
+        lines = []
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                self._pending = None
+                raise pulsectl.PulseDisconnected(" ".join(lines[-3:]) or "pacmd exited.")
+            line = line.rstrip("\n")
+            while line.startswith(self.PROMPT):
+                line = line[len(self.PROMPT):]
+            if self.END_MARKER in line:
+                self._pending = None
+                return
+            lines.append(line)
+            yield line
+
+
+class PacmdBackend(Backend):
+    """
+    Talks to the server through a single pacmd process for its whole lifetime, so no process is started per
+    operation. Listings are parsed while pacmd writes them. pacmd cannot subscribe to events, so this backend suits the
+    old GUI, which refreshes on demand, but not the long running commands.
+    """
+    def __init__(self, client_name: str = "pulseaudio-loopback-tool", command: str = "pacmd"):
+        # pacmd has no option for a client name, so the connection is shown under pacmd's own.
+        self.client_name = client_name
+        self.session = PacmdSession(command)
+
+    def close(self):
+        super().close()
+        self.session.close()
+
+    def _run(self, command: str) -> Iterator[str]:
+        if not self.session.running:
+            self.connected = False
+            raise pulsectl.PulseDisconnected("pacmd exited.")
+        return self.session.execute(command)
+
+    def _run_quiet(self, command: str):
+        """
+        Runs a command that prints nothing when it succeeds.
+        :raises pulsectl.PulseOperationFailed: The command printed an error.
+        """
+        output = [line for line in self._run(command) if line.strip()]
+        if output:
+            raise pulsectl.PulseOperationFailed("pacmd {} failed: {}".format(command, " ".join(output)))
+
+    def _list(self, command: str, kind: str) -> List:
+        return [record_to_info(record) for record in listing_parser.parse_pacmd_list(self._run(command), kind)]
+
+    def sink_list(self) -> List[pulsectl.PulseSinkInfo]:
+        return self._list("list-sinks", listing_parser.SINK)
+
+    def source_list(self) -> List[pulsectl.PulseSourceInfo]:
+        return self._list("list-sources", listing_parser.SOURCE)
+
+    def module_list(self) -> List[pulsectl.PulseModuleInfo]:
+        return self._list("list-modules", listing_parser.MODULE)
+
+    def sink_input_list(self) -> List[pulsectl.PulseSinkInputInfo]:
+        return self._list("list-sink-inputs", listing_parser.SINK_INPUT)
+
+    def source_output_list(self) -> List[pulsectl.PulseSourceOutputInfo]:
+        return self._list("list-source-outputs", listing_parser.SOURCE_OUTPUT)
+
+    def module_load(self, name: str, args: str = "") -> int:
+        self._run_quiet("load-module {} {}".format(name, args).strip())
+        # pacmd does not print the index of the new module, but indices only grow, so it is the highest one with
+        # that name.
+        indices = [module.index for module in self.module_list() if module.name == name]
+        if not indices:
+            raise pulsectl.PulseOperationFailed("{} was loaded but is not listed.".format(name))
+        return max(indices)
+
+    def module_unload(self, index: int):
+        self._run_quiet("unload-module {}".format(index))
+
+    def server_info(self) -> pulsectl.PulseServerInfo:
+        fields = {}
+        for line in self._run("stat"):
+            name, separator, value = line.partition(": ")
+            if separator:
+                fields[name.strip()] = value.strip()
+        return make_info(pulsectl.PulseServerInfo, default_sink_name=fields.get("Default sink name"),
+                         default_source_name=fields.get("Default source name"))
+
+    def sink_input_move(self, obj_index: int, sink_index: int):
+        self._run_quiet("move-sink-input {} {}".format(obj_index, sink_index))
+
+    def source_output_move(self, obj_index: int, source_index: int):
+        self._run_quiet("move-source-output {} {}".format(obj_index, source_index))
+
+    def event_mask_set(self, *masks):
+        raise pulsectl.PulseError("pacmd cannot subscribe to events.")
+
+    def event_callback_set(self, function: Optional[Callable]):
+        raise pulsectl.PulseError("pacmd cannot subscribe to events.")
+
+    def event_listen(self, timeout: float = None, raise_on_disconnect: bool = True):
+        raise pulsectl.PulseError("pacmd cannot subscribe to events.")
+
+    def event_listen_stop(self):
+        # Nothing can be listening.
+        pass
+
+
+def select_backend(name: str):
+    """
+    Chooses the backend connect() uses from now on.
+    :param name: One of BACKEND_NAMES.
+    :return:
+    """
+    global _selected_backend
+    if name not in BACKEND_NAMES:
+        raise ValueError("Unknown backend {!r}, expected one of: {}.".format(name, ", ".join(BACKEND_NAMES)))
+    _selected_backend = name
+    logger.debug("Using the {} backend.".format(name))
+
+
+def connect(client_name: str = "pulseaudio-loopback-tool"):
+    """
+    Opens a connection with the selected backend.
+    :param client_name: Name the connection is shown with on the server.
+    :return: pulsectl.Pulse or an object with the same interface.
+    :raises pulsectl.PulseError: The server cannot be reached.
+    """
+    if _selected_backend == PACTL:
+        return PactlBackend(client_name)
+    if _selected_backend == PACMD:
+        return PacmdBackend(client_name)
+    if _selected_backend == FAKE:
+        global _fake_server
+        import fake_pulse
+        # Connections share one server, so its state survives reconnects like a real server's would.
+        if _fake_server is None:
+            _fake_server = fake_pulse.FakePulse.with_graph(FAKE_OBJECT_COUNT)
+        _fake_server.connected = True
+        return _fake_server
+    return pulsectl.Pulse(client_name)
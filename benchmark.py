@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Times the listing, parsing, search and listbox paths against fake servers of growing size. No baseline is shipped, as
+timings only compare on the machine that made them: store one with --save-baseline, and later runs report the cases
+that got slower than it. benchmark_baseline.json can be committed wherever the benchmark always runs on the same
+machine, such as a dedicated CI runner.
+
+    python benchmark.py --save-baseline  Run and store the results as the baseline, benchmark_baseline.json.
+    python benchmark.py                  Run and report regressions against the baseline, if one was stored.
+
+The listbox cases need a display; run under xvfb-run to include them, otherwise they are skipped.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+import fake_pulse
+import program_logic
+import search_index
+
+SIZES = [10, 100, 1000, 10000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# Best-of-N timing is used, and a case only counts as a regression once it is this much slower than the baseline.
+DEFAULT_THRESHOLD = 0.25
+
+
+def _best_time(function: Callable, repeat: int) -> float:
+    """
+    :return: Fastest of repeat runs of function, in seconds.
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def _repeat_for(size: int) -> int:
+    return max(3, 2000 // size)
+
+
+def _cold_module_list(pulseaudio: fake_pulse.FakePulse) -> List[Dict]:
+    program_logic.prune_module_cache([])
+    return program_logic.get_module_list(pulseaudio)
+
+
+def _module_to_dict_all(pulseaudio: fake_pulse.FakePulse) -> List[Dict]:
+    return [program_logic._module_to_dict(module) for module in pulseaudio.module_list()]
+
+
+def run_logic_cases(sizes: List[int]) -> Dict[str, float]:
+    results = {}
+    for size in sizes:
+        pulseaudio = fake_pulse.FakePulse.with_graph(size)
+        repeat = _repeat_for(size)
+        module_list = program_logic.get_module_list(pulseaudio)
+        index = search_index.SearchIndex()
+        index.update(module_list)
+        cases = {
+            "get_source_list": lambda: program_logic.get_source_list(pulseaudio),
+            "get_sink_list": lambda: program_logic.get_sink_list(pulseaudio),
+            "get_module_list_cold": lambda: _cold_module_list(pulseaudio),
+            "get_module_list_warm": lambda: program_logic.get_module_list(pulseaudio),
+            "_module_to_dict": lambda: _module_to_dict_all(pulseaudio),
+            "SearchIndex.build": lambda: search_index.SearchIndex().update(module_list),
+            "SearchIndex.update_unchanged": lambda: index.update(module_list),
+            "SearchIndex.search": lambda: index.search("virtual 1"),
+        }
+        for name, function in cases.items():
+            if name == "get_module_list_warm":
+                program_logic.get_module_list(pulseaudio)
+            results["{}[{}]".format(name, size)] = _best_time(function, repeat)
+    return results
+
+
+def run_listbox_cases(sizes: List[int]) -> Dict[str, float]:
+    import tkinter
+    from tkinter import ttk
+    import gui_logic
+
+    try:
+        window = tkinter.Tk()
+    except tkinter.TclError as error:
+        print("Skipping listbox cases, no display available: {}".format(error), file=sys.stderr)
+        return {}
+    gui_logic.setup_style(ttk.Style())
+
+    results = {}
+    try:
+        for size in sizes:
+            pulseaudio = fake_pulse.FakePulse.with_graph(size)
+            item_list = program_logic.get_module_list(pulseaudio)
+            changed_list = [dict(item, color="green") if item["id"] % 10 == 0 else item for item in item_list]
+            repeat = _repeat_for(size)
+
+            def populate():
+                source_sink_list = gui_logic.SourceSinkList(window, "Benchmark", lambda event: None)
+                source_sink_list.refresh(item_list)
+                window.update_idletasks()
+                source_sink_list.destroy()
+
+            source_sink_list = gui_logic.SourceSinkList(window, "Benchmark", lambda event: None)
+            source_sink_list.refresh(item_list)
+
+            def refresh_unchanged():
+                source_sink_list.refresh(list(item_list))
+
+            def refresh_ten_percent():
+                source_sink_list.refresh(changed_list)
+                source_sink_list.refresh(item_list)
+
+            results["SourceSinkList.populate[{}]".format(size)] = _best_time(populate, repeat)
+            results["SourceSinkList.refresh_unchanged[{}]".format(size)] = _best_time(refresh_unchanged, repeat)
+            results["SourceSinkList.refresh_10_percent[{}]".format(size)] = _best_time(refresh_ten_percent, repeat)
+            source_sink_list.destroy()
+    finally:
+        window.destroy()
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """
+    :return: Descriptions of the cases that are slower than the baseline by more than the threshold.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        baseline_seconds = baseline.get(name)
+        if baseline_seconds and seconds > baseline_seconds * (1 + threshold):
+            regressions.append("{}: {:.6f}s, baseline {:.6f}s ({:+.0%})".format(
+                name, seconds, baseline_seconds, seconds / baseline_seconds - 1))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark PALT against fake PulseAudio servers.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to compare with or write to")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown before a case counts as a regression, as a fraction")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Graph sizes to run")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the listbox cases")
+    args = parser.parse_args()
+
+    results = run_logic_cases(args.sizes)
+    if not args.no_gui:
+        results.update(run_listbox_cases(args.sizes))
+
+    for name, seconds in results.items():
+        print("{:<45} {:>12.6f}s".format(name, seconds))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True)
+        print("Baseline written to {}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, so nothing was compared. Run with --save-baseline to store these results as the "
+              "baseline for later runs on this machine.".format(args.baseline), file=sys.stderr)
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Headless subcommands. Every command prints a single JSON document to stdout, so the tool can be scripted without a
+display; log output goes to stderr and the log file instead. The modules behind a single command are imported by its
+handler, so the other commands start without them.
+"""
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+from typing import Dict, Tuple
+
+import pulsectl
+
+import backends
+import program_logic
+import unix_socket
+
+logger = logging.getLogger("Main")
+
+CLIENT_NAME = "pulseaudio-loopback-tool"
+
+
+def _list(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    listings = {
+        "sinks": program_logic.get_sink_list,
+        "sources": program_logic.get_source_list,
+        "modules": program_logic.get_module_list,
+        "sink-inputs": program_logic.get_sink_input_list,
+        "source-outputs": program_logic.get_source_output_list,
+    }
+    kinds = [args.kind] if args.kind else list(listings)
+    return {kind: listings[kind](pulseaudio) for kind in kinds}
+
+
+def _create_sink(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    return {"module": program_logic.create_virtual_sink(pulseaudio, args.sink_name)}
+
+
+def _loopback(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    options = program_logic.loopback_options(args.preset, **{
+        name: getattr(args, name) for name in program_logic.LoopbackOptions._fields})
+    return {"module": program_logic.create_loopback(pulseaudio, args.source, args.sink, options=options)}
+
+
+def _remap(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    return {"module": program_logic.create_remapped_source(pulseaudio, args.source_name, args.master)}
+
+
+def _remove(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    return {"removed": program_logic.delete_modules(pulseaudio, args.module_ids)}
+
+
+def _move(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    if args.kind == "sink-inputs":
+        move_function, move_all_function = program_logic.move_sink_inputs, program_logic.move_all_sink_inputs
+    else:
+        move_function, move_all_function = program_logic.move_source_outputs, program_logic.move_all_source_outputs
+
+    if args.from_device is not None:
+        return {"moved": move_all_function(pulseaudio, args.from_device, args.destination)}
+    return {"moved": move_function(pulseaudio, args.streams, args.destination)}
+
+
+def _apply(pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+    import topology
+    plan = topology.plan_topology(topology.load_topology(args.topology_file),
+                                  program_logic.get_module_list(pulseaudio))
+    loaded = topology.apply_plan(pulseaudio, plan)
+    return {"unloaded": [module["id"] for module in plan.unload], "loaded": loaded}
+
+
+def _supervise(args: argparse.Namespace) -> Dict:
+    import supervisor
+    import topology
+    daemon = supervisor.Supervisor(topology.load_topology(args.topology_file), CLIENT_NAME)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    return {"stopped": True}
+
+
+def _health(args: argparse.Namespace) -> Dict:
+    import loopback_health
+    monitor = loopback_health.HealthMonitor()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stop.set())
+    if args.duration is not None:
+        timer = threading.Timer(args.duration, stop.set)
+        timer.daemon = True
+        timer.start()
+    with backends.connect(CLIENT_NAME) as pulseaudio:
+        try:
+            monitor.run(pulseaudio, stop, args.interval)
+        except KeyboardInterrupt:
+            pass
+    return {"loopbacks": [health.summary() for health in monitor.routes.values()]}
+
+
+def _serve(args: argparse.Namespace) -> Dict:
+    import control_server
+    server = control_server.ControlServer(args.socket_path or control_server.default_socket_path(), COMMANDS,
+                                          CLIENT_NAME)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: server.stop())
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    return {"stopped": True}
+
+
+# Commands that manage their own connection for as long as they run.
+LONG_RUNNING_COMMANDS = {
+    "supervise": _supervise,
+    "health": _health,
+    "serve": _serve,
+}
+
+COMMANDS = {
+    "list": _list,
+    "create-sink": _create_sink,
+    "loopback": _loopback,
+    "remap": _remap,
+    "remove": _remove,
+    "move": _move,
+    "apply": _apply,
+}
+
+
+def _expected_errors() -> Tuple[type, ...]:
+    """
+    :return: The errors a command reports as its result rather than as a crash. Only evaluated once a command raised,
+    so topology is still only imported by the commands that use it.
+    """
+    import topology
+    return program_logic.ModuleError, topology.TopologyError, pulsectl.PulseError, unix_socket.SocketPathError
+
+
+def run_command(args: argparse.Namespace) -> int:
+    """
+    Runs a headless subcommand over one connection and prints its result as JSON.
+    :param args: Parsed arguments, with the subcommand in args.command.
+    :return: Exit code for the process.
+    """
+    try:
+        if args.command in LONG_RUNNING_COMMANDS:
+            result = LONG_RUNNING_COMMANDS[args.command](args)
+        else:
+            with backends.connect(CLIENT_NAME) as pulseaudio:
+                result = COMMANDS[args.command](pulseaudio, args)
+    except _expected_errors() as error:
+        logger.error("{} failed: {}".format(args.command, error))
+        response = {"error": str(error)}
+        if isinstance(error, program_logic.ModuleBatchError):
+            # The rest of the batch was still carried out.
+            response["completed"] = error.completed
+            response["failures"] = [str(failure) for failure in error.failures]
+        json.dump(response, sys.stdout)
+        sys.stdout.write("\n")
+        return 1
+
+    json.dump(result, sys.stdout)
+    sys.stdout.write("\n")
+    return 0
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+import pulsectl
+
+import backends
+
+logger = logging.getLogger("Main")
+
+RECONNECT_INITIAL_DELAY = 0.01
+RECONNECT_MAX_DELAY = 2.0
+
+
+class ConnectionManager:
+    """
+    Keeps a pulsectl connection alive across server restarts.
+    run() connects, hands the connection to a serving function and, when the connection is lost, reconnects with
+    exponential backoff. on_connect is called after every (re)connect, which is where cached state gets resynced.
+    """
+    def __init__(self, client_name: str, pulse_factory: Callable[[str], pulsectl.Pulse] = backends.connect):
+        self.client_name = client_name
+        self.pulse_factory = pulse_factory
+        self.pulseaudio: Optional[pulsectl.Pulse] = None
+
+        self.on_connect: Optional[Callable[[pulsectl.Pulse], None]] = None
+        self.on_disconnect: Optional[Callable[[], None]] = None
+
+        self._stopped = threading.Event()
+        # Guards self.pulseaudio so wake() never touches a connection that is being closed.
+        self._lock = threading.Lock()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self):
+        self._stopped.set()
+        self.wake()
+
+    def wake(self):
+        """
+        Interrupts an event_listen() on the current connection. Safe to call from any thread.
+        :return:
+        """
+        with self._lock:
+            if self.pulseaudio is not None:
+                self.pulseaudio.event_listen_stop()
+
+    def run(self, serve: Callable[[pulsectl.Pulse], None]):
+        """
+        Serves connections until stop() is called.
+        :param serve: Called with each new connection. It should return once stopped and raise PulseError or
+        PulseDisconnected when the connection is lost.
+        :return:
+        """
+        delay = RECONNECT_INITIAL_DELAY
+        disconnected_at: Optional[float] = None
+        while not self.stopped:
+            try:
+                pulseaudio = self.pulse_factory(self.client_name)
+            except pulsectl.PulseError as error:
+                logger.debug("Connecting to the PulseAudio server failed, retrying in {:.0f} ms: {}".format(
+                    delay * 1000, error))
+                self._stopped.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            delay = RECONNECT_INITIAL_DELAY
+            try:
+                with self._lock:
+                    self.pulseaudio = pulseaudio
+                if self.on_connect is not None:
+                    self.on_connect(pulseaudio)
+                if disconnected_at is not None:
+                    logger.info("Reconnected to the PulseAudio server after {:.0f} ms.".format(
+                        (time.monotonic() - disconnected_at) * 1000))
+                serve(pulseaudio)
+            except (pulsectl.PulseError, pulsectl.PulseDisconnected) as error:
+                logger.warning("Lost the connection to the PulseAudio server: {!r}".format(error))
+            finally:
+                with self._lock:
+                    self.pulseaudio = None
+                pulseaudio.close()
+
+            if not self.stopped:
+                disconnected_at = time.monotonic()
+                if self.on_disconnect is not None:
+                    self.on_disconnect()
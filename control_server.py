@@ -0,0 +1,293 @@
+"""
+Control socket for scripts that change routing while the tool runs headless.
+Clients connect to a Unix domain socket and send one JSON object per line, for example
+{"id": 1, "command": "move", "kind": "sink-inputs", "destination": "3", "from_device": "1"}, and get one JSON object
+per line back, {"id": 1, "result": {...}} or {"id": 1, "error": "..."}. The commands and their arguments are those of
+the headless subcommands. Every client shares one PulseWorker, so there is a single long-lived connection to the
+server, and listings are answered from its state store without asking the server at all.
+Requests run one at a time in the order they arrive; answers to one client come back in the order it asked.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import selectors
+import socket
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pulsectl
+
+import program_logic
+import pulse_worker
+import state_store
+import unix_socket
+
+logger = logging.getLogger("Main")
+
+SOCKET_NAME = "pulseaudio-loopback-tool.sock"
+READ_SIZE = 65536
+# Longest request line accepted. A client sending more without a newline is disconnected.
+MAX_LINE_LENGTH = 1 << 20
+
+# Required arguments, and optional arguments with their defaults, of each command. They match the subcommands of
+# start.py, so the command functions of cli can be reused.
+COMMAND_ARGUMENTS: Dict[str, Tuple[List[str], Dict]] = {
+    "list": ([], {"kind": None}),
+    "create-sink": (["sink_name"], {}),
+    "loopback": (["source", "sink"], dict({"preset": program_logic.DEFAULT_LOOPBACK_PRESET},
+                                          **{name: None for name in program_logic.LoopbackOptions._fields})),
+    "remap": (["source_name", "master"], {}),
+    "remove": (["module_ids"], {}),
+    "move": (["kind", "destination"], {"from_device": None, "streams": None}),
+    "apply": (["topology_file"], {}),
+}
+
+
+class ControlError(Exception):
+    """
+    Raised for a request that is not valid JSON, names an unknown command or has wrong arguments.
+    """
+
+
+def default_socket_path() -> str:
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp", SOCKET_NAME)
+
+
+def decode_request(line: bytes) -> Dict:
+    """
+    :param line: One request line, without the newline.
+    :return: The request object.
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as error:
+        raise ControlError("Request is not valid JSON: {}".format(error)) from error
+    if not isinstance(request, dict):
+        raise ControlError("Request is not a JSON object.")
+    return request
+
+
+def parse_request(request: Dict) -> Tuple[str, argparse.Namespace]:
+    """
+    :param request: Request object without its id.
+    :return: The command and its arguments.
+    """
+    request = dict(request)
+    command = request.pop("command", None)
+    if command not in COMMAND_ARGUMENTS:
+        raise ControlError("Unknown command {!r}, expected one of: {}.".format(
+            command, ", ".join(sorted(COMMAND_ARGUMENTS))))
+
+    required, optional = COMMAND_ARGUMENTS[command]
+    missing = [name for name in required if name not in request]
+    unknown = [name for name in request if name not in required and name not in optional]
+    if missing or unknown:
+        raise ControlError("{} needs {} and accepts {}; missing: {}, unknown: {}.".format(
+            command, ", ".join(required) or "nothing", ", ".join(optional) or "nothing else",
+            ", ".join(missing) or "none", ", ".join(unknown) or "none"))
+    if command == "move" and (request.get("from_device") is None) == (request.get("streams") is None):
+        raise ControlError("move needs exactly one of from_device and streams.")
+    return command, argparse.Namespace(**dict(optional, **request))
+
+
+class _Client:
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.input = bytearray()
+        self.output = bytearray()
+        self.closed = False
+
+
+class ControlServer:
+    """
+    Serves the control socket from a single thread with a selector; the PulseWorker wakes it through a pipe whenever
+    a result is ready, so no request waits for a polling interval.
+    """
+    def __init__(self, socket_path: str, commands: Dict[str, Callable], client_name: str):
+        """
+        :param socket_path: Path of the socket to create. A stale socket at this path is replaced, anything else
+        there makes run() raise unix_socket.SocketPathError.
+        :param commands: Functions taking the connection and the parsed arguments, by command name. list is always
+        answered from the state store instead.
+        :param client_name: Name of the connection to the server.
+        """
+        self.socket_path = socket_path
+        self.store = state_store.StateStore()
+        self.worker = pulse_worker.PulseWorker(self.store, client_name)
+        self.worker.on_results_ready = self._wake
+        self.commands = dict(commands, list=self._list)
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_reader, self._wake_writer = os.pipe()
+        os.set_blocking(self._wake_reader, False)
+        os.set_blocking(self._wake_writer, False)
+        self._listener: Optional[socket.socket] = None
+        self._clients: List[_Client] = []
+        self._stopped = False
+
+    def stop(self):
+        """
+        Makes run() return. Safe to call from any thread and from signal handlers.
+        :return:
+        """
+        self._stopped = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_writer, b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the serving thread is going to wake up anyway.
+            pass
+
+    def run(self):
+        """
+        Serves clients until stop() is called.
+        :return:
+        """
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            unix_socket.remove_stale_socket(self.socket_path)
+            # Anyone who can connect can load and unload modules, so only the owner may.
+            unix_socket.bind_private(self._listener, self.socket_path)
+        except OSError:
+            self._selector.close()
+            self._listener.close()
+            os.close(self._wake_reader)
+            os.close(self._wake_writer)
+            raise
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ, self._accept)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ, self._on_wake)
+        self.worker.start()
+        logger.info("Listening for commands on {}.".format(self.socket_path))
+
+        try:
+            while not self._stopped:
+                for key, events in self._selector.select():
+                    key.data(key.fileobj, events)
+        finally:
+            self.worker.stop()
+            self.worker.join(timeout=1)
+            for client in list(self._clients):
+                self._close(client)
+            self._selector.close()
+            self._listener.close()
+            os.close(self._wake_reader)
+            os.close(self._wake_writer)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _accept(self, listener: socket.socket, events: int):
+        connection, address = listener.accept()
+        connection.setblocking(False)
+        client = _Client(connection)
+        self._clients.append(client)
+        self._selector.register(connection, selectors.EVENT_READ, functools.partial(self._on_client_ready, client))
+
+    def _on_wake(self, reader: int, events: int):
+        try:
+            while os.read(reader, READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        self.worker.dispatch_results()
+
+    def _on_client_ready(self, client: _Client, connection: socket.socket, events: int):
+        # A client closed earlier in the same round of events may still be listed in it.
+        if client.closed:
+            return
+        if events & selectors.EVENT_WRITE:
+            self._flush(client)
+        if events & selectors.EVENT_READ and not client.closed:
+            self._read(client)
+
+    def _read(self, client: _Client):
+        try:
+            data = client.connection.recv(READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)
+            return
+
+        client.input += data
+        *lines, rest = client.input.split(b"\n")
+        client.input = bytearray(rest)
+        for line in lines:
+            if line.strip():
+                self._handle_line(client, bytes(line))
+        if len(client.input) > MAX_LINE_LENGTH:
+            self._send(client, {"error": "Request longer than {} bytes.".format(MAX_LINE_LENGTH)})
+            self._close(client)
+
+    def _handle_line(self, client: _Client, line: bytes):
+        request_id = None
+        try:
+            request = decode_request(line)
+            request_id = request.pop("id", None)
+            command, args = parse_request(request)
+        except ControlError as error:
+            self._send(client, {"id": request_id, "error": str(error)})
+            return
+
+        self.worker.submit(self.commands[command], args, action="control_{}".format(command),
+                           on_success=lambda result: self._send(client, {"id": request_id, "result": result}),
+                           on_error=lambda error: self._send_error(client, request_id, command, error))
+
+    def _send_error(self, client: _Client, request_id, command: str, error: Exception):
+        response = {"id": request_id, "error": str(error)}
+        if isinstance(error, program_logic.ModuleBatchError):
+            response["completed"] = error.completed
+            response["failures"] = [str(failure) for failure in error.failures]
+        if not isinstance(error, (program_logic.ModuleError, ControlError, pulsectl.PulseError)):
+            logger.error("{} failed unexpectedly: {!r}".format(command, error))
+        self._send(client, response)
+
+    def _send(self, client: _Client, response: Dict):
+        if client.closed:
+            return
+        client.output += json.dumps(response).encode("utf-8") + b"\n"
+        self._flush(client)
+
+    def _flush(self, client: _Client):
+        try:
+            sent = client.connection.send(client.output)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(client)
+            return
+        del client.output[:sent]
+        # Wait for the socket to drain only while there is something left to write.
+        key = self._selector.get_key(client.connection)
+        self._selector.modify(client.connection,
+                              selectors.EVENT_READ | (selectors.EVENT_WRITE if client.output else 0), key.data)
+
+    def _close(self, client: _Client):
+        if client.closed:
+            return
+        client.closed = True
+        self._clients.remove(client)
+        self._selector.unregister(client.connection)
+        client.connection.close()
+
+    def _list(self, pulseaudio: pulsectl.Pulse, args: argparse.Namespace) -> Dict:
+        """
+        Answers a listing from the state store. Runs on the worker thread, which owns the store.
+        """
+        listings = {
+            "sinks": self.store.get_sink_list,
+            "sources": self.store.get_source_list,
+            "modules": self.store.get_module_list,
+            "sink-inputs": self.store.get_sink_input_list,
+            "source-outputs": self.store.get_source_output_list,
+        }
+        if args.kind is not None and args.kind not in listings:
+            raise ControlError("Unknown kind {!r}, expected one of: {}.".format(args.kind, ", ".join(listings)))
+        kinds = [args.kind] if args.kind else list(listings)
+        return {kind: listings[kind]() for kind in kinds}
@@ -0,0 +1,252 @@
+"""
+In-memory stand-in for pulsectl.Pulse, used to benchmark the program without a PulseAudio server.
+It returns real pulsectl info objects and simulates what the modules used by this program do: a null sink creates a
+sink and its monitor source, a remapped source creates a source, a loopback creates a sink input and a source output,
+and unloading a module removes what it created.
+"""
+import random
+import threading
+from typing import Callable, Dict, List, Optional
+
+import pulsectl
+
+import backends
+import program_logic
+
+DRIVERS = ["module-alsa-card.c", "module-bluez5-device.c", "module-null-sink.c", "module-remap-source.c"]
+STATES = ["running", "idle", "suspended"]
+RATES = [44100, 48000]
+# Rate PulseAudio gives a device when none is requested (default-sample-rate).
+DEFAULT_RATE = 44100
+SAMPLE_FORMAT_S16LE = 3
+
+
+_info = backends.make_info
+
+
+def _sample_spec(rate: int) -> backends.SampleSpec:
+    return backends.SampleSpec(format=SAMPLE_FORMAT_S16LE, rate=rate, channels=2)
+
+
+class FakePulse(backends.Backend):
+    """
+    Offers the subset of the pulsectl.Pulse interface that this program uses.
+    """
+    def __init__(self, client_name: str = None):
+        self.client_name = client_name
+        self.connected = True
+        self.sinks: Dict[int, pulsectl.PulseSinkInfo] = {}
+        self.sources: Dict[int, pulsectl.PulseSourceInfo] = {}
+        self.modules: Dict[int, pulsectl.PulseModuleInfo] = {}
+        self.sink_inputs: Dict[int, pulsectl.PulseSinkInputInfo] = {}
+        self.source_outputs: Dict[int, pulsectl.PulseSourceOutputInfo] = {}
+        self.event_callback: Optional[Callable] = None
+        self._event_facilities: List[str] = []
+        self._queued_events: List[pulsectl.PulseEventInfo] = []
+        self._next_index = {"sink": 0, "source": 0, "module": 0, "sink_input": 0, "source_output": 0}
+        self._listen_stopped = threading.Event()
+
+    @classmethod
+    def with_graph(cls, object_count: int, seed: int = 0) -> "FakePulse":
+        """
+        Builds a server with object_count hardware sinks, object_count hardware sources and object_count modules of
+        the kinds this program lists, with realistic names and argument strings.
+        :param object_count:
+        :param seed: Seed for the random choices, so graphs of the same size are identical.
+        :return:
+        """
+        generator = random.Random(seed)
+        pulseaudio = cls()
+        for number in range(object_count):
+            name = "alsa_output.pci-0000_{:02x}_1f.{}.analog-stereo".format(number // 8, number % 8)
+            pulseaudio._add_sink(name, "Built-in Audio Analog Stereo #{}".format(number), None,
+                                 generator.choice(DRIVERS[:2]), generator.choice(STATES), generator.choice(RATES))
+            pulseaudio._add_source(name.replace("output", "input"), "Microphone #{}".format(number), None,
+                                   generator.choice(DRIVERS[:2]), generator.choice(STATES), generator.choice(RATES))
+
+        for number in range(object_count):
+            kind = number % 3
+            if kind == 0:
+                pulseaudio.module_load("module-null-sink", program_logic.format_module_arguments({
+                    "sink_name": "Virtual_{}".format(number),
+                    "sink_properties": "device.description='Virtual Sink {}'".format(number),
+                    "rate": 48000,
+                }))
+            elif kind == 1:
+                pulseaudio.module_load("module-remap-source", program_logic.format_module_arguments({
+                    "master": generator.choice(list(pulseaudio.sources.values())).name,
+                    "source_name": "Remap_{}".format(number),
+                    "source_properties": "device.description=Remap_{}".format(number),
+                }))
+            else:
+                pulseaudio.module_load("module-loopback", program_logic.format_module_arguments({
+                    "source": generator.choice(list(pulseaudio.sources.values())).name,
+                    "sink": generator.choice(list(pulseaudio.sinks.values())).name,
+                    "latency_msec": 1,
+                    "sink_input_properties": "media.name='Loopback {}'".format(number),
+                }))
+        pulseaudio._queued_events.clear()
+        return pulseaudio
+
+    def _take_index(self, facility: str) -> int:
+        index = self._next_index[facility]
+        self._next_index[facility] += 1
+        return index
+
+    def _queue_event(self, event_type: str, facility: str, index: int):
+        if facility in self._event_facilities:
+            self._queued_events.append(pulsectl.PulseEventInfo(
+                pulsectl.PulseEventTypeEnum[event_type], pulsectl.PulseEventFacilityEnum[facility], index))
+
+    def _add_sink(self, name: str, description: str, owner_module: Optional[int], driver: str,
+                  state: str = "suspended", rate: int = DEFAULT_RATE) -> pulsectl.PulseSinkInfo:
+        index = self._take_index("sink")
+        monitor = self._add_source(name + ".monitor", "Monitor of " + description, owner_module, driver, state, rate)
+        sink = _info(pulsectl.PulseSinkInfo, index=index, name=name, description=description,
+                     owner_module=owner_module, driver=driver, state=state, sample_spec=_sample_spec(rate),
+                     monitor_source=monitor.index, monitor_source_name=monitor.name)
+        sink.channel_list = ["front-left", "front-right"]
+        monitor.monitor_of_sink, monitor.monitor_of_sink_name = index, name
+        self.sinks[index] = sink
+        self._queue_event("new", "sink", index)
+        return sink
+
+    def _add_source(self, name: str, description: str, owner_module: Optional[int], driver: str,
+                    state: str = "suspended", rate: int = DEFAULT_RATE) -> pulsectl.PulseSourceInfo:
+        index = self._take_index("source")
+        source = _info(pulsectl.PulseSourceInfo, index=index, name=name, description=description,
+                       owner_module=owner_module, driver=driver, state=state, sample_spec=_sample_spec(rate))
+        source.channel_list = ["front-left", "front-right"]
+        self.sources[index] = source
+        self._queue_event("new", "source", index)
+        return source
+
+    def _add_stream(self, facility: str, info_class, device_field: str, device: Optional[int], name: str,
+                    owner_module: Optional[int]):
+        index = self._take_index(facility)
+        stream = _info(info_class, index=index, name=name, owner_module=owner_module, corked=False,
+                       driver="module-loopback.c", sample_spec=_sample_spec(DEFAULT_RATE), buffer_usec=0,
+                       **{device_field: device, device_field + "_usec": 0})
+        stream.proplist = {"application.name": "PulseAudio Loopback", "media.name": name}
+        getattr(self, facility + "s")[index] = stream
+        self._queue_event("new", facility, index)
+        return stream
+
+    def _find_device(self, table: Dict, name: Optional[str]) -> Optional[int]:
+        for index, device in table.items():
+            if device.name == name or str(index) == name:
+                return index
+        return next(iter(table), None)
+
+    def sink_list(self) -> List[pulsectl.PulseSinkInfo]:
+        return list(self.sinks.values())
+
+    def source_list(self) -> List[pulsectl.PulseSourceInfo]:
+        return list(self.sources.values())
+
+    def module_list(self) -> List[pulsectl.PulseModuleInfo]:
+        return list(self.modules.values())
+
+    def sink_input_list(self) -> List[pulsectl.PulseSinkInputInfo]:
+        return list(self.sink_inputs.values())
+
+    def source_output_list(self) -> List[pulsectl.PulseSourceOutputInfo]:
+        return list(self.source_outputs.values())
+
+    @staticmethod
+    def _get(table: Dict, index: int):
+        if index not in table:
+            raise pulsectl.PulseIndexError(index)
+        return table[index]
+
+    def server_info(self) -> pulsectl.PulseServerInfo:
+        return _info(pulsectl.PulseServerInfo, server_name="fake", default_sink_name=next(
+            (sink.name for sink in self.sinks.values()), None), default_source_name=next(
+            (source.name for source in self.sources.values()), None))
+
+    def sink_info(self, index: int) -> pulsectl.PulseSinkInfo:
+        return self._get(self.sinks, index)
+
+    def source_info(self, index: int) -> pulsectl.PulseSourceInfo:
+        return self._get(self.sources, index)
+
+    def module_info(self, index: int) -> pulsectl.PulseModuleInfo:
+        return self._get(self.modules, index)
+
+    def sink_input_info(self, index: int) -> pulsectl.PulseSinkInputInfo:
+        return self._get(self.sink_inputs, index)
+
+    def source_output_info(self, index: int) -> pulsectl.PulseSourceOutputInfo:
+        return self._get(self.source_outputs, index)
+
+    def _move(self, facility: str, streams: Dict, devices: Dict, device_field: str, index: int, device_index: int):
+        if index not in streams or device_index not in devices:
+            raise pulsectl.PulseOperationFailed(index)
+        setattr(streams[index], device_field, device_index)
+        self._queue_event("change", facility, index)
+
+    def sink_input_move(self, obj_index: int, sink_index: int):
+        self._move("sink_input", self.sink_inputs, self.sinks, "sink", obj_index, sink_index)
+
+    def source_output_move(self, obj_index: int, source_index: int):
+        self._move("source_output", self.source_outputs, self.sources, "source", obj_index, source_index)
+
+    def module_load(self, name: str, args: str = "") -> int:
+        arguments = program_logic.parse_module_arguments(args)
+        index = self._take_index("module")
+        self.modules[index] = _info(pulsectl.PulseModuleInfo, index=index, name=name, argument=args, n_used=-1)
+        self._queue_event("new", "module", index)
+
+        if name == "module-null-sink":
+            sink_name = arguments.get("sink_name", "null")
+            self._add_sink(sink_name, sink_name, index, "module-null-sink.c",
+                           rate=int(arguments.get("rate", DEFAULT_RATE)))
+        elif name in ("module-remap-source", "module-null-source"):
+            source_name = arguments.get("source_name", "remapped")
+            master = self.sources.get(self._find_device(self.sources, arguments.get("master")))
+            self._add_source(source_name, source_name, index, name + ".c",
+                             rate=master.sample_spec.rate if master is not None else DEFAULT_RATE)
+        elif name == "module-loopback":
+            stream_name = "Loopback {}".format(index)
+            self._add_stream("sink_input", pulsectl.PulseSinkInputInfo, "sink",
+                             self._find_device(self.sinks, arguments.get("sink")), stream_name, index)
+            self._add_stream("source_output", pulsectl.PulseSourceOutputInfo, "source",
+                             self._find_device(self.sources, arguments.get("source")), stream_name, index)
+        return index
+
+    def module_unload(self, index: int):
+        if index not in self.modules:
+            raise pulsectl.PulseOperationFailed(index)
+        del self.modules[index]
+        self._queue_event("remove", "module", index)
+
+        for facility, table in (("sink", self.sinks), ("source", self.sources), ("sink_input", self.sink_inputs),
+                                ("source_output", self.source_outputs)):
+            for owned_index in [i for i, device in table.items() if device.owner_module == index]:
+                del table[owned_index]
+                self._queue_event("remove", facility, owned_index)
+
+    def event_mask_set(self, *masks):
+        self._event_facilities = list(self._next_index) if "all" in masks else list(masks)
+
+    def event_callback_set(self, function: Optional[Callable]):
+        self.event_callback = function
+
+    def event_listen(self, timeout: float = None, raise_on_disconnect: bool = True):
+        """
+        Delivers every queued event at once. Nothing else changes the server, so without queued events this only
+        waits for the timeout or event_listen_stop(), like a real server with nothing to report.
+        """
+        if raise_on_disconnect and not self.connected:
+            raise pulsectl.PulseDisconnected()
+        if not self._queued_events:
+            self._listen_stopped.wait(timeout)
+        self._listen_stopped.clear()
+        while self._queued_events:
+            try:
+                self.event_callback(self._queued_events.pop(0))
+            except pulsectl.PulseLoopStop:
+                break
+
+    def event_listen_stop(self):
+        self._listen_stopped.set()
@@ -1,12 +1,18 @@
 from tkinter import ttk
+import tkinter.font
 import traceback
 import logging
 import tkinter
 import sys
+import re
 
-import pulsectl
-
+import level_meter
+import metrics
+import profiling
 import program_logic
+import pulse_worker
+import search_index
+import state_store
 
 logger = logging.getLogger("Main")
 
@@ -22,35 +28,74 @@ def log_exception_handler(error_type, value, tb):
 
 sys.excepthook = log_exception_handler
 
+RESULT_POLL_INTERVAL_MS = 50
+LIST_BACKGROUND = "#323232"
+# Rows a list shows before its real height is known, and rows scrolled per mouse wheel notch.
+DEFAULT_PAGE_SIZE = 20
+WHEEL_ROWS = 3
+SHIFT_MASK = 0x0001
+CONTROL_MASK = 0x0004
+# Level meters are redrawn at most this often; their streams deliver new levels no faster anyway.
+METER_FRAME_MS = 1000 // level_meter.METER_BLOCK_RATE
+METER_BAR_HEIGHT = 6
+# Labels of the loopback option fields, by program_logic.LoopbackOptions field.
+LOOPBACK_OPTION_LABELS = {
+    "latency_msec": "Latency (ms)",
+    "max_latency_msec": "Max latency (ms)",
+    "adjust_time": "Adjust time (s)",
+    "resample_method": "Resample method",
+    "channels": "Channels",
+    "channel_map": "Channel map",
+}
+
 
 def run_gui():
-    with pulsectl.Pulse("pulseaudio-loopback-tool") as pulseaudio:
-        palt_gui = PaltGui(pulseaudio)
-        palt_gui.run_gui()
+    palt_gui = PaltGui()
+    palt_gui.run_gui()
 
 
 class PaltGui:
-    def __init__(self, pulseaudio: pulsectl.Pulse):
+    def __init__(self):
+        self.store = state_store.StateStore()
+        self.worker = pulse_worker.PulseWorker(self.store)
+        self.worker.on_state_change = self.refresh_tabs
+        self.lists = {
+            state_store.SINK: [],
+            state_store.SOURCE: [],
+            state_store.MODULE: [],
+            state_store.SINK_INPUT: [],
+            state_store.SOURCE_OUTPUT: [],
+        }
+
         self.window = tkinter.Tk()
         self.window_name = "PulseAudio Loopback Tool"
         self.global_refresh_button = ttk.Button(self.window, text="Refresh All", command=self.global_refresh)
+        self.status_label = ttk.Label(self.window, text="Connecting...")
         self.tab_controller = ttk.Notebook(self.window)
-        self.loopback_tab = LoopbackTab(self.tab_controller, self.global_refresh)
-        self.virtual_sink_tab = VirtualSinkTab(self.tab_controller, self.global_refresh)
-        self.remap_source_tab = RemapSourceTab(self.tab_controller, self.global_refresh)
-        self.delete_tab = DeleteModuleTab(self.tab_controller, self.global_refresh)
+        self.loopback_tab = LoopbackTab(self.tab_controller, self.worker)
+        self.virtual_sink_tab = VirtualSinkTab(self.tab_controller, self.worker)
+        self.remap_source_tab = RemapSourceTab(self.tab_controller, self.worker)
+        self.delete_tab = DeleteModuleTab(self.tab_controller, self.worker)
+        self.streams_tab = StreamsTab(self.tab_controller, self.worker)
         self.style = ttk.Style()
         setup_style(self.style)
 
-        self.pulseaudio = pulseaudio
-
         self._configure_window()
         self._configure_refresh_button()
+        self._configure_status_label()
         self._configure_tab_holder()
 
     def run_gui(self):
-        self.global_refresh()
-        self.window.mainloop()
+        self.worker.start()
+        self.window.after(RESULT_POLL_INTERVAL_MS, self._poll_results)
+        try:
+            self.window.mainloop()
+        finally:
+            for meter in (self.loopback_tab.source_meter, self.loopback_tab.sink_meter,
+                          self.remap_source_tab.source_meter):
+                meter.set_device(None)
+            self.worker.stop()
+            self.worker.join(timeout=1)
 
     def _configure_window(self):
         self.window.title(self.window_name)
@@ -62,39 +107,84 @@ class PaltGui:
     def _configure_refresh_button(self):
         self.global_refresh_button.grid(column=0, row=0)
 
+    def _configure_status_label(self):
+        self.status_label.grid(column=0, row=0, padx=5, sticky=tkinter.E)
+
     def _configure_tab_holder(self):
         self.tab_controller.grid(column=0, row=1, sticky=tkinter.NSEW)
         self.tab_controller.add(self.loopback_tab, text=self.loopback_tab.text_name)
         self.tab_controller.add(self.virtual_sink_tab, text=self.virtual_sink_tab.text_name)
         self.tab_controller.add(self.remap_source_tab, text=self.remap_source_tab.text_name)
         self.tab_controller.add(self.delete_tab, text=self.delete_tab.text_name)
+        self.tab_controller.add(self.streams_tab, text=self.streams_tab.text_name)
 
     def global_refresh(self):
         logger.info("Global refresh triggered.")
-        source_list = program_logic.get_source_list(self.pulseaudio)
-        sink_list = program_logic.get_sink_list(self.pulseaudio)
-        module_list = program_logic.get_module_list(self.pulseaudio)
-
-        self.loopback_tab.refresh(source_list, sink_list)
-        self.virtual_sink_tab.refresh(module_list)
-        self.remap_source_tab.refresh(source_list)
-        self.delete_tab.refresh(module_list)
+        self.worker.request_reload()
+
+    def _poll_results(self):
+        self.worker.dispatch_results()
+        self._update_status()
+        self.window.after(RESULT_POLL_INTERVAL_MS, self._poll_results)
+
+    def _update_status(self):
+        if not self.worker.connected:
+            text = "Connecting..."
+        elif self.worker.in_flight > 0:
+            text = "Working ({})...".format(self.worker.in_flight)
+        else:
+            text = "Idle"
+        if self.status_label.cget("text") != text:
+            self.status_label.configure(text=text)
+
+    def refresh_tabs(self, changed_kinds, snapshot):
+        """
+        Refreshes the tabs that display any of the given kinds of objects.
+        :param changed_kinds: Set of state_store kinds.
+        :param snapshot: The new lists of the changed kinds.
+        :return:
+        """
+        with metrics.REFRESH_SECONDS.time("tabs"), profiling.profile("refresh_tabs"):
+            self._refresh_tabs(changed_kinds, snapshot)
+
+    def _refresh_tabs(self, changed_kinds, snapshot):
+        self.lists.update(snapshot)
+        source_list = self.lists[state_store.SOURCE]
+        sink_list = self.lists[state_store.SINK]
+        module_list = self.lists[state_store.MODULE]
+
+        if state_store.SOURCE in changed_kinds or state_store.SINK in changed_kinds:
+            self.loopback_tab.refresh(source_list, sink_list)
+        if state_store.SOURCE in changed_kinds:
+            self.remap_source_tab.refresh(source_list)
+        if state_store.MODULE in changed_kinds:
+            self.virtual_sink_tab.refresh(module_list)
+            self.delete_tab.refresh(module_list)
+        if changed_kinds & {state_store.SINK, state_store.SOURCE, state_store.SINK_INPUT, state_store.SOURCE_OUTPUT}:
+            self.streams_tab.refresh(self.lists)
 
 
 class LoopbackTab(ttk.Frame):
-    def __init__(self, parent_notebook: ttk.Notebook, global_refresh_function, **kwargs):
+    def __init__(self, parent_notebook: ttk.Notebook, worker: pulse_worker.PulseWorker, **kwargs):
         super().__init__(parent_notebook, **kwargs)
         self.text_name = "Loopback"
-        self.global_refresh_function = global_refresh_function
+        self.worker = worker
 
-        self.source_list = SourceSinkList(self, "Source List", self._on_source_list_click)
+        self.source_list = SourceSinkList(self, "Source List", self._on_source_list_click, multi_select=True)
         self.source_label = ttk.Label(self, text="Source")
         self.source_entry = ttk.Entry(self, width=6)
         self.loopback_label = ttk.Label(self, text="will pipe sound to")
         self.loopback_button = ttk.Button(self, text="Create Loopback", command=self.create_loopback)
         self.sink_label = ttk.Label(self, text="Sink")
         self.sink_entry = ttk.Entry(self, width=6)
-        self.sink_list = SourceSinkList(self, "Sink List", self._on_sink_list_click)
+        self.sink_list = SourceSinkList(self, "Sink List", self._on_sink_list_click, multi_select=True)
+        self.source_meter = LevelMeter(self, "Source Level")
+        self.sink_meter = LevelMeter(self, "Sink Level")
+        self.preset_label = ttk.Label(self, text="Preset")
+        self.preset = tkinter.StringVar(self, value=program_logic.DEFAULT_LOOPBACK_PRESET)
+        self.preset_box = ttk.Combobox(self, textvariable=self.preset, values=list(program_logic.LOOPBACK_PRESETS),
+                                       state="readonly", width=12)
+        self.options_frame = LoopbackOptionsFrame(self, "Options (empty: module default)")
 
         self._configure_source_list()
         self._configure_source_label()
@@ -104,12 +194,29 @@ class LoopbackTab(ttk.Frame):
         self._configure_sink_label()
         self._configure_sink_entry()
         self._configure_sink_list()
+        self._configure_meters()
+        self._configure_options()
 
         self._configure_weights()
 
     def _configure_source_list(self):
         self.source_list.grid(column=0, row=0, rowspan=2, sticky=tkinter.NSEW)
 
+    def _configure_meters(self):
+        self.source_meter.grid(column=0, row=2, sticky=tkinter.EW)
+        self.sink_meter.grid(column=4, row=2, sticky=tkinter.EW)
+
+    def _configure_options(self):
+        self.preset_label.grid(column=1, row=2, padx=5, sticky=tkinter.E)
+        self.preset_box.grid(column=2, row=2, columnspan=2, padx=5, pady=5, sticky=tkinter.W)
+        self.preset_box.bind("<<ComboboxSelected>>", self._on_preset_change)
+        self.options_frame.grid(column=1, row=3, columnspan=3, padx=5, pady=5, sticky=tkinter.N)
+        self._on_preset_change(None)
+
+    def _on_preset_change(self, evt):
+        # The option fields start at the preset's values and may then be edited.
+        self.options_frame.set_options(program_logic.LOOPBACK_PRESETS[self.preset.get()])
+
     def _configure_source_label(self):
         self.source_label.grid(column=1, row=0, sticky=tkinter.S)
 
@@ -138,30 +245,41 @@ class LoopbackTab(ttk.Frame):
         self.rowconfigure(1, weight=1)
 
     def _on_source_list_click(self, evt):
-        selection = self.source_list.list_box.curselection()
-        if len(selection) > 0:
-            index = selection[0]
+        selected_items = self.source_list.get_selected_items()
+        if len(selected_items) > 0:
             self.source_entry.delete(0, tkinter.END)
-            self.source_entry.insert(0, self.source_list.given_item_list[index]["id"])
+            self.source_entry.insert(0, join_ids(item["id"] for item in selected_items))
+            self.source_meter.set_device(selected_items[0]["name"])
 
     def _on_sink_list_click(self, evt):
-        selection = self.sink_list.list_box.curselection()
-        if len(selection) > 0:
-            index = selection[0]
+        selected_items = self.sink_list.get_selected_items()
+        if len(selected_items) > 0:
             self.sink_entry.delete(0, tkinter.END)
-            self.sink_entry.insert(0, self.sink_list.given_item_list[index]["id"])
+            self.sink_entry.insert(0, join_ids(item["id"] for item in selected_items))
+            # A sink is metered through its monitor source.
+            self.sink_meter.set_device(selected_items[0]["name"] + ".monitor")
 
     def create_loopback(self):
-        source_id = self.source_entry.get()
-        sink_id = self.sink_entry.get()
-        value = program_logic.create_loopback(source_id, sink_id)
-        if value is not 0:
-            self.source_entry.delete(0, tkinter.END)
-            self.source_entry.insert(0, "ERR")
-            self.sink_entry.delete(0, tkinter.END)
-            self.sink_entry.insert(0, "ERR")
-        else:
-            self.global_refresh_function()
+        source_ids = split_ids(self.source_entry.get())
+        sink_ids = split_ids(self.sink_entry.get())
+        try:
+            options = program_logic.loopback_options(self.preset.get(), **self.options_frame.get_overrides())
+        except program_logic.LoopbackOptionsError as error:
+            logger.warning(str(error))
+            self.options_frame.mark_invalid(self.preset.get())
+            return
+        # Every source is looped to every sink in a single worker job.
+        self.worker.submit(program_logic.create_loopbacks, source_ids, sink_ids, options,
+                           on_error=self._on_create_error)
+
+    def _on_create_error(self, error):
+        # Loopbacks refused for closing a feedback loop are marked apart from plain failures.
+        failures = getattr(error, "failures", [error])
+        text = "LOOP" if any(isinstance(failure, program_logic.FeedbackLoopError) for failure in failures) else "ERR"
+        self.source_entry.delete(0, tkinter.END)
+        self.source_entry.insert(0, text)
+        self.sink_entry.delete(0, tkinter.END)
+        self.sink_entry.insert(0, text)
 
     def refresh(self, source_list, sink_list):
         self.source_list.refresh(source_list)
@@ -169,10 +287,10 @@ class LoopbackTab(ttk.Frame):
 
 
 class VirtualSinkTab(ttk.Frame):
-    def __init__(self, parent, global_refresh_function, **kwargs):
+    def __init__(self, parent, worker: pulse_worker.PulseWorker, **kwargs):
         super().__init__(parent, **kwargs)
         self.text_name = "Virtual Sinks"
-        self.global_refresh_function = global_refresh_function
+        self.worker = worker
 
         self.module_list = SourceSinkList(self, "Virtual Sinks", self._on_module_list_click)
         self.create_label = ttk.Label(self, text="Sink Name: ")
@@ -209,12 +327,11 @@ class VirtualSinkTab(ttk.Frame):
 
     def create_sink(self):
         sink_name = self.create_entry.get()
-        value = program_logic.create_virtual_sink(sink_name)
-        if value is not 0:
-            self.create_entry.delete(0, tkinter.END)
-            self.create_entry.insert(0, "ERR")
-        else:
-            self.global_refresh_function()
+        self.worker.submit(program_logic.create_virtual_sink, sink_name, on_error=self._on_create_error)
+
+    def _on_create_error(self, error):
+        self.create_entry.delete(0, tkinter.END)
+        self.create_entry.insert(0, "ERR")
 
     def refresh(self, module_list):
         specific_module_list = []
@@ -225,12 +342,13 @@ class VirtualSinkTab(ttk.Frame):
 
 
 class RemapSourceTab(ttk.Frame):
-    def __init__(self, parent, global_refresh_function, **kwargs):
+    def __init__(self, parent, worker: pulse_worker.PulseWorker, **kwargs):
         super().__init__(parent, **kwargs)
         self.text_name = "Remap Sources"
-        self.global_refresh_function = global_refresh_function
+        self.worker = worker
 
         self.source_list = SourceSinkList(self, "Sources", self._on_module_list_click)
+        self.source_meter = LevelMeter(self, "Source Level")
 
         self.remap_name_label = ttk.Label(self, text="Source Name: ")
         self.remap_name_entry = ttk.Entry(self, width=20)
@@ -246,11 +364,15 @@ class RemapSourceTab(ttk.Frame):
         self._configure_source_id_label()
         self._configure_source_id_entry()
         self._configure_create_button()
+        self._configure_source_meter()
         self._configure_weights()
 
     def _configure_module_list(self):
         self.source_list.grid(column=0, row=0, columnspan=3, sticky=tkinter.NSEW)
 
+    def _configure_source_meter(self):
+        self.source_meter.grid(column=0, row=3, columnspan=3, sticky=tkinter.EW)
+
     def _configure_remap_name_label(self):
         self.remap_name_label.grid(column=0, row=1, sticky=tkinter.E)
 
@@ -272,11 +394,11 @@ class RemapSourceTab(ttk.Frame):
         self.rowconfigure(0, weight=1)
 
     def _on_module_list_click(self, evt):
-        selection = self.source_list.list_box.curselection()
-        if len(selection) > 0:
-            index = selection[0]
+        selected_items = self.source_list.get_selected_items()
+        if len(selected_items) > 0:
             self.source_id_entry.delete(0, tkinter.END)
-            self.source_id_entry.insert(0, self.source_list.given_item_list[index]["id"])
+            self.source_id_entry.insert(0, selected_items[0]["id"])
+            self.source_meter.set_device(selected_items[0]["name"])
 
     def create_remapped_source(self):
         # sink_id = self.create_entry.get()
@@ -288,26 +410,26 @@ class RemapSourceTab(ttk.Frame):
         #     self.global_refresh_function()
         remap_name = self.remap_name_entry.get()
         source_id = self.source_id_entry.get()
-        value = program_logic.create_remapped_source(remap_name, source_id)
-        if value is not 0:
-            self.remap_name_entry.delete(0, tkinter.END)
-            self.remap_name_entry.insert(0, "ERR")
-            self.source_id_entry.delete(0, tkinter.END)
-            self.source_id_entry.insert(0, "ERR")
-        else:
-            self.global_refresh_function()
+        self.worker.submit(program_logic.create_remapped_source, remap_name, source_id,
+                           on_error=self._on_create_error)
+
+    def _on_create_error(self, error):
+        self.remap_name_entry.delete(0, tkinter.END)
+        self.remap_name_entry.insert(0, "ERR")
+        self.source_id_entry.delete(0, tkinter.END)
+        self.source_id_entry.insert(0, "ERR")
 
     def refresh(self, source_list):
         self.source_list.refresh(source_list)
 
 
 class DeleteModuleTab(ttk.Frame):
-    def __init__(self, parent, global_refresh_function, **kwargs):
+    def __init__(self, parent, worker: pulse_worker.PulseWorker, **kwargs):
         super().__init__(parent, **kwargs)
         self.text_name = "Remove"
-        self.global_refresh_function = global_refresh_function
+        self.worker = worker
 
-        self.module_list = SourceSinkList(self, "Relevant Modules", self._on_module_list_click)
+        self.module_list = SourceSinkList(self, "Relevant Modules", self._on_module_list_click, multi_select=True)
         self.delete_entry = ttk.Entry(self, width=6)
         self.delete_button = ttk.Button(self, text="Delete", command=self.delete_module)
 
@@ -332,67 +454,570 @@ class DeleteModuleTab(ttk.Frame):
         self.rowconfigure(0, weight=1)
 
     def _on_module_list_click(self, evt):
-        selection = self.module_list.list_box.curselection()
-        if len(selection) > 0:
-            index = selection[0]
+        selected_ids = self.module_list.get_selected_ids()
+        if len(selected_ids) > 0:
             self.delete_entry.delete(0, tkinter.END)
-            self.delete_entry.insert(0, self.module_list.given_item_list[index]["id"])
+            self.delete_entry.insert(0, join_ids(selected_ids))
 
     def delete_module(self):
-        module_id = self.delete_entry.get()
-        value = program_logic.delete_module(module_id)
-        if value is not 0:
-            self.delete_entry.delete(0, tkinter.END)
-            self.delete_entry.insert(0, "ERR")
-        else:
-            self.global_refresh_function()
+        module_ids = split_ids(self.delete_entry.get())
+        self.worker.submit(program_logic.delete_modules, module_ids, on_error=self._on_delete_error)
+
+    def _on_delete_error(self, error):
+        self.delete_entry.delete(0, tkinter.END)
+        self.delete_entry.insert(0, "ERR")
 
     def refresh(self, module_list):
         self.module_list.refresh(module_list)
 
 
+class StreamsTab(ttk.Frame):
+    # Per direction: stream kind, device kind, what the device is called, and the functions moving the streams.
+    DIRECTIONS = {
+        "Playback": (state_store.SINK_INPUT, state_store.SINK, "Sink",
+                     program_logic.move_sink_inputs, program_logic.move_all_sink_inputs),
+        "Recording": (state_store.SOURCE_OUTPUT, state_store.SOURCE, "Source",
+                      program_logic.move_source_outputs, program_logic.move_all_source_outputs),
+    }
+
+    def __init__(self, parent, worker: pulse_worker.PulseWorker, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.text_name = "Streams"
+        self.worker = worker
+        self.lists = {}
+
+        self.stream_list = SourceSinkList(self, "Streams", self._on_stream_list_click, multi_select=True)
+        self.direction = tkinter.StringVar(self, value="Playback")
+        self.direction_box = ttk.Combobox(self, textvariable=self.direction, values=list(self.DIRECTIONS),
+                                          state="readonly", width=10)
+        self.streams_label = ttk.Label(self, text="Streams")
+        self.streams_entry = ttk.Entry(self, width=6)
+        self.from_label = ttk.Label(self, text="From Sink")
+        self.from_entry = ttk.Entry(self, width=6)
+        self.to_label = ttk.Label(self, text="To Sink")
+        self.to_entry = ttk.Entry(self, width=6)
+        self.move_button = ttk.Button(self, text="Move", command=self.move_streams)
+        self.move_all_button = ttk.Button(self, text="Move All", command=self.move_all_streams)
+        self.device_list = SourceSinkList(self, "Sinks", self._on_device_list_click)
+
+        self._configure_stream_list()
+        self._configure_direction_box()
+        self._configure_entries()
+        self._configure_buttons()
+        self._configure_device_list()
+
+        self._configure_weights()
+
+    def _configure_stream_list(self):
+        self.stream_list.grid(column=0, row=0, rowspan=5, sticky=tkinter.NSEW)
+
+    def _configure_direction_box(self):
+        self.direction_box.grid(column=1, row=0, columnspan=2, padx=5, pady=5)
+        self.direction_box.bind("<<ComboboxSelected>>", self._on_direction_change)
+
+    def _configure_entries(self):
+        for row, (label, entry) in enumerate([(self.streams_label, self.streams_entry),
+                                              (self.from_label, self.from_entry),
+                                              (self.to_label, self.to_entry)], start=1):
+            label.grid(column=1, row=row, padx=5, sticky=tkinter.E)
+            entry.grid(column=2, row=row, padx=5, pady=5, sticky=tkinter.W)
+
+    def _configure_buttons(self):
+        self.move_button.grid(column=1, row=4, padx=5, pady=5, sticky=tkinter.N)
+        self.move_all_button.grid(column=2, row=4, padx=5, pady=5, sticky=tkinter.N)
+
+    def _configure_device_list(self):
+        self.device_list.grid(column=3, row=0, rowspan=5, sticky=tkinter.NSEW)
+
+    def _configure_weights(self):
+        self.columnconfigure(0, weight=1)
+        self.columnconfigure(3, weight=1)
+        self.rowconfigure(4, weight=1)
+
+    def _on_direction_change(self, evt):
+        device_name = self.DIRECTIONS[self.direction.get()][2]
+        self.from_label.configure(text="From " + device_name)
+        self.to_label.configure(text="To " + device_name)
+        self.device_list.configure(text=device_name + "s")
+        for entry in (self.streams_entry, self.from_entry, self.to_entry):
+            entry.delete(0, tkinter.END)
+        self._show_lists()
+
+    def _on_stream_list_click(self, evt):
+        selected_ids = self.stream_list.get_selected_ids()
+        if len(selected_ids) > 0:
+            self.streams_entry.delete(0, tkinter.END)
+            self.streams_entry.insert(0, join_ids(selected_ids))
+
+    def _on_device_list_click(self, evt):
+        selected_ids = self.device_list.get_selected_ids()
+        if len(selected_ids) > 0:
+            self.to_entry.delete(0, tkinter.END)
+            self.to_entry.insert(0, selected_ids[0])
+
+    def move_streams(self):
+        move_function = self.DIRECTIONS[self.direction.get()][3]
+        stream_ids = split_ids(self.streams_entry.get())
+        self.worker.submit(move_function, stream_ids, self.to_entry.get(), on_error=self._on_move_error)
+
+    def move_all_streams(self):
+        move_all_function = self.DIRECTIONS[self.direction.get()][4]
+        self.worker.submit(move_all_function, self.from_entry.get(), self.to_entry.get(),
+                           on_error=self._on_move_error)
+
+    def _on_move_error(self, error):
+        self.to_entry.delete(0, tkinter.END)
+        self.to_entry.insert(0, "ERR")
+
+    def _show_lists(self):
+        stream_kind, device_kind = self.DIRECTIONS[self.direction.get()][:2]
+        self.stream_list.refresh(self.lists.get(stream_kind, []))
+        self.device_list.refresh(self.lists.get(device_kind, []))
+
+    def refresh(self, lists):
+        """
+        :param lists: Current lists of every kind, keyed by state_store kind.
+        :return:
+        """
+        self.lists = lists
+        self._show_lists()
+
+
 class SourceSinkList(ttk.LabelFrame):
-    def __init__(self, parent, name, on_click_function, **kwargs):
+    """
+    Scrollable, filterable list of devices or modules that only renders the rows in view.
+    all_items holds every item and given_item_list the ones matching the filter box, but the Tcl listbox only ever
+    contains the rows that fit in the widget. Scrolling re-fills those rows from the list, and the selection is kept as
+    a set of ids, so memory use and refresh time do not grow with the number of items.
+    """
+    def __init__(self, parent, name, on_click_function, multi_select=False, **kwargs):
         super().__init__(parent, text=name, **kwargs)
 
+        self.all_items = []
+        self._row_of_id = {}
+        self.search_index = search_index.SearchIndex()
         self.given_item_list = []
+        self.selected_ids = set()
+        self.multi_select = multi_select
+        # Row of given_item_list shown at the top, and the number of rows that fit in the listbox.
+        self.first_row = 0
+        self.page_size = DEFAULT_PAGE_SIZE
+        # (id, nice_name, color) of every row currently in the listbox.
+        self._rendered_rows = []
+        # Rows of given_item_list the keyboard moves from, and extends a Shift selection from.
+        self.cursor_row = None
+        self.anchor_row = None
+        self.on_click_function = on_click_function
 
         self.list_box = tkinter.Listbox(self)
         self.vertical_scrollbar = ttk.Scrollbar(self, orient="vertical")
         self.horizontal_scrollbar = ttk.Scrollbar(self, orient="horizontal")
+        self.filter_text = tkinter.StringVar(self)
+        self.filter_entry = ttk.Entry(self, textvariable=self.filter_text)
 
-        self._configure_list_box(on_click_function)
+        self._configure_list_box(on_click_function, multi_select)
         self._configure_vertical_scrollbar(self.list_box)
         self._configure_horizontal_scrollbar(self.list_box)
+        self._configure_filter_entry()
 
         self._configure_weights()
 
-    def _configure_list_box(self, on_click_function):
+    def _configure_list_box(self, on_click_function, multi_select):
         self.list_box = tkinter.Listbox(self)
         self.list_box.grid(column=0, row=0, sticky=tkinter.NSEW)
+        self.list_box.bind("<ButtonPress-1>", self._on_press)
         self.list_box.bind("<ButtonRelease-1>", on_click_function)
-        self.list_box.configure(background="#323232", relief="flat", borderwidth=0, highlightthickness=0)
+        self.list_box.bind("<<ListboxSelect>>", self._on_select)
+        self.list_box.bind("<Configure>", self._on_resize)
+        self.list_box.bind("<MouseWheel>", self._on_mouse_wheel)
+        self.list_box.bind("<Button-4>", lambda event: self._scroll_by(-WHEEL_ROWS))
+        self.list_box.bind("<Button-5>", lambda event: self._scroll_by(WHEEL_ROWS))
+        # The listbox's own key bindings would stop at the last rendered row, so the keys move through the whole list.
+        # Tk also matches these with Shift held, which extends the selection.
+        self.list_box.bind("<Up>", lambda event: self._move_cursor(event, -1))
+        self.list_box.bind("<Down>", lambda event: self._move_cursor(event, 1))
+        self.list_box.bind("<Prior>", lambda event: self._move_cursor(event, -max(1, self.page_size - 1)))
+        self.list_box.bind("<Next>", lambda event: self._move_cursor(event, max(1, self.page_size - 1)))
+        self.list_box.bind("<Home>", lambda event: self._move_cursor(event, -len(self.given_item_list)))
+        self.list_box.bind("<End>", lambda event: self._move_cursor(event, len(self.given_item_list)))
+        # Selections live in selected_ids, so the listbox never has to give its selection up to another widget.
+        self.list_box.configure(background=LIST_BACKGROUND, relief="flat", borderwidth=0, highlightthickness=0,
+                                exportselection=False)
+        if multi_select:
+            self.list_box.configure(selectmode=tkinter.EXTENDED)
 
     def _configure_vertical_scrollbar(self, list_box):
-        self.vertical_scrollbar.config(command=list_box.yview)
+        # The scrollbar follows the whole item list rather than the rows in the listbox.
+        self.vertical_scrollbar.config(command=self._on_scrollbar)
         self.vertical_scrollbar.grid(column=1, row=0, sticky=tkinter.NS + tkinter.E)
-        list_box.config(yscrollcommand=self.vertical_scrollbar.set)
 
     def _configure_horizontal_scrollbar(self, list_box):
         self.horizontal_scrollbar.config(command=list_box.xview)
         self.horizontal_scrollbar.grid(column=0, row=1, sticky=tkinter.S + tkinter.EW)
         list_box.config(xscrollcommand=self.horizontal_scrollbar.set)
 
+    def _configure_filter_entry(self):
+        self.filter_entry.grid(column=0, row=2, columnspan=2, sticky=tkinter.EW)
+        self.filter_text.trace_add("write", self._on_filter_change)
+
     def _configure_weights(self):
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
+    def get_selected_ids(self):
+        """
+        :return: Ids of the selected items, in list order.
+        """
+        return [item["id"] for item in self.get_selected_items()]
+
+    def get_selected_items(self):
+        """
+        :return: The selected items, in list order.
+        """
+        if not self.selected_ids:
+            return []
+        return [item for item in self.given_item_list if item["id"] in self.selected_ids]
+
     def refresh(self, item_list):
-        self.list_box.delete(0, tkinter.END)
-        for i in range(len(item_list)):
-            self.list_box.insert(tkinter.END, item_list[i]["nice_name"])
-            self.list_box.itemconfig(i, {"bg": item_list[i]["color"]})
-        self.given_item_list = item_list
+        """
+        Replaces the items. Only the rows in view are touched, and only where they differ from what is shown.
+        The selection and the item at the top of the view are kept by id.
+        :param item_list: List of dictionaries with at least "id", "nice_name" and "color".
+        :return:
+        """
+        top_id, cursor_id, anchor_id = (self._id_at(row) for row in (self.first_row, self.cursor_row, self.anchor_row))
+        self.all_items = item_list
+        self._row_of_id = {item["id"]: row for row, item in enumerate(item_list)}
+        self.selected_ids.intersection_update(self._row_of_id)
+        self.search_index.update(item_list)
+
+        matching_ids = self.search_index.search(self.filter_text.get())
+        if matching_ids is None:
+            self.given_item_list = item_list
+            row_of_id = self._row_of_id
+        else:
+            self.given_item_list = self._matching_items(matching_ids)
+            row_of_id = {item["id"]: row for row, item in enumerate(self.given_item_list)}
+        if top_id in row_of_id:
+            self.first_row = row_of_id[top_id]
+        self.cursor_row = row_of_id.get(cursor_id)
+        self.anchor_row = row_of_id.get(anchor_id)
+        self._render(self._clamp(self.first_row))
+
+    def _id_at(self, row):
+        return self.given_item_list[row]["id"] if row is not None and row < len(self.given_item_list) else None
+
+    def _matching_items(self, matching_ids):
+        """
+        :return: Items with the given ids, in the order of all_items.
+        """
+        return [self.all_items[row] for row in sorted(self._row_of_id[item_id] for item_id in matching_ids)]
+
+    def _on_filter_change(self, *args):
+        matching_ids = self.search_index.search(self.filter_text.get())
+        self.given_item_list = self.all_items if matching_ids is None else self._matching_items(matching_ids)
+        self.cursor_row = self.anchor_row = None
+        self._render(0)
+
+    def scroll_to(self, row):
+        """
+        Scrolls so the given row of given_item_list is at the top, as far as the list allows.
+        :param row:
+        :return:
+        """
+        row = self._clamp(row)
+        if row != self.first_row:
+            self._render(row)
+
+    def _scroll_by(self, rows):
+        self.scroll_to(self.first_row + rows)
+        # Keeps the listbox from scrolling its own few rows as well.
+        return "break"
+
+    def _clamp(self, row):
+        return max(0, min(row, len(self.given_item_list) - self.page_size))
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(round(float(amount) * len(self.given_item_list)))
+        elif unit == "pages":
+            self._scroll_by(int(amount) * max(1, self.page_size - 1))
+        else:
+            self._scroll_by(int(amount))
+
+    def _on_mouse_wheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS reports small deltas.
+        notches = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self._scroll_by(-notches * WHEEL_ROWS)
+
+    def _on_resize(self, event):
+        font = tkinter.font.Font(font=self.list_box.cget("font"))
+        row_height = font.metrics("linespace") + 1 + 2 * int(self.list_box.cget("selectborderwidth"))
+        page_size = max(1, event.height // row_height)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self._render(self._clamp(self.first_row))
+
+    def _on_press(self, event):
+        # A plain click in an extended list starts a new selection, including the rows scrolled out of view.
+        if self.multi_select and not event.state & (SHIFT_MASK | CONTROL_MASK):
+            self.selected_ids.clear()
+
+    def _move_cursor(self, event, rows):
+        """
+        Moves the keyboard cursor by rows through the whole list, scrolling it into view, and selects the row it lands
+        on; with Shift held in an extended list, every row from the anchor to it. Tells the owner like a click would.
+        """
+        if not self.given_item_list:
+            return "break"
+        if self.cursor_row is None:
+            target = self.first_row
+        else:
+            target = max(0, min(self.cursor_row + rows, len(self.given_item_list) - 1))
+
+        if self.multi_select and event.state & SHIFT_MASK:
+            if self.anchor_row is None:
+                self.anchor_row = self.cursor_row if self.cursor_row is not None else target
+            first, last = sorted((self.anchor_row, target))
+            self.selected_ids = {item["id"] for item in self.given_item_list[first:last + 1]}
+        else:
+            self.anchor_row = target
+            self.selected_ids = {self.given_item_list[target]["id"]}
+        self.cursor_row = target
+
+        if target < self.first_row:
+            first_row = target
+        elif target >= self.first_row + self.page_size:
+            first_row = target - self.page_size + 1
+        else:
+            first_row = self.first_row
+        self._render(self._clamp(first_row))
+        self.list_box.activate(target - self.first_row)
+        if 0 <= self.anchor_row - self.first_row < len(self._rendered_rows):
+            self.list_box.selection_anchor(self.anchor_row - self.first_row)
+        self.on_click_function(event)
+        return "break"
+
+    def _on_select(self, event):
+        # A click moves the keyboard cursor to the clicked row; a Shift click keeps the anchor.
+        active_row, anchor_row = self.list_box.index(tkinter.ACTIVE), self.list_box.index(tkinter.ANCHOR)
+        if active_row < len(self._rendered_rows):
+            self.cursor_row = self.first_row + active_row
+        if anchor_row < len(self._rendered_rows):
+            self.anchor_row = self.first_row + anchor_row
+        selected_rows = set(self.list_box.curselection())
+        if not self.multi_select:
+            self.selected_ids = {self._rendered_rows[row][0] for row in selected_rows}
+            return
+        for row, (item_id, _, _) in enumerate(self._rendered_rows):
+            if row in selected_rows:
+                self.selected_ids.add(item_id)
+            else:
+                self.selected_ids.discard(item_id)
+
+    def _render(self, first_row):
+        """
+        Shows the rows of given_item_list starting at first_row. Rows that scrolled by less than a page are moved
+        instead of re-inserted.
+        :param first_row:
+        :return:
+        """
+        # One row more than fits, so a partially visible last row is never blank.
+        rows = [(item["id"], item["nice_name"], item["color"])
+                for item in self.given_item_list[first_row:first_row + self.page_size + 1]]
+        old_rows = self._rendered_rows
+        shift = first_row - self.first_row
+
+        if 0 < shift < len(old_rows):
+            self.list_box.delete(0, shift - 1)
+            old_rows = old_rows[shift:]
+        elif 0 < -shift < len(rows):
+            for row in range(-shift - 1, -1, -1):
+                self._insert_row(0, rows[row])
+            old_rows = rows[:-shift] + old_rows
+
+        if len(old_rows) > len(rows):
+            self.list_box.delete(len(rows), tkinter.END)
+        for row, rendered in enumerate(rows):
+            if row >= len(old_rows):
+                self._insert_row(row, rendered)
+            elif old_rows[row][1] != rendered[1]:
+                self.list_box.delete(row)
+                self._insert_row(row, rendered)
+            elif old_rows[row][2] != rendered[2]:
+                self.list_box.itemconfig(row, {"bg": rendered[2]})
+
+        self.list_box.selection_clear(0, tkinter.END)
+        for row, (item_id, _, _) in enumerate(rows):
+            if item_id in self.selected_ids:
+                self.list_box.selection_set(row)
+        self.list_box.yview(0)
+
+        self.first_row = first_row
+        self._rendered_rows = rows
+        self._update_scrollbar()
+
+    def _insert_row(self, row, rendered):
+        self.list_box.insert(row, rendered[1])
+        # Rows already have the listbox background, so only other colours cost a second Tcl call.
+        if rendered[2] != LIST_BACKGROUND:
+            self.list_box.itemconfig(row, {"bg": rendered[2]})
+
+    def _update_scrollbar(self):
+        item_count = len(self.given_item_list)
+        if item_count <= self.page_size:
+            self.vertical_scrollbar.set(0, 1)
+        else:
+            self.vertical_scrollbar.set(self.first_row / item_count,
+                                        min(1, (self.first_row + self.page_size) / item_count))
+
+
+class LevelMeter(ttk.LabelFrame):
+    """
+    Peak and RMS bars of one source, one pair per channel. The levels are computed by a level_meter.LevelStream; this
+    widget only moves the bars, at most once per METER_FRAME_MS and only while it is visible.
+    """
+    def __init__(self, parent, name, **kwargs):
+        super().__init__(parent, text=name, **kwargs)
+        self.name = name
+        self.device_name = None
+        self.stream = None
+        self._drawn_levels = None
+        self._draw_job = None
+
+        self.canvas = tkinter.Canvas(self, height=METER_BAR_HEIGHT * level_meter.METER_CHANNELS,
+                                     background=LIST_BACKGROUND, highlightthickness=0)
+        self.rms_bars = []
+        self.peak_marks = []
+
+        self._configure_canvas()
+        if not level_meter.is_available():
+            self._show_status("disabled, {}".format(level_meter.unavailable_reason()))
+
+    def _configure_canvas(self):
+        self.canvas.grid(column=0, row=0, sticky=tkinter.EW)
+        self.columnconfigure(0, weight=1)
+        for channel in range(level_meter.METER_CHANNELS):
+            top = channel * METER_BAR_HEIGHT
+            self.rms_bars.append(self.canvas.create_rectangle(0, top + 1, 0, top + METER_BAR_HEIGHT - 1,
+                                                              fill="green", width=0))
+            self.peak_marks.append(self.canvas.create_line(0, top, 0, top + METER_BAR_HEIGHT, fill="yellow"))
+
+    def set_device(self, device_name):
+        """
+        Meters another source, or nothing if device_name is None.
+        :param device_name: Name of the source or monitor.
+        :return:
+        """
+        if device_name == self.device_name:
+            return
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+        if self._draw_job is not None:
+            self.after_cancel(self._draw_job)
+            self._draw_job = None
+        self.device_name = device_name
+        self._draw_levels(None)
+
+        if device_name is None:
+            return
+        if not level_meter.is_available():
+            logger.info("Level meters are disabled: {}.".format(level_meter.unavailable_reason()))
+            return
+        try:
+            self.stream = level_meter.LevelStream.open(device_name)
+        except OSError as error:
+            logger.warning("Could not meter {}: {}".format(device_name, error))
+            self._show_status("could not start {}".format(level_meter.PAREC))
+            return
+        self._show_status(None)
+        self._draw_job = self.after(METER_FRAME_MS, self._draw)
+
+    def _show_status(self, status):
+        # The canvas is too small for text, so the status goes in the frame's title.
+        self.configure(text=self.name if status is None else "{} ({})".format(self.name, status))
+
+    def _draw(self):
+        levels = self.stream.latest
+        if levels is not self._drawn_levels and self.winfo_viewable():
+            self._draw_levels(levels)
+        self._draw_job = self.after(METER_FRAME_MS, self._draw)
+
+    def _draw_levels(self, levels):
+        width = self.canvas.winfo_width()
+        for channel in range(level_meter.METER_CHANNELS):
+            top = channel * METER_BAR_HEIGHT
+            rms_x = peak_x = 0
+            if levels is not None and channel < len(levels.peak):
+                rms_x = width * level_meter.to_meter_fraction(levels.rms[channel])
+                peak_x = width * level_meter.to_meter_fraction(levels.peak[channel])
+            self.canvas.coords(self.rms_bars[channel], 0, top + 1, rms_x, top + METER_BAR_HEIGHT - 1)
+            self.canvas.coords(self.peak_marks[channel], peak_x, top, peak_x, top + METER_BAR_HEIGHT)
+        self._drawn_levels = levels
+
+
+class LoopbackOptionsFrame(ttk.LabelFrame):
+    """
+    One field per loopback option. Choosing a preset fills them in with its values, which may then be edited; an empty
+    field leaves the option to module-loopback's default.
+    """
+    def __init__(self, parent, name, **kwargs):
+        super().__init__(parent, text=name, **kwargs)
+        self.labels = {}
+        self.entries = {}
+        for option in program_logic.LoopbackOptions._fields:
+            self.labels[option] = ttk.Label(self, text=LOOPBACK_OPTION_LABELS[option])
+            self.entries[option] = ttk.Entry(self, width=14)
+
+        self._configure_entries()
+
+    def _configure_entries(self):
+        for row, option in enumerate(program_logic.LoopbackOptions._fields):
+            self.labels[option].grid(column=0, row=row, padx=5, sticky=tkinter.E)
+            self.entries[option].grid(column=1, row=row, padx=5, pady=2, sticky=tkinter.W)
+
+    def set_options(self, options):
+        """
+        :param options: program_logic.LoopbackOptions to show.
+        :return:
+        """
+        for option, value in options._asdict().items():
+            self.entries[option].delete(0, tkinter.END)
+            if value is not None:
+                self.entries[option].insert(0, value)
+
+    def get_overrides(self):
+        """
+        :return: The contents of every field by option name, for program_logic.loopback_options.
+        """
+        return {option: entry.get().strip() for option, entry in self.entries.items()}
+
+    def mark_invalid(self, preset):
+        """
+        Replaces the contents of the fields that program_logic.loopback_options refuses with ERR.
+        :param preset: Preset the fields override.
+        :return:
+        """
+        for option, value in self.get_overrides().items():
+            try:
+                program_logic.loopback_options(preset, **{option: value})
+            except program_logic.LoopbackOptionsError:
+                self.entries[option].delete(0, tkinter.END)
+                self.entries[option].insert(0, "ERR")
+
+
+def split_ids(text):
+    """
+    Splits the contents of an id entry, which may hold several ids separated by spaces or commas.
+    :param text: Entry contents.
+    :return: List of id strings.
+    """
+    return [part for part in re.split(r"[\s,]+", text) if part]
+
+
+def join_ids(ids):
+    return " ".join(str(item_id) for item_id in ids)
 
 
 def setup_style(style_object: ttk.Style):
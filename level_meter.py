@@ -0,0 +1,148 @@
+"""
+Peak and RMS levels of sources and sink monitors.
+A LevelStream reads low-rate float PCM from a recording stream and keeps the levels of the most recent block, computed
+over the whole block at once with NumPy. The GUI reads the latest levels at its own frame rate, so reading and maths
+never run on the Tk thread. NumPy and parec are optional; without them the meters are disabled.
+The recording comes from one parec process per metered device. pulsectl's get_peak_sample would avoid the process,
+but it measures one mono peak per call, sets up a new stream every time and holds the connection while it waits, so
+it cannot give per-channel peak and RMS levels many times a second.
+"""
+import functools
+import logging
+import math
+import shutil
+import subprocess
+import threading
+from typing import BinaryIO, List, NamedTuple, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("Main")
+
+METER_SAMPLE_RATE = 8000
+METER_CHANNELS = 2
+# Blocks per second read from each stream; also the highest useful meter frame rate.
+METER_BLOCK_RATE = 20
+SILENCE_DB = -60.0
+PAREC = "parec"
+
+# Little endian sample formats parec can deliver, with their NumPy type and full scale value.
+SAMPLE_FORMATS = {
+    "float32le": ("<f4", 1.0),
+    "s16le": ("<i2", 32768.0),
+    "s32le": ("<i4", 2147483648.0),
+}
+
+
+class Levels(NamedTuple):
+    # Linear levels per channel, 1.0 being full scale.
+    peak: List[float]
+    rms: List[float]
+
+
+@functools.lru_cache(maxsize=None)
+def unavailable_reason() -> Optional[str]:
+    """
+    :return: Why levels cannot be metered here, or None if they can.
+    """
+    if numpy is None:
+        return "NumPy is not installed"
+    if shutil.which(PAREC) is None:
+        return "{} is not installed".format(PAREC)
+    return None
+
+
+def is_available() -> bool:
+    return unavailable_reason() is None
+
+
+def compute_levels(buffer: bytes, channels: int, sample_format: str = "float32le") -> Levels:
+    """
+    Computes the peak and RMS level of every channel of an interleaved PCM buffer. A trailing partial frame is ignored.
+    :param buffer: Raw PCM.
+    :param channels: Number of interleaved channels.
+    :param sample_format: One of SAMPLE_FORMATS.
+    :return:
+    """
+    dtype, full_scale = SAMPLE_FORMATS[sample_format]
+    samples = numpy.frombuffer(buffer, dtype=dtype)
+    frame_count = len(samples) // channels
+    if frame_count == 0:
+        return Levels([0.0] * channels, [0.0] * channels)
+
+    frames = samples[:frame_count * channels].reshape(frame_count, channels).astype(numpy.float64) / full_scale
+    peak = numpy.abs(frames).max(axis=0)
+    rms = numpy.sqrt(numpy.mean(numpy.square(frames), axis=0))
+    return Levels(peak.tolist(), rms.tolist())
+
+
+def to_db(level: float) -> float:
+    """
+    :return: The level in dBFS, no lower than SILENCE_DB.
+    """
+    if level <= 0:
+        return SILENCE_DB
+    return max(SILENCE_DB, 20 * math.log10(level))
+
+
+def to_meter_fraction(level: float) -> float:
+    """
+    :return: Position of the level on a meter running linearly in dB from SILENCE_DB to 0 dBFS, between 0 and 1.
+    """
+    return min(1.0, 1 - to_db(level) / SILENCE_DB)
+
+
+class LevelStream:
+    """
+    Reads blocks of PCM from a binary stream on a background thread and keeps the levels of the latest block.
+    """
+    def __init__(self, reader: BinaryIO, channels: int = METER_CHANNELS, sample_format: str = "float32le",
+                 frames_per_block: int = METER_SAMPLE_RATE // METER_BLOCK_RATE, process: subprocess.Popen = None):
+        self.reader = reader
+        self.channels = channels
+        self.sample_format = sample_format
+        self.block_size = frames_per_block * channels * numpy.dtype(SAMPLE_FORMATS[sample_format][0]).itemsize
+        self.process = process
+        self.latest: Optional[Levels] = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read_blocks, name="LevelStream", daemon=True)
+
+    @classmethod
+    def open(cls, device_name: str) -> "LevelStream":
+        """
+        Starts a low-rate parec recording of a source or monitor and meters it.
+        :param device_name: Name of the source, for example alsa_output.pci-0000_00_1f.3.analog-stereo.monitor.
+        :return: The started stream.
+        """
+        process = subprocess.Popen(
+            [PAREC, "--device={}".format(device_name), "--format=float32le",
+             "--channels={}".format(METER_CHANNELS), "--rate={}".format(METER_SAMPLE_RATE),
+             "--latency-msec={}".format(1000 // METER_BLOCK_RATE), "--client-name=pulseaudio-loopback-tool",
+             "--stream-name=Level meter"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        stream = cls(process.stdout, process=process)
+        stream.start()
+        logger.debug("Metering {}.".format(device_name))
+        return stream
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    def _read_blocks(self):
+        while not self._stopped:
+            block = self.reader.read(self.block_size)
+            if not block:
+                break
+            self.latest = compute_levels(block, self.channels, self.sample_format)
@@ -0,0 +1,258 @@
+"""
+Streaming parsers for the long listings of PulseAudio's command line tools: pacmd list-*, pactl list and pactl
+--format=json list.
+Each parser reads from any iterable, such as a pipe, and yields one ListingRecord per sink, source, module or stream
+as soon as the last of it has been read, so a listing is never held in memory as a whole, however many properties
+the server prints. Field names are normalised to the attribute names of pulsectl's info objects, so records from
+every tool are converted the same way.
+"""
+import json
+import re
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+SINK = "sink"
+SOURCE = "source"
+MODULE = "module"
+SINK_INPUT = "sink_input"
+SOURCE_OUTPUT = "source_output"
+
+
+class ListingRecord(NamedTuple):
+    # One of SINK, SOURCE, MODULE, SINK_INPUT and SOURCE_OUTPUT.
+    kind: str
+    index: int
+    # Normalised field names, for example "sample_spec" or "owner_module", to their text.
+    fields: Dict[str, str]
+    properties: Dict[str, str]
+
+
+# pacmd field names, as in "\tsample spec: s16le 2ch 44100Hz", to normalised names. Other fields are skipped.
+PACMD_FIELDS = {
+    "name": "name",
+    "driver": "driver",
+    "state": "state",
+    "sample spec": "sample_spec",
+    "channel map": "channel_map",
+    "current latency": "latency",
+    "module": "owner_module",
+    "monitor_of": "monitor_of_sink",
+    "sink": "sink",
+    "source": "source",
+    "client": "client",
+    "argument": "argument",
+}
+
+_PACMD_INDEX_PATTERN = re.compile(r"^\s+(?:\* )?index: (\d+)\s*$")
+_PACMD_FIELD_PATTERN = re.compile(r"^\t([a-z_ ]+): ?(.*)$")
+_PROPERTY_PATTERN = re.compile(r"^\t\t([^\s=]+) = \"(.*)\"\s*$")
+
+
+def _strip_brackets(value: str) -> str:
+    # pacmd puts names in angle brackets, for example "name: <alsa_output.pci-0000_00_1f.3.analog-stereo>".
+    return value[1:-1] if value.startswith("<") and value.endswith(">") else value
+
+
+def parse_pacmd_list(lines: Iterable[str], kind: str) -> Iterator[ListingRecord]:
+    """
+    Parses the output of pacmd list-sinks, list-sources, list-modules, list-sink-inputs or list-source-outputs.
+    :param lines: Output lines, with or without their line endings.
+    :param kind: What is listed, one of SINK, SOURCE, MODULE, SINK_INPUT and SOURCE_OUTPUT.
+    :return: Generator of the listed records, in listing order.
+    """
+    index: Optional[int] = None
+    fields: Dict[str, str] = {}
+    properties: Dict[str, str] = {}
+    in_properties = False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        index_match = _PACMD_INDEX_PATTERN.match(line)
+        if index_match is not None:
+            if index is not None:
+                yield ListingRecord(kind, index, fields, properties)
+            index, fields, properties, in_properties = int(index_match.group(1)), {}, {}, False
+            continue
+        if index is None:
+            # The "2 sink(s) available." header.
+            continue
+
+        field_match = _PACMD_FIELD_PATTERN.match(line)
+        if field_match is not None:
+            name, value = field_match.groups()
+            in_properties = name == "properties"
+            if name in PACMD_FIELDS:
+                fields[PACMD_FIELDS[name]] = _strip_brackets(value.strip())
+            continue
+        if in_properties:
+            property_match = _PROPERTY_PATTERN.match(line)
+            if property_match is not None:
+                properties[property_match.group(1)] = property_match.group(2)
+        # Anything else continues a field that is not used, like the second line of a volume.
+
+    if index is not None:
+        yield ListingRecord(kind, index, fields, properties)
+
+
+# Record kinds by the headers of pactl list, as in "Sink Input #4". Records of other kinds, like clients and cards,
+# are skipped.
+PACTL_KINDS = {
+    "Sink": SINK,
+    "Source": SOURCE,
+    "Module": MODULE,
+    "Sink Input": SINK_INPUT,
+    "Source Output": SOURCE_OUTPUT,
+}
+
+# pactl list field names, as in "\tSample Specification: s16le 2ch 44100Hz", to normalised names. pactl translates
+# them, so pactl has to run in the C locale.
+PACTL_FIELDS = {
+    "Name": "name",
+    "Description": "description",
+    "Driver": "driver",
+    "State": "state",
+    "Sample Specification": "sample_spec",
+    "Channel Map": "channel_map",
+    "Latency": "latency",
+    "Owner Module": "owner_module",
+    "Monitor of Sink": "monitor_of_sink",
+    "Sink": "sink",
+    "Source": "source",
+    "Client": "client",
+    "Argument": "argument",
+    "Corked": "corked",
+}
+
+_PACTL_HEADER_PATTERN = re.compile(r"^(\w[\w ]*) #(\d+)\s*$")
+_PACTL_FIELD_PATTERN = re.compile(r"^\t([A-Za-z][A-Za-z ]*): ?(.*)$")
+
+
+def parse_pactl_list(lines: Iterable[str]) -> Iterator[ListingRecord]:
+    """
+    Parses the output of pactl list, for all kinds of objects or one.
+    :param lines: Output lines, with or without their line endings.
+    :return: Generator of the listed sinks, sources, modules and streams, in listing order.
+    """
+    kind: Optional[str] = None
+    index: Optional[int] = None
+    fields: Dict[str, str] = {}
+    properties: Dict[str, str] = {}
+    in_properties = False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        header_match = _PACTL_HEADER_PATTERN.match(line)
+        if header_match is not None:
+            if kind is not None:
+                yield ListingRecord(kind, index, fields, properties)
+            kind = PACTL_KINDS.get(header_match.group(1))
+            index, fields, properties, in_properties = int(header_match.group(2)), {}, {}, False
+            continue
+        if kind is None:
+            continue
+
+        field_match = _PACTL_FIELD_PATTERN.match(line)
+        if field_match is not None:
+            name, value = field_match.groups()
+            in_properties = name == "Properties"
+            if name in PACTL_FIELDS:
+                fields[PACTL_FIELDS[name]] = value.strip()
+            continue
+        if in_properties:
+            property_match = _PROPERTY_PATTERN.match(line)
+            if property_match is not None:
+                properties[property_match.group(1)] = property_match.group(2)
+
+    if kind is not None:
+        yield ListingRecord(kind, index, fields, properties)
+
+
+# pactl --format=json field names that differ from the normalised ones. The others are the same or skipped.
+PACTL_JSON_FIELDS = {
+    "sample_specification": "sample_spec",
+}
+_JSON_SEPARATORS = " \t\r\n,[]"
+# Whole strings, the characters opening and closing objects, and the quote of a string that the chunk cuts off.
+_JSON_TOKEN_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}"]', re.DOTALL)
+# The rest of a string up to its closing quote, or up to the end of the chunk or a backslash ending it.
+_JSON_STRING_REST_PATTERN = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
+
+def _json_record(item: Dict, kind: str) -> ListingRecord:
+    fields = {}
+    for name, value in item.items():
+        name = PACTL_JSON_FIELDS.get(name, name)
+        if name == "latency" and isinstance(value, dict):
+            # {"actual": 0, "configured": 0}, in microseconds, printed like pactl list does.
+            fields[name] = "{} usec, configured {} usec".format(value.get("actual"), value.get("configured"))
+        elif isinstance(value, bool):
+            fields[name] = "yes" if value else "no"
+        elif isinstance(value, (str, int, float)):
+            fields[name] = str(value)
+    properties = {name: str(value) for name, value in (item.get("properties") or {}).items()}
+    return ListingRecord(kind, int(item["index"]), fields, properties)
+
+
+def parse_pactl_json(chunks: Iterable[str], kind: str) -> Iterator[ListingRecord]:
+    """
+    Parses the output of pactl --format=json list, which is one JSON array, decoding each object of it as soon as it
+    is complete. Every character is scanned once to find where objects end, so an object spread over many chunks costs
+    no more than one that arrives whole.
+    :param chunks: The output in pieces of any size. pactl prints the array on a single line, so reading it line by
+    line would read all of it at once.
+    :param kind: What is listed, one of SINK, SOURCE, MODULE, SINK_INPUT and SOURCE_OUTPUT.
+    :return: Generator of the listed records, in listing order.
+    :raises ValueError: The output is not a JSON array of objects, or ends in the middle of one.
+    """
+    # Pieces of the object being read, how deeply nested the scan is inside it, and whether it is inside a string.
+    pieces: List[str] = []
+    depth = 0
+    in_string = False
+    # Whether the first character of the next chunk is escaped by a backslash at the end of this one.
+    escaped = False
+    for chunk in chunks:
+        # Start of the current object's text in this chunk, and end of the text between objects already checked.
+        object_start = 0 if depth else None
+        checked = 0
+        position = 1 if escaped else 0
+        escaped = False
+        while True:
+            if in_string:
+                position = _JSON_STRING_REST_PATTERN.match(chunk, position).end()
+                if position == len(chunk):
+                    break
+                if chunk[position] == "\\":
+                    # The chunk ends with the backslash.
+                    escaped = True
+                    break
+                in_string = False
+                position += 1
+
+            for match in _JSON_TOKEN_PATTERN.finditer(chunk, position):
+                token = match.group()
+                if depth == 0:
+                    if token != "{" or chunk[checked:match.start()].strip(_JSON_SEPARATORS):
+                        raise ValueError("Expected a JSON object in the listing, got {!r}.".format(
+                            chunk[checked:match.end()][:100]))
+                    depth, object_start = 1, match.start()
+                elif token == "{":
+                    depth += 1
+                elif token == "}":
+                    depth -= 1
+                    if depth == 0:
+                        pieces.append(chunk[object_start:match.end()])
+                        item = json.loads("".join(pieces))
+                        pieces, object_start, checked = [], None, match.end()
+                        yield _json_record(item, kind)
+                elif token == "\"":
+                    # A string that goes on in the next chunk.
+                    in_string, position = True, match.end()
+                    break
+                # Anything else is a whole string, whose braces do not count.
+            else:
+                break
+
+        if depth:
+            pieces.append(chunk[object_start:])
+        elif chunk[checked:].strip(_JSON_SEPARATORS):
+            raise ValueError("Expected a JSON object in the listing, got {!r}.".format(chunk[checked:][:100]))
+
+    if depth:
+        raise ValueError("The JSON listing ends in the middle of an object: {!r}".format("".join(pieces)[:100]))
@@ -0,0 +1,186 @@
+"""
+Health of loopbacks over time.
+HealthMonitor.sample() reads the sink input and source output of every loopback module in one listing each and adds
+their combined latency and the sink input's rate to a bounded history per loopback. From that history a loopback is
+flagged when its latency is far from the requested latency, when the latency keeps drifting in one direction, or when
+module-loopback changes the resampling rate more often than its adjust_time lets it do routinely.
+"""
+import collections
+import logging
+import threading
+import time
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+import pulsectl
+
+import program_logic
+
+logger = logging.getLogger("Main")
+
+SAMPLE_INTERVAL = 1.0
+HISTORY_LENGTH = 120
+# Samples needed before a loopback is judged at all.
+MIN_SAMPLES = 10
+# Latency further than this from the target, in microseconds or as a fraction of the target, whichever is larger.
+OFF_TARGET_USEC = 5000
+OFF_TARGET_FRACTION = 0.5
+# module-loopback cannot get below the latency of its devices and its own buffers, tens of milliseconds on most
+# hardware, so smaller targets, like the 1 ms of the default preset, are judged as if they were this.
+MIN_TARGET_USEC = 20000
+# Latency changing faster than this, in microseconds per second, counts as drifting.
+DRIFT_USEC_PER_SECOND = 200.0
+# module-loopback changes the rate about once per adjust_time. A loopback whose rate changes more than this many times
+# as often counts as re-adjusting.
+READJUST_MARGIN = 2.0
+# module-loopback's latency and adjust_time, in seconds, when latency_msec and adjust_time are not given.
+DEFAULT_TARGET_USEC = 200000
+DEFAULT_ADJUST_TIME = 10
+
+OFF_TARGET = "off_target"
+DRIFTING = "drifting"
+READJUSTING = "readjusting"
+
+
+class LatencySample(NamedTuple):
+    time: float
+    # Sink input and source output buffers plus the sink and source latency, in microseconds.
+    latency_usec: int
+    rate: Optional[int]
+
+
+class LoopbackHealth:
+    def __init__(self, module_id: int, target_usec: int, history_length: int = HISTORY_LENGTH,
+                 adjust_time: int = DEFAULT_ADJUST_TIME):
+        self.module_id = module_id
+        self.target_usec = target_usec
+        # Seconds between module-loopback's rate adjustments; 0 turns them off.
+        self.adjust_time = adjust_time
+        self.samples: Deque[LatencySample] = collections.deque(maxlen=history_length)
+
+    def add(self, sample: LatencySample):
+        self.samples.append(sample)
+
+    def drift_usec_per_second(self) -> float:
+        """
+        :return: Least squares slope of the latency over the history.
+        """
+        count = len(self.samples)
+        mean_time = sum(sample.time for sample in self.samples) / count
+        mean_latency = sum(sample.latency_usec for sample in self.samples) / count
+        covariance = sum((sample.time - mean_time) * (sample.latency_usec - mean_latency) for sample in self.samples)
+        variance = sum((sample.time - mean_time) ** 2 for sample in self.samples)
+        return covariance / variance if variance > 0 else 0.0
+
+    def rate_change_fraction(self) -> float:
+        samples = list(self.samples)
+        changes = sum(1 for previous, sample in zip(samples, samples[1:]) if previous.rate != sample.rate)
+        return changes / (len(samples) - 1)
+
+    def expected_rate_change_fraction(self) -> float:
+        """
+        :return: Share of sampling intervals in which module-loopback routinely changes the rate, one per adjust_time.
+        """
+        if self.adjust_time <= 0:
+            return 0.0
+        interval = (self.samples[-1].time - self.samples[0].time) / (len(self.samples) - 1)
+        return min(1.0, interval / self.adjust_time)
+
+    def flags(self) -> List[str]:
+        """
+        :return: Problems of this loopback, empty while it is healthy or has too little history to tell.
+        """
+        if len(self.samples) < MIN_SAMPLES:
+            return []
+        flags = []
+        recent = list(self.samples)[-MIN_SAMPLES:]
+        mean_latency = sum(sample.latency_usec for sample in recent) / len(recent)
+        target_usec = max(self.target_usec, MIN_TARGET_USEC)
+        if abs(mean_latency - target_usec) > max(OFF_TARGET_USEC, target_usec * OFF_TARGET_FRACTION):
+            flags.append(OFF_TARGET)
+        if abs(self.drift_usec_per_second()) > DRIFT_USEC_PER_SECOND:
+            flags.append(DRIFTING)
+        # With an adjust_time at or below the sampling interval, a rate change in every interval is routine.
+        if self.rate_change_fraction() > min(1.0, self.expected_rate_change_fraction() * READJUST_MARGIN):
+            flags.append(READJUSTING)
+        return flags
+
+    def summary(self) -> Dict:
+        latest = self.samples[-1] if self.samples else None
+        return {
+            "module": self.module_id,
+            "target_usec": self.target_usec,
+            "latency_usec": latest.latency_usec if latest else None,
+            "rate": latest.rate if latest else None,
+            "samples": len(self.samples),
+            "flags": self.flags(),
+        }
+
+
+def _rate(stream) -> Optional[int]:
+    sample_spec = getattr(stream, "sample_spec", None)
+    return sample_spec.rate if sample_spec is not None else None
+
+
+class HealthMonitor:
+    def __init__(self, history_length: int = HISTORY_LENGTH):
+        self.history_length = history_length
+        self.routes: Dict[int, LoopbackHealth] = {}
+
+    def sample(self, pulseaudio: pulsectl.Pulse, now: float = None) -> Dict[int, LoopbackHealth]:
+        """
+        Takes one sample of every loopback, forgetting loopbacks that are gone and logging newly raised flags.
+        :param pulseaudio: Connection to the server.
+        :param now: Time of the sample, time.monotonic() by default.
+        :return: Health of every current loopback, by module index.
+        """
+        now = time.monotonic() if now is None else now
+        loopbacks = {module.index: module for module in pulseaudio.module_list() if module.name == "module-loopback"}
+        sink_inputs = {stream.owner_module: stream for stream in pulseaudio.sink_input_list()
+                       if stream.owner_module in loopbacks}
+        source_outputs = {stream.owner_module: stream for stream in pulseaudio.source_output_list()
+                          if stream.owner_module in loopbacks}
+
+        for module_id in [module_id for module_id in self.routes if module_id not in loopbacks]:
+            del self.routes[module_id]
+
+        for module_id, module in loopbacks.items():
+            sink_input, source_output = sink_inputs.get(module_id), source_outputs.get(module_id)
+            if sink_input is None or source_output is None:
+                continue
+            health = self.routes.get(module_id)
+            if health is None:
+                health = self.routes[module_id] = LoopbackHealth(module_id, self._target_usec(module),
+                                                                 self.history_length, self._adjust_time(module))
+            old_flags = health.flags()
+            health.add(LatencySample(now, (sink_input.buffer_usec or 0) + (sink_input.sink_usec or 0) +
+                                     (source_output.buffer_usec or 0) + (source_output.source_usec or 0),
+                                     _rate(sink_input)))
+            new_flags = set(health.flags()) - set(old_flags)
+            if new_flags:
+                logger.warning("Loopback module {} is {}: {}".format(
+                    module_id, " and ".join(sorted(new_flags)), health.summary()))
+        return self.routes
+
+    @staticmethod
+    def _target_usec(module: pulsectl.PulseModuleInfo) -> int:
+        latency_msec = program_logic.get_module_attributes(module).get("latency_msec", "")
+        return int(latency_msec) * 1000 if latency_msec.isdigit() else DEFAULT_TARGET_USEC
+
+    @staticmethod
+    def _adjust_time(module: pulsectl.PulseModuleInfo) -> int:
+        adjust_time = program_logic.get_module_attributes(module).get("adjust_time", "")
+        return int(adjust_time) if adjust_time.isdigit() else DEFAULT_ADJUST_TIME
+
+    def run(self, pulseaudio: pulsectl.Pulse, stop: threading.Event, interval: float = SAMPLE_INTERVAL):
+        """
+        Samples every interval seconds until stop is set. Sampling time does not accumulate into the schedule.
+        :param pulseaudio: Connection to the server.
+        :param stop: Event that ends the run.
+        :param interval: Seconds between samples.
+        :return:
+        """
+        next_sample = time.monotonic()
+        while not stop.is_set():
+            self.sample(pulseaudio)
+            next_sample += interval
+            stop.wait(max(0.0, next_sample - time.monotonic()))
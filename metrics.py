@@ -0,0 +1,242 @@
+"""
+Timing histograms and counters for program_logic calls, state refreshes and GUI actions.
+Metrics live in this module for the whole process and are rendered in the Prometheus text exposition format, which
+serve() makes available over HTTP on a local port or on a Unix domain socket.
+"""
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import unix_socket
+
+logger = logging.getLogger("Main")
+
+METRIC_PREFIX = "palt_"
+# Upper bounds of the histogram buckets, in seconds. Server round trips take a few milliseconds, so the buckets are
+# densest there.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing count per label value.
+    """
+    def __init__(self, name: str, documentation: str, label_name: str):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label: str, amount: float = 1):
+        with self._lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            values = sorted(self.values.items())
+        for label, value in values:
+            lines.append("{}{{{}=\"{}\"}} {}".format(self.name, self.label_name, _escape_label_value(label),
+                                                     _format_value(value)))
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of durations per label value, in cumulative buckets as Prometheus expects them.
+    """
+    def __init__(self, name: str, documentation: str, label_name: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = buckets
+        # Per label: count of observations falling into each bucket (not cumulative, the last one being +Inf), and
+        # the sum of all observations.
+        self.bucket_counts: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, seconds: float):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self.bucket_counts.get(label)
+            if counts is None:
+                counts = self.bucket_counts[label] = [0] * (len(self.buckets) + 1)
+                self.sums[label] = 0.0
+            counts[bucket] += 1
+            self.sums[label] += seconds
+
+    @contextlib.contextmanager
+    def time(self, label: str):
+        """
+        Observes the duration of the with block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - start)
+
+    def render(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            snapshot = sorted((label, list(counts), self.sums[label]) for label, counts in self.bucket_counts.items())
+        for label, counts, total in snapshot:
+            label_pair = "{}=\"{}\"".format(self.label_name, _escape_label_value(label))
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{{{},le=\"{}\"}} {}".format(self.name, label_pair, _format_value(upper_bound),
+                                                                  cumulative))
+            lines.append("{}_sum{{{}}} {}".format(self.name, label_pair, _format_value(total)))
+            lines.append("{}_count{{{}}} {}".format(self.name, label_pair, cumulative))
+        return lines
+
+
+CALL_SECONDS = Histogram("call_duration_seconds", "Duration of program_logic calls.", "function")
+CALLS = Counter("calls_total", "program_logic calls made.", "function")
+CALL_FAILURES = Counter("call_failures_total", "program_logic calls that raised.", "function")
+OBJECTS_RETURNED = Counter("objects_returned_total", "Objects returned by program_logic calls.", "function")
+REFRESH_SECONDS = Histogram("refresh_duration_seconds",
+                            "Duration of state refreshes: full reloads, applied events and GUI tab updates.", "kind")
+GUI_ACTION_SECONDS = Histogram("gui_action_duration_seconds",
+                               "Time from submitting a GUI action to the worker until it finished.", "action")
+
+ALL_METRICS = [CALL_SECONDS, CALLS, CALL_FAILURES, OBJECTS_RETURNED, REFRESH_SECONDS, GUI_ACTION_SECONDS]
+
+
+def _object_count(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (list, tuple, dict, set)):
+        return len(value)
+    return 1
+
+
+def timed(function: Callable) -> Callable:
+    """
+    Decorator recording the duration, outcome and number of returned objects of every call of a function.
+    :param function:
+    :return:
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        CALLS.inc(name)
+        start = time.perf_counter()
+        try:
+            value = function(*args, **kwargs)
+        except Exception:
+            CALL_FAILURES.inc(name)
+            raise
+        finally:
+            CALL_SECONDS.observe(name, time.perf_counter() - start)
+        OBJECTS_RETURNED.inc(name, _object_count(value))
+        return value
+    return wrapper
+
+
+def render() -> str:
+    """
+    :return: Every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@functools.lru_cache(maxsize=None)
+def _server_classes():
+    """
+    Defines the HTTP handler and server classes on first use, so that processes that never serve metrics, headless
+    commands above all, do not load the HTTP modules at startup.
+    :return: The request handler class and the TCP and Unix domain socket server classes.
+    """
+    import http.server
+    import socketserver
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self) -> str:
+            # Clients of a Unix domain socket have no address.
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix socket"
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request from {}: {}".format(self.address_string(), format % args))
+
+    class TcpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return MetricsHandler, TcpServer, UnixServer
+
+
+class MetricsServer:
+    """
+    Serves render() over HTTP on a background thread.
+    """
+    def __init__(self, server: "socketserver.BaseServer", socket_path: Optional[str] = None):
+        self.server = server
+        self.socket_path = socket_path
+        self._thread = threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def serve(port: Optional[int] = None, socket_path: Optional[str] = None, host: str = "127.0.0.1") -> MetricsServer:
+    """
+    Starts serving the metrics, on a local TCP port or on a Unix domain socket.
+    :param port: TCP port to listen on.
+    :param socket_path: Path of the Unix domain socket to create instead. A stale socket at this path is replaced;
+    anything else there raises unix_socket.SocketPathError.
+    :param host: Address to listen on with a TCP port.
+    :return: The started server.
+    """
+    handler, tcp_server, unix_server = _server_classes()
+    if socket_path is not None:
+        unix_socket.remove_stale_socket(socket_path)
+        metrics_server = MetricsServer(unix_server(socket_path, handler), socket_path)
+        logger.info("Serving metrics on unix socket {}.".format(socket_path))
+    else:
+        metrics_server = MetricsServer(tcp_server((host, port), handler))
+        logger.info("Serving metrics on http://{}:{}/metrics.".format(host, metrics_server.server.server_address[1]))
+    metrics_server.start()
+    return metrics_server
@@ -0,0 +1,132 @@
+"""
+Profiling of single actions, enabled with start.py --profile.
+Each profiled action runs under cProfile while tracemalloc tracks allocations. Its call statistics are written to
+logs/ as a .prof file for pstats or snakeviz, next to a text report of the slowest calls and the allocation sites
+that grew, and a one line summary of the slowest calls goes to the log.
+cProfile only sees the thread it runs on, so the work of a GUI action is profiled where it happens: the server calls
+on the worker thread and the list updates on the Tk thread, as separate actions. Each thread has its own profiler, so
+actions on different threads never wait for each other. tracemalloc's figures are for the whole process, though, so
+the memory reported for actions that overlap includes each other's allocations.
+"""
+import contextlib
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("Main")
+
+PROFILE_DIRECTORY = "logs"
+# Frames of the allocation stack tracemalloc keeps, and how many entries each report lists.
+TRACEMALLOC_FRAMES = 10
+REPORT_LENGTH = 30
+SUMMARY_LENGTH = 5
+
+_enabled = False
+_sequence = itertools.count(1)
+_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def enable():
+    """
+    Turns profiling on for the rest of the process. Call it early, since allocations made before it are not traced.
+    :return:
+    """
+    global _enabled
+    _enabled = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    logger.info("Profiling enabled, writing profiles to {}/.".format(PROFILE_DIRECTORY))
+
+
+@contextlib.contextmanager
+def profile(action: str):
+    """
+    Profiles the with block as one action when profiling is enabled, and does nothing otherwise. A block nested in an
+    action that is already being profiled on the same thread counts as part of that action.
+    :param action: Name of the action, used in the file names and the log.
+    """
+    if not _enabled or getattr(_thread_state, "active", False):
+        yield
+        return
+
+    number = next(_sequence)
+    # The lock only keeps the process-wide tracemalloc readings of two threads from interleaving; it is never held
+    # while the action runs.
+    with _lock:
+        snapshot_before = tracemalloc.take_snapshot()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as error:
+        # Python 3.12 and later allow a single enabled profiler in the whole process.
+        logger.debug("Not profiling {} #{}, another thread is being profiled: {}".format(action, number, error))
+        yield
+        return
+
+    _thread_state.active = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        with _lock:
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            snapshot_after = tracemalloc.take_snapshot()
+        _thread_state.active = False
+        try:
+            _write_report(action, number, profiler, elapsed, memory_after - memory_before,
+                          memory_peak - memory_before, snapshot_after.compare_to(snapshot_before, "lineno"))
+        except OSError as error:
+            logger.warning("Writing the profile of {} #{} failed: {}".format(action, number, error))
+
+
+def _slowest_calls(stats: pstats.Stats, count: int):
+    """
+    :return: The count functions with the most time spent in themselves, as (function, self seconds, calls).
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    return [(_function_name(function), internal_time, call_count)
+            for function, (primitive_calls, call_count, internal_time, cumulative_time, callers) in rows[:count]]
+
+
+def _function_name(function) -> str:
+    file_name, line_number, name = function
+    if file_name == "~":
+        # Built-in functions have no file.
+        return name
+    return "{}:{}({})".format(os.path.basename(file_name), line_number, name)
+
+
+def _write_report(action: str, number: int, profiler: cProfile.Profile, elapsed: float, memory_change: int,
+                  memory_peak: int, allocation_changes):
+    base_name = os.path.join(PROFILE_DIRECTORY, "profile {} {:04}".format(re.sub(r"[^\w.-]", "_", action), number))
+    profiler.dump_stats(base_name + ".prof")
+
+    report = io.StringIO()
+    report.write("{} #{}: {:.1f} ms, memory {:+.1f} KiB, peak {:+.1f} KiB\n\n".format(
+        action, number, elapsed * 1000, memory_change / 1024, memory_peak / 1024))
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(REPORT_LENGTH)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LENGTH)
+    report.write("Allocation sites that grew the most:\n")
+    for change in allocation_changes[:REPORT_LENGTH]:
+        report.write("{}\n".format(change))
+    with open(base_name + ".txt", "w") as report_file:
+        report_file.write(report.getvalue())
+
+    slowest = ", ".join("{} {:.1f} ms in {} calls".format(function, internal_time * 1000, call_count)
+                        for function, internal_time, call_count in _slowest_calls(stats, SUMMARY_LENGTH))
+    logger.info("Profiled {} #{} in {:.1f} ms, peak memory {:+.1f} KiB, slowest: {}. Written to {}.prof".format(
+        action, number, elapsed * 1000, memory_peak / 1024, slowest, base_name))
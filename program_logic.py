@@ -3,12 +3,22 @@ import subprocess
 import traceback
 import logging
 import sys
-from typing import Dict, List, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
 import pulsectl
 
+import metrics
+import routing
+
 logger = logging.getLogger("Main")
 
+LISTABLE_MODULE_NAMES = [
+    'module-null-sink',
+    'module-loopback',
+    'module-null-source',
+    'module-remap-source',
+]
+
 
 def log_exception_handler(error_type, value, tb):
     # TODO: Unify logging errors.
@@ -31,6 +41,7 @@ def open_pavucontrol():
     subprocess.Popen("pavucontrol", shell=True, stdout=subprocess.PIPE)
 
 
+@metrics.timed
 def list_sources(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSourceInfo]:
     """
     Shortcut for the pactl list sources short command.
@@ -39,6 +50,7 @@ def list_sources(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSourceInfo]:
     return pulseaudio.source_list()
 
 
+@metrics.timed
 def list_sinks(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSinkInfo]:
     """
     Shortcut for the pactl list sinks short command.
@@ -47,29 +59,74 @@ def list_sinks(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSinkInfo]:
     return pulseaudio.sink_list()
 
 
+@metrics.timed
 def list_modules(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseModuleInfo]:
     """
     Shortcut for the pactl list modules short command.
     :return: String output from the command.
     """
-    listable_module_names = [
-        'module-null-sink',
-        'module-loopback',
-        'module-null-source',
-        'module-remap-source',
-    ]
     return [
         module for module in
         pulseaudio.module_list()
-        if module.name in listable_module_names
+        if module.name in LISTABLE_MODULE_NAMES
     ]
 
 
+@metrics.timed
+def list_sink_inputs(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSinkInputInfo]:
+    """
+    Shortcut for the pactl list sink-inputs short command.
+    :return: Playback streams.
+    """
+    return pulseaudio.sink_input_list()
+
+
+@metrics.timed
+def list_source_outputs(pulseaudio: pulsectl.Pulse) -> List[pulsectl.PulseSourceOutputInfo]:
+    """
+    Shortcut for the pactl list source-outputs short command.
+    :return: Recording streams.
+    """
+    return pulseaudio.source_output_list()
+
+
 """
 Start of information processing.
 """
 
 
+def _optional_index(index: Optional[int]) -> Optional[int]:
+    return None if index is None or index == routing.INVALID_INDEX else index
+
+
+# Names of PulseAudio's pa_sample_format_t values, in enum order, as the format module argument expects them.
+SAMPLE_FORMAT_NAMES = [
+    "u8", "alaw", "ulaw", "s16le", "s16be", "float32le", "float32be", "s32le", "s32be", "s24le", "s24be", "s24-32le",
+    "s24-32be",
+]
+
+
+def _sample_spec_to_dict(device: Union[pulsectl.PulseSourceInfo, pulsectl.PulseSinkInfo]) -> Optional[Dict]:
+    """
+    :return: Format, rate, channel count and channel map of the device, or None if the server did not report them.
+    """
+    sample_spec = getattr(device, "sample_spec", None)
+    if sample_spec is None:
+        return None
+    sample_format = sample_spec.format
+    if hasattr(sample_format, "_value"):
+        sample_format = sample_format._value
+    elif isinstance(sample_format, int) and 0 <= sample_format < len(SAMPLE_FORMAT_NAMES):
+        sample_format = SAMPLE_FORMAT_NAMES[sample_format]
+    channel_list = getattr(device, "channel_list", None)
+    return {
+        "format": str(sample_format),
+        "rate": sample_spec.rate,
+        "channels": sample_spec.channels,
+        "channel_map": ",".join(channel_list) if channel_list else None,
+    }
+
+
 def _audio_device_to_dict(device: Union[pulsectl.PulseSourceInfo, pulsectl.PulseSinkInfo]) -> dict:
     """
     Takes a tab separated string in the sequence of "ID Name Driver Specification State" and turns it into a dictionary.
@@ -79,26 +136,132 @@ def _audio_device_to_dict(device: Union[pulsectl.PulseSourceInfo, pulsectl.Pulse
     return {
         "id": device.index,
         "name": device.name,
+        "description": device.description,
         "driver": device.driver,
+        "monitor_of_sink": _optional_index(getattr(device, "monitor_of_sink", None)),
+        "sample_spec": _sample_spec_to_dict(device),
         "state": device.state._value,
         "color": color_tag(device.state._value),
         "nice_name": f"{device.index} {device.description} {device.state._value.upper()}"
     }
 
 
-def get_module_attributes(module: pulsectl.PulseModuleInfo) -> Dict[str, str]:
+def _stream_to_dict(stream: Union[pulsectl.PulseSinkInputInfo, pulsectl.PulseSourceOutputInfo],
+                    device_field: str) -> Dict:
+    """
+    Turns a sink input or source output into a dictionary.
+    :param stream:
+    :param device_field: "sink" for sink inputs, "source" for source outputs.
+    :return:
+    """
+    application = getattr(stream, "proplist", {}).get("application.name", "")
+    device = getattr(stream, device_field)
+    return {
+        "id": stream.index,
+        "name": stream.name,
+        "application": application,
+        device_field: device,
+        "owner_module": stream.owner_module,
+        "corked": bool(stream.corked),
+        "color": "yellow" if stream.corked else "green",
+        "nice_name": f"{stream.index} {application}: {stream.name} ({device_field} {device})"
+    }
+
+
+def _sink_input_to_dict(sink_input: pulsectl.PulseSinkInputInfo) -> Dict:
+    return _stream_to_dict(sink_input, "sink")
+
+
+def _source_output_to_dict(source_output: pulsectl.PulseSourceOutputInfo) -> Dict:
+    return _stream_to_dict(source_output, "source")
+
+
+# Same grammar as PulseAudio's pa_modargs: a value is bare, "double quoted" or 'single quoted', and a backslash
+# escapes the next character in all three forms.
+_MODULE_ARGUMENT_PATTERN = re.compile(r"""
+    ([^\s=]+)=
+    (?:
+        "((?:[^"\\]|\\.)*)"
+        |'((?:[^'\\]|\\.)*)'
+        |((?:[^\s\\]|\\.)*)
+    )
+""", re.VERBOSE | re.DOTALL)
+_ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+# Parsed arguments by module index, together with the argument string they were parsed from.
+_module_attribute_cache: Dict[int, Tuple[str, Dict[str, str]]] = {}
+
+
+def parse_module_arguments(argument: str) -> Dict[str, str]:
+    """
+    Splits a module argument string into its names and values, removing quotes and escapes.
+    :param argument: Argument string of a module.
+    :return: Dictionary of argument names to values.
+    """
     attributes: Dict[str, str] = {}
+    if not argument:
+        return attributes
+
+    for match in _MODULE_ARGUMENT_PATTERN.finditer(argument):
+        name, double_quoted, single_quoted, bare = match.groups()
+        value = next(part for part in (double_quoted, single_quoted, bare) if part is not None)
+        if "\\" in value:
+            value = _ESCAPE_PATTERN.sub(r"\1", value)
+        attributes[name] = value
+    return attributes
 
-    matches = re.findall(r'(\S+?)=((?:"[^"+]+")|(?:[^\s]+))', module.argument)
-    for k, v in matches:
-        if v.startswith('"') and v.endswith('"'):
-            v = v[1:-1]
 
-        attributes[k] = v
+def get_module_attributes(module: pulsectl.PulseModuleInfo) -> Dict[str, str]:
+    """
+    Parsed arguments of a module, memoised by module index and argument string.
+    The returned dictionary is shared with the cache and must not be modified.
+    :param module:
+    :return: Dictionary of argument names to values.
+    """
+    cached = _module_attribute_cache.get(module.index)
+    if cached is not None and cached[0] == module.argument:
+        return cached[1]
 
+    attributes = parse_module_arguments(module.argument)
+    _module_attribute_cache[module.index] = (module.argument, attributes)
     return attributes
 
 
+def forget_module(module_index: int):
+    """
+    Drops the cached arguments of a module that was unloaded.
+    :param module_index:
+    :return:
+    """
+    _module_attribute_cache.pop(module_index, None)
+
+
+def prune_module_cache(live_module_indices: Iterable[int]):
+    """
+    Drops the cached arguments of every module not in the given indices.
+    :param live_module_indices: Indices of the modules that still exist.
+    :return:
+    """
+    live_module_indices = set(live_module_indices)
+    for module_index in [index for index in _module_attribute_cache if index not in live_module_indices]:
+        del _module_attribute_cache[module_index]
+
+
+def format_module_arguments(attributes: Dict[str, str]) -> str:
+    """
+    Turns a dictionary of module arguments back into an argument string, quoting values where needed.
+    :param attributes: Argument names and values.
+    :return: String usable as the arguments of a module load.
+    """
+    argument_strings = []
+    for name, value in attributes.items():
+        value = str(value)
+        if value == "" or re.search(r'[\s"\'\\]', value):
+            value = '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+        argument_strings.append(f"{name}={value}")
+    return " ".join(argument_strings)
+
+
 def _module_to_dict(module: pulsectl.PulseModuleInfo) -> Dict:
     """
     Takes a tab separated string with the bare minimum sequence of "ID ModuleType" and if applicable to the program,
@@ -126,6 +289,7 @@ def _module_to_dict(module: pulsectl.PulseModuleInfo) -> Dict:
     return {
         "id": module.index,
         "name": module.name,
+        "attributes": attributes,
         "nice_name": f"{module.index} {module.name} {' '.join(attribute_strings)}",
         "color": "#323232",
     }
@@ -150,6 +314,7 @@ def color_tag(raw_state: str) -> str:
     return output
 
 
+@metrics.timed
 def get_source_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
     """
     Shortcut to getting a list of source dictionaries.
@@ -158,6 +323,7 @@ def get_source_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
     return list(map(_audio_device_to_dict, list_sources(pulseaudio)))
 
 
+@metrics.timed
 def get_sink_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
     """
     Shortcut to getting a list of sink dictionaries.
@@ -166,12 +332,33 @@ def get_sink_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
     return list(map(_audio_device_to_dict, list_sinks(pulseaudio)))
 
 
+@metrics.timed
 def get_module_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
     """
     Shortcut to getting a list of module dictionaries.
     :return:
     """
-    return list(map( _module_to_dict, list_modules(pulseaudio)))
+    module_list = list(map(_module_to_dict, list_modules(pulseaudio)))
+    prune_module_cache(module["id"] for module in module_list)
+    return module_list
+
+
+@metrics.timed
+def get_sink_input_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
+    """
+    Shortcut to getting a list of sink input (playback stream) dictionaries.
+    :return:
+    """
+    return list(map(_sink_input_to_dict, list_sink_inputs(pulseaudio)))
+
+
+@metrics.timed
+def get_source_output_list(pulseaudio: pulsectl.Pulse) -> List[Dict]:
+    """
+    Shortcut to getting a list of source output (recording stream) dictionaries.
+    :return:
+    """
+    return list(map(_source_output_to_dict, list_source_outputs(pulseaudio)))
 
 
 """
@@ -179,81 +366,478 @@ Start of module creation.
 """
 
 
-def create_loopback(source_id: str, sink_id: str):
+class ModuleError(Exception):
+    """
+    Base class for failures while loading or unloading PulseAudio modules.
+    """
+
+
+class ModuleLoadError(ModuleError):
+    """
+    Raised when the server refuses to load a module.
+    """
+
+
+class ModuleUnloadError(ModuleError):
+    """
+    Raised when a module could not be unloaded.
+    """
+
+
+class FeedbackLoopError(ModuleLoadError):
+    """
+    Raised instead of loading a loopback that would route a device's audio back into itself.
+    """
+
+
+class LoopbackOptionsError(ModuleError):
+    """
+    Raised for an unknown loopback preset or an invalid loopback option.
+    """
+
+
+class StreamMoveError(ModuleError):
+    """
+    Raised when a stream could not be moved to another sink or source.
+    """
+
+
+class ModuleBatchError(ModuleError):
+    """
+    Raised when some operations of a batch failed. The remaining operations of the batch were still carried out.
+    """
+    def __init__(self, message: str, completed: List[int], failures: List[ModuleError]):
+        super().__init__(message)
+        self.completed = completed
+        self.failures = failures
+
+
+@metrics.timed
+def load_module(pulseaudio: pulsectl.Pulse, name: str, arguments: str) -> int:
+    """
+    Loads a module through the given connection.
+    :param pulseaudio: Connection to the server.
+    :param name: Module name, for example module-loopback.
+    :param arguments: Module argument string.
+    :return: Index of the newly loaded module.
+    """
+    try:
+        index = pulseaudio.module_load(name, arguments)
+    except pulsectl.PulseError as error:
+        raise ModuleLoadError("Loading {} with arguments \"{}\" failed: {}".format(name, arguments, error)) from error
+    # pulsectl 20.5 reports a refused load by returning PA_INVALID_INDEX instead of raising.
+    if index == routing.INVALID_INDEX:
+        raise ModuleLoadError("Loading {} with arguments \"{}\" failed: the server refused it.".format(name, arguments))
+    return index
+
+
+@metrics.timed
+def get_routing_graph(pulseaudio: pulsectl.Pulse) -> routing.RoutingGraph:
+    """
+    Shortcut to building the routing graph of the server.
+    :return:
+    """
+    return routing.RoutingGraph.from_lists(get_sink_list(pulseaudio), get_source_list(pulseaudio),
+                                           get_module_list(pulseaudio))
+
+
+def check_loopback(routing_graph: routing.RoutingGraph, source_id: str, sink_id: str) -> Optional[Tuple]:
+    """
+    Adds a proposed loopback to the routing graph, refusing it if it would close a feedback loop.
+    A source or sink the graph does not know is left for the server to reject.
+    :param routing_graph:
+    :param source_id: Index or name of the source.
+    :param sink_id: Index or name of the sink.
+    :return: The edge if it was new to the graph, otherwise None.
+    """
+    source = routing_graph.resolve(routing.SOURCE, source_id)
+    sink = routing_graph.resolve(routing.SINK, sink_id)
+    if source is None or sink is None or sink in routing_graph.edges[source]:
+        return None
+    cycle = routing_graph.add_edge(source, sink)
+    if cycle is not None:
+        raise FeedbackLoopError("A loopback from source {} to sink {} would create the feedback loop {}".format(
+            source_id, sink_id, routing_graph.format_path(cycle)))
+    return source, sink
+
+
+def loopback_sample_spec(routing_graph: routing.RoutingGraph, source_id: str, sink_id: str) -> Optional[Dict]:
+    """
+    Picks the sample spec of a loopback's streams: the sink's, so the sink input plays without conversion. When the
+    source runs at another rate, the route has to resample somewhere, which is logged as a warning.
+    :param routing_graph: Routing that knows the devices.
+    :param source_id: Index or name of the source.
+    :param sink_id: Index or name of the sink.
+    :return: The sample spec, or None if it is unknown.
+    """
+    source = routing_graph.devices.get(routing_graph.resolve(routing.SOURCE, source_id), {})
+    sink = routing_graph.devices.get(routing_graph.resolve(routing.SINK, sink_id), {})
+    source_spec, sink_spec = source.get("sample_spec"), sink.get("sample_spec")
+    if source_spec is not None and sink_spec is not None and source_spec["rate"] != sink_spec["rate"]:
+        logger.warning("The loopback from {} ({} Hz) to {} ({} Hz) will resample.".format(
+            source["name"], source_spec["rate"], sink["name"], sink_spec["rate"]))
+    return sink_spec
+
+
+class LoopbackOptions(NamedTuple):
+    """
+    Tuning of a module-loopback. Options left at None are not passed, so the module's own default applies.
+    """
+    latency_msec: Optional[int] = 1
+    max_latency_msec: Optional[int] = None
+    adjust_time: Optional[int] = None
+    resample_method: Optional[str] = None
+    channels: Optional[int] = None
+    channel_map: Optional[str] = None
+
+    def to_arguments(self) -> Dict[str, str]:
+        return {name: str(value) for name, value in self._asdict().items() if value is not None}
+
+
+LOOPBACK_INTEGER_OPTIONS = ["latency_msec", "max_latency_msec", "adjust_time", "channels"]
+
+DEFAULT_LOOPBACK_PRESET = "default"
+LOOPBACK_PRESETS = {
+    DEFAULT_LOOPBACK_PRESET: LoopbackOptions(),
+    # Small buffers, corrected every second; costs wakeups and risks underruns on a busy machine.
+    "low-latency": LoopbackOptions(latency_msec=5, max_latency_msec=20, adjust_time=1),
+    # Large buffers, rarely re-adjusted, with a cheap resampler.
+    "low-CPU": LoopbackOptions(latency_msec=200, adjust_time=20, resample_method="speex-fixed-1"),
+}
+
+
+def loopback_options(preset: str = DEFAULT_LOOPBACK_PRESET, **overrides) -> LoopbackOptions:
+    """
+    Builds loopback options from a preset, replacing the options given as keyword arguments. Overrides that are None
+    or empty keep the preset's value, so unset command line flags and empty GUI fields can be passed as they are.
+    :param preset: One of LOOPBACK_PRESETS.
+    :param overrides: LoopbackOptions fields, as values or strings.
+    :return:
+    """
+    if preset not in LOOPBACK_PRESETS:
+        raise LoopbackOptionsError("Unknown loopback preset \"{}\", known presets are {}.".format(
+            preset, ", ".join(LOOPBACK_PRESETS)))
+    unknown = set(overrides) - set(LoopbackOptions._fields)
+    if unknown:
+        raise LoopbackOptionsError("Unknown loopback options: {}".format(", ".join(sorted(unknown))))
+
+    replacements = {}
+    for name, value in overrides.items():
+        if value is None or value == "":
+            continue
+        if name in LOOPBACK_INTEGER_OPTIONS:
+            if not str(value).strip().isdigit():
+                raise LoopbackOptionsError("Loopback option {} must be a whole number, got {!r}.".format(name, value))
+            value = int(value)
+        replacements[name] = value
+    return LOOPBACK_PRESETS[preset]._replace(**replacements)
+
+
+def loopback_arguments(source_id: str, sink_id: str, options: LoopbackOptions,
+                       sample_spec: Optional[Dict]) -> str:
     """
-    Creates a loopback with the given source id and sink id.
+    :return: Module arguments of a loopback with the given options, streaming in the given sample spec. Channels set in
+    the options replace the sample spec's channel count and map.
+    """
+    arguments = {"sink": sink_id, "source": source_id}
+    arguments.update(sample_spec_arguments(sample_spec))
+    if options.channels is not None or options.channel_map is not None:
+        arguments.pop("channels", None)
+        arguments.pop("channel_map", None)
+    arguments.update(options.to_arguments())
+    return format_module_arguments(arguments)
+
+
+@metrics.timed
+def create_loopback(pulseaudio: pulsectl.Pulse, source_id: str, sink_id: str,
+                    routing_graph: Optional[routing.RoutingGraph] = None,
+                    options: Optional[LoopbackOptions] = None) -> int:
+    """
+    Creates a loopback with the given source id and sink id, unless it would feed the sink back into the source.
+    The loopback's streams use the sink's sample spec.
+    :param pulseaudio: Connection to the server.
     :param source_id:
     :param sink_id:
-    :return: Error code from the subprocess call.
+    :param routing_graph: Current routing, which the new loopback is added to. Fetched from the server if not given.
+    :param options: Latency and resampling options; the default preset if not given.
+    :return: Index of the new loopback module.
     """
     logger.info("Creating a loopback.")
     logger.debug("Creating a loopback with source {} and sink {}".format(source_id, sink_id))
-    returned_value = subprocess.call("pactl load-module module-loopback sink={} source={} latency_msec=1".format(
-        sink_id, source_id), shell=True, stdout=subprocess.PIPE)
-    if returned_value is 1:
+    if routing_graph is None:
+        routing_graph = get_routing_graph(pulseaudio)
+    try:
+        new_edge = check_loopback(routing_graph, source_id, sink_id)
+    except FeedbackLoopError as error:
+        logger.warning(str(error))
+        raise
+    if options is None:
+        options = LOOPBACK_PRESETS[DEFAULT_LOOPBACK_PRESET]
+    arguments = loopback_arguments(source_id, sink_id, options,
+                                   loopback_sample_spec(routing_graph, source_id, sink_id))
+    try:
+        module_index = load_module(pulseaudio, "module-loopback", arguments)
+    except ModuleLoadError:
         logger.warning("Creation of loopback with source {} and sink {} failed!".format(source_id, sink_id))
-    elif returned_value is 0:
-        logger.debug("Creation of loopback with source {} and sink {} successful.".format(source_id, sink_id))
-    else:
-        logger.error("Creation of loopback with source {} and sink {} failed with an unexpected error: {}".format(
-            source_id, sink_id, returned_value))
-    return returned_value
+        if new_edge is not None:
+            routing_graph.remove_edge(*new_edge)
+        raise
+    logger.debug("Creation of loopback with source {} and sink {} successful.".format(source_id, sink_id))
+    return module_index
+
+
+@metrics.timed
+def get_default_sample_spec(pulseaudio: pulsectl.Pulse) -> Optional[Dict]:
+    """
+    :param pulseaudio: Connection to the server.
+    :return: Sample spec of the default sink, in the form of the "sample_spec" of device dictionaries, or None.
+    """
+    try:
+        default_sink = pulseaudio.get_sink_by_name(pulseaudio.server_info().default_sink_name)
+    except pulsectl.PulseError as error:
+        logger.debug("Could not look up the default sink: {}".format(error))
+        return None
+    return _sample_spec_to_dict(default_sink)
+
+
+def sample_spec_arguments(sample_spec: Optional[Dict]) -> Dict[str, str]:
+    """
+    :param sample_spec: Sample spec as found in device dictionaries.
+    :return: The rate, format, channels and channel_map module arguments that reproduce it.
+    """
+    if sample_spec is None:
+        return {}
+    return {name: str(sample_spec[name]) for name in ("rate", "format", "channels", "channel_map")
+            if sample_spec.get(name) is not None}
 
 
-def create_virtual_sink(sink_name: str):
+@metrics.timed
+def create_virtual_sink(pulseaudio: pulsectl.Pulse, sink_name: str, sample_spec: Optional[Dict] = None) -> int:
     """
-    Creates a virtual/null sink with the given name.
+    Creates a virtual/null sink with the given name. By default it runs at the rate, format and channel map of the
+    default sink, so routing it to the hardware needs no resampling.
+    :param pulseaudio: Connection to the server.
     :param sink_name:
-    :return: Error code from the subprocess call.
+    :param sample_spec: Sample spec for the sink, as found in device dictionaries. Defaults to the default sink's.
+    :return: Index of the new null sink module.
     """
     logger.info("Creating a virtual sink.")
     logger.debug("Creation a virtual sink with name {}".format(sink_name))
-    returned_value = subprocess.call("pactl load-module module-null-sink sink_name={} "
-                                     "sink_properties=device.description={} rate=48000".format(sink_name, sink_name),
-                                     shell=True, stdout=subprocess.PIPE)
-    if returned_value is 1:
+    if sample_spec is None:
+        sample_spec = get_default_sample_spec(pulseaudio)
+    # 48 kHz was the fixed rate before sample specs were looked up, and stays the fallback.
+    spec_arguments = sample_spec_arguments(sample_spec) or {"rate": "48000"}
+    try:
+        module_index = load_module(pulseaudio, "module-null-sink",
+                                    "sink_name={} sink_properties=device.description={} {}".format(
+                                        sink_name, sink_name, format_module_arguments(spec_arguments)))
+    except ModuleLoadError:
         logger.warning("Creation of virtual sink with name {} failed!".format(sink_name))
-    elif returned_value is 0:
-        logger.debug("Creation of virtual sink with name {} successful.".format(sink_name))
-    else:
-        logger.error("Creation of virtual sink with name {} failed with an unexpected error: {}".format(sink_name,
-                                                                                                        returned_value))
-    return returned_value
+        raise
+    logger.debug("Creation of virtual sink with name {} successful.".format(sink_name))
+    return module_index
 
 
-def create_remapped_source(remapped_source_name: str, source_id: str):
+@metrics.timed
+def create_remapped_source(pulseaudio: pulsectl.Pulse, remapped_source_name: str, source_id: str) -> int:
+    """
+    Creates a remapped source with the given name on top of the given master source.
+    :param pulseaudio: Connection to the server.
+    :param remapped_source_name:
+    :param source_id:
+    :return: Index of the new remap module.
+    """
     logger.info("Creating a remapped source.")
     logger.debug("Creating a remapped source with the name of {} from ID of {}".format(remapped_source_name, source_id))
-    returned_value = subprocess.call("pactl load-module module-remap-source master={} source_name={} "
-                                     "source_properties=device.description={}".format(source_id, remapped_source_name,
-                                                                                      remapped_source_name), shell=True,
-                                     stdout=subprocess.PIPE)
-    if returned_value is 1:
+    try:
+        module_index = load_module(pulseaudio, "module-remap-source",
+                                    "master={} source_name={} source_properties=device.description={}".format(
+                                        source_id, remapped_source_name, remapped_source_name))
+    except ModuleLoadError:
         logger.warning("Creation of remapped source with name {} and ID of {} failed!".format(remapped_source_name,
                                                                                               source_id))
-    elif returned_value is 0:
-        logger.warning("Creation of remapped source with name {} and ID of {} successful!".format(remapped_source_name,
-                                                                                                  source_id))
-    else:
-        logger.warning("Creation of remapped source with name {} and ID of {} failed with an unexpected error: {}".
-                       format(remapped_source_name, source_id, returned_value))
-    return returned_value
+        raise
+    logger.debug("Creation of remapped source with name {} and ID of {} successful.".format(remapped_source_name,
+                                                                                           source_id))
+    return module_index
 
 
-def delete_module(module_id: str):
+@metrics.timed
+def delete_module(pulseaudio: pulsectl.Pulse, module_id: Union[int, str]) -> int:
     """
     Deletes/unloads a module with the given module id.
+    :param pulseaudio: Connection to the server.
     :param module_id:
-    :return: Error code from the subprocess call.
+    :return: Index of the unloaded module.
     """
     logger.info("Removing module.")
     logger.debug("Removing module with an ID of {}".format(module_id))
-    returned_value = subprocess.call("pactl unload-module {}".format(module_id), shell=True, stdout=subprocess.PIPE)
-    if returned_value is 1:
+    try:
+        module_index = int(module_id)
+    except ValueError as error:
         logger.warning("Removal of module with ID of {} failed!".format(module_id))
-    elif returned_value is 0:
-        logger.debug("Removal of module with ID of {} successful.".format(module_id))
-    else:
-        logger.error("Removal of module with ID of {} failed with an unexpected error: {}".format(module_id,
-                                                                                                  returned_value))
-    return returned_value
+        raise ModuleUnloadError("\"{}\" is not a module index.".format(module_id)) from error
+
+    try:
+        pulseaudio.module_unload(module_index)
+    except pulsectl.PulseError as error:
+        logger.warning("Removal of module with ID of {} failed!".format(module_id))
+        raise ModuleUnloadError("Unloading module {} failed: {}".format(module_index, error)) from error
+    forget_module(module_index)
+    logger.debug("Removal of module with ID of {} successful.".format(module_id))
+    return module_index
+
+
+def _run_batch(description: str, operations: List) -> List[int]:
+    """
+    Runs every operation even if some fail, so one bad id does not abort the rest of a batch.
+    :param description: What the batch does, for the log and the error message.
+    :param operations: Callables each returning a module index.
+    :return: Module indices returned by the operations.
+    """
+    completed: List[int] = []
+    failures: List[ModuleError] = []
+    for operation in operations:
+        try:
+            completed.append(operation())
+        except ModuleError as error:
+            failures.append(error)
+
+    logger.info("{}: {} succeeded, {} failed.".format(description, len(completed), len(failures)))
+    if failures:
+        raise ModuleBatchError("{}: {} of {} operations failed.".format(description, len(failures), len(operations)),
+                               completed, failures)
+    return completed
+
+
+@metrics.timed
+def create_loopbacks(pulseaudio: pulsectl.Pulse, source_ids: List[str], sink_ids: List[str],
+                     options: Optional[LoopbackOptions] = None) -> List[int]:
+    """
+    Creates a loopback from every given source to every given sink. The routing is fetched once, and each loopback
+    is checked for feedback loops together with the ones created before it.
+    :param pulseaudio: Connection to the server.
+    :param source_ids:
+    :param sink_ids:
+    :param options: Options shared by all the loopbacks.
+    :return: Indices of the new loopback modules.
+    """
+    routing_graph = get_routing_graph(pulseaudio)
+    return _run_batch("Creating {}x{} loopbacks".format(len(source_ids), len(sink_ids)), [
+        lambda source_id=source_id, sink_id=sink_id: create_loopback(pulseaudio, source_id, sink_id, routing_graph,
+                                                                     options)
+        for source_id in source_ids for sink_id in sink_ids
+    ])
+
+
+@metrics.timed
+def delete_modules(pulseaudio: pulsectl.Pulse, module_ids: List[Union[int, str]]) -> List[int]:
+    """
+    Deletes/unloads every given module.
+    :param pulseaudio: Connection to the server.
+    :param module_ids:
+    :return: Indices of the unloaded modules.
+    """
+    return _run_batch("Removing {} modules".format(len(module_ids)), [
+        lambda module_id=module_id: delete_module(pulseaudio, module_id)
+        for module_id in module_ids
+    ])
+
+
+"""
+Start of stream moving.
+"""
+
+
+@metrics.timed
+def move_sink_input(pulseaudio: pulsectl.Pulse, stream_id: Union[int, str], sink_id: Union[int, str]) -> int:
+    """
+    Moves a playback stream to another sink.
+    :param pulseaudio: Connection to the server.
+    :param stream_id: Index of the sink input.
+    :param sink_id: Index of the sink to move it to.
+    :return: Index of the moved sink input.
+    """
+    try:
+        stream_index, sink_index = int(stream_id), int(sink_id)
+        pulseaudio.sink_input_move(stream_index, sink_index)
+    except (ValueError, pulsectl.PulseError) as error:
+        raise StreamMoveError("Moving sink input {} to sink {} failed: {}".format(stream_id, sink_id, error)) \
+            from error
+    return stream_index
+
+
+@metrics.timed
+def move_source_output(pulseaudio: pulsectl.Pulse, stream_id: Union[int, str], source_id: Union[int, str]) -> int:
+    """
+    Moves a recording stream to another source.
+    :param pulseaudio: Connection to the server.
+    :param stream_id: Index of the source output.
+    :param source_id: Index of the source to move it to.
+    :return: Index of the moved source output.
+    """
+    try:
+        stream_index, source_index = int(stream_id), int(source_id)
+        pulseaudio.source_output_move(stream_index, source_index)
+    except (ValueError, pulsectl.PulseError) as error:
+        raise StreamMoveError("Moving source output {} to source {} failed: {}".format(
+            stream_id, source_id, error)) from error
+    return stream_index
+
+
+@metrics.timed
+def move_sink_inputs(pulseaudio: pulsectl.Pulse, stream_ids: List[Union[int, str]],
+                     sink_id: Union[int, str]) -> List[int]:
+    """
+    Moves every given playback stream to one sink. pulsectl's API is synchronous, so this is one round trip per
+    stream, made back to back on the one connection rather than pipelined.
+    :return: Indices of the moved sink inputs.
+    """
+    return _run_batch("Moving {} sink inputs to sink {}".format(len(stream_ids), sink_id), [
+        lambda stream_id=stream_id: move_sink_input(pulseaudio, stream_id, sink_id)
+        for stream_id in stream_ids
+    ])
+
+
+@metrics.timed
+def move_source_outputs(pulseaudio: pulsectl.Pulse, stream_ids: List[Union[int, str]],
+                        source_id: Union[int, str]) -> List[int]:
+    """
+    Moves every given recording stream to one source, with one round trip per stream like move_sink_inputs.
+    :return: Indices of the moved source outputs.
+    """
+    return _run_batch("Moving {} source outputs to source {}".format(len(stream_ids), source_id), [
+        lambda stream_id=stream_id: move_source_output(pulseaudio, stream_id, source_id)
+        for stream_id in stream_ids
+    ])
+
+
+@metrics.timed
+def move_all_sink_inputs(pulseaudio: pulsectl.Pulse, from_sink_id: Union[int, str],
+                         to_sink_id: Union[int, str]) -> List[int]:
+    """
+    Moves every playback stream of one sink to another sink. The streams are listed once, then moved one by one.
+    :return: Indices of the moved sink inputs.
+    """
+    try:
+        from_sink_index = int(from_sink_id)
+    except ValueError as error:
+        raise StreamMoveError("Invalid sink id \"{}\".".format(from_sink_id)) from error
+    stream_ids = [stream.index for stream in list_sink_inputs(pulseaudio) if stream.sink == from_sink_index]
+    return move_sink_inputs(pulseaudio, stream_ids, to_sink_id)
+
+
+@metrics.timed
+def move_all_source_outputs(pulseaudio: pulsectl.Pulse, from_source_id: Union[int, str],
+                            to_source_id: Union[int, str]) -> List[int]:
+    """
+    Moves every recording stream of one source to another source. The streams are listed once, then moved one by
+    one.
+    :return: Indices of the moved source outputs.
+    """
+    try:
+        from_source_index = int(from_source_id)
+    except ValueError as error:
+        raise StreamMoveError("Invalid source id \"{}\".".format(from_source_id)) from error
+    stream_ids = [stream.index for stream in list_source_outputs(pulseaudio) if stream.source == from_source_index]
+    return move_source_outputs(pulseaudio, stream_ids, to_source_id)
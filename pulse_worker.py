@@ -0,0 +1,169 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import pulsectl
+
+import connection
+import metrics
+import profiling
+import state_store
+
+logger = logging.getLogger("Main")
+
+# How long the worker waits for server events before checking its request queue again. submit() wakes the worker
+# early, so this only bounds the delay if that wake-up races with the start of a listen.
+EVENT_LISTEN_TIMEOUT = 0.1
+
+
+class PulseWorker(threading.Thread):
+    """
+    Thread that owns the pulsectl connection, since pulsectl is not thread safe.
+    Jobs are submitted from the GUI thread and executed here in order. Their results, and any changes to the state
+    store, are handed back through a queue that the GUI thread drains with dispatch_results().
+    """
+    def __init__(self, store: state_store.StateStore, client_name: str = "pulseaudio-loopback-tool"):
+        super().__init__(name="PulseWorker", daemon=True)
+        self.store = store
+        self.connection = connection.ConnectionManager(client_name)
+        self.connection.on_connect = self._on_connect
+        self.connection.on_disconnect = self._on_disconnect
+
+        # Called on the dispatching thread with the changed kinds and a snapshot of their lists.
+        self.on_state_change: Optional[Callable[[Set[str], Dict[str, List[Dict]]], None]] = None
+        # Called on the dispatching thread with True after every (re)connect and False when the connection is lost.
+        self.on_connection_change: Optional[Callable[[bool], None]] = None
+        # Called on the worker thread whenever results are queued, for dispatchers that wait for results instead of
+        # polling for them. It must not block.
+        self.on_results_ready: Optional[Callable[[], None]] = None
+
+        # Only touched from the dispatching thread.
+        self.in_flight = 0
+        self.connected = False
+
+        self._requests: queue.Queue = queue.Queue()
+        self._results: queue.Queue = queue.Queue()
+        self._running = True
+
+    def submit(self, function: Callable, *args, on_success: Callable = None, on_error: Callable = None,
+               action: str = None):
+        """
+        Queues function(pulseaudio, *args) to run on the worker thread.
+        :param function: Callable taking the connection as its first argument.
+        :param on_success: Called with the return value on the dispatching thread.
+        :param on_error: Called with the raised exception on the dispatching thread.
+        :param action: Name of the job in metrics and profiles, the function's name by default.
+        :return:
+        """
+        if action is None:
+            action = getattr(function, "__name__", str(function))
+        self.in_flight += 1
+        self._requests.put((function, args, on_success, on_error, action, time.perf_counter()))
+        self._wake()
+
+    def request_reload(self):
+        """
+        Queues a full reload of the state store.
+        :return:
+        """
+        self.submit(self._reload, action="global_refresh")
+
+    def stop(self):
+        self._running = False
+        self.connection.stop()
+
+    def _wake(self):
+        self.connection.wake()
+
+    def dispatch_results(self):
+        """
+        Runs the callbacks of every finished job. Must be called from the thread that submits jobs.
+        :return:
+        """
+        while True:
+            try:
+                finished, callback, value = self._results.get_nowait()
+            except queue.Empty:
+                return
+            if finished:
+                self.in_flight -= 1
+            if callback is not None:
+                callback(value)
+
+    def run(self):
+        self.connection.run(self._serve)
+
+    def _put_result(self, finished: bool, callback: Optional[Callable], value):
+        self._results.put((finished, callback, value))
+        if self.on_results_ready is not None:
+            self.on_results_ready()
+
+    def _on_connect(self, pulseaudio: pulsectl.Pulse):
+        # A fresh connection knows nothing of what happened while disconnected, so everything is resynced at once.
+        self.store.subscribe(pulseaudio)
+        with profiling.profile("connect"):
+            self._post_state_change(self.store.load(pulseaudio))
+        self._put_result(False, self._dispatch_connection_change, True)
+
+    def _on_disconnect(self):
+        self._put_result(False, self._dispatch_connection_change, False)
+
+    def _serve(self, pulseaudio: pulsectl.Pulse):
+        while self._running:
+            self._run_requests(pulseaudio)
+            pulseaudio.event_listen(timeout=EVENT_LISTEN_TIMEOUT)
+            if self.store.has_pending_events():
+                self._post_state_change(self.store.apply_pending(pulseaudio))
+
+    def _run_requests(self, pulseaudio: pulsectl.Pulse):
+        while True:
+            try:
+                function, args, on_success, on_error, action, submitted = self._requests.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                with profiling.profile(action):
+                    value = function(pulseaudio, *args)
+            except Exception as error:
+                self._observe_action(action, submitted)
+                if on_error is None:
+                    logger.exception("Unhandled error in {}.".format(action))
+                self._put_result(True, on_error, error)
+                if not pulseaudio.connected:
+                    raise pulsectl.PulseDisconnected()
+            else:
+                self._observe_action(action, submitted)
+                self._put_result(True, on_success, value)
+
+    @staticmethod
+    def _observe_action(action: str, submitted: float):
+        # Includes the time the job waited behind earlier ones, which is what the user waited for.
+        metrics.GUI_ACTION_SECONDS.observe(action, time.perf_counter() - submitted)
+
+    def _reload(self, pulseaudio: pulsectl.Pulse):
+        self._post_state_change(self.store.load(pulseaudio))
+
+    def _post_state_change(self, changed_kinds: Set[str]):
+        if not changed_kinds:
+            return
+        getters = {
+            state_store.SINK: self.store.get_sink_list,
+            state_store.SOURCE: self.store.get_source_list,
+            state_store.MODULE: self.store.get_module_list,
+            state_store.SINK_INPUT: self.store.get_sink_input_list,
+            state_store.SOURCE_OUTPUT: self.store.get_source_output_list,
+        }
+        snapshot = {kind: getters[kind]() for kind in changed_kinds}
+        self._put_result(False, self._dispatch_state_change, (changed_kinds, snapshot))
+
+    def _dispatch_state_change(self, change):
+        if self.on_state_change is not None:
+            self.on_state_change(*change)
+
+    def _dispatch_connection_change(self, connected: bool):
+        self.connected = connected
+        if self.on_connection_change is not None:
+            self.on_connection_change(connected)
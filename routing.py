@@ -0,0 +1,176 @@
+"""
+Graph of where audio flows between sinks and sources, used to refuse loopbacks that would feed a device back into
+itself.
+Nodes are sinks and sources. A sink flows into its monitor source, a remapped source is fed by its master source and a
+loopback carries audio from its source to its sink. The graph keeps its nodes in a topological order that is repaired
+locally as edges are added (Pearce and Kelly's dynamic topological sort), so checking a proposed edge usually only
+looks at a handful of nodes and never walks the whole graph.
+"""
+import logging
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger("Main")
+
+SINK = "sink"
+SOURCE = "source"
+# Value PulseAudio uses for "no index", for example as monitor_of_sink of a source that is not a monitor.
+INVALID_INDEX = 0xFFFFFFFF
+
+Node = Tuple[str, int]
+
+
+class RoutingGraph:
+    def __init__(self):
+        self.edges: Dict[Node, Set[Node]] = {}
+        self.reverse_edges: Dict[Node, Set[Node]] = {}
+        # Position of each node in a topological order: every edge points from a lower to a higher position.
+        self.order: Dict[Node, int] = {}
+        # Edges that already closed a loop on the server. They are kept out of the graph so the order stays valid.
+        self.cyclic_edges: List[Tuple[Node, Node]] = []
+        self.names: Dict[Node, str] = {}
+        # Device dictionaries the nodes were built from, where known.
+        self.devices: Dict[Node, Dict] = {}
+        self._nodes_by_name: Dict[Tuple[str, str], Node] = {}
+
+    @classmethod
+    def from_lists(cls, sink_list: List[Dict], source_list: List[Dict], module_list: List[Dict]) -> "RoutingGraph":
+        """
+        Builds the graph from the dictionaries made by program_logic.
+        :param sink_list:
+        :param source_list:
+        :param module_list:
+        :return:
+        """
+        graph = cls()
+        for sink in sink_list:
+            graph.add_node(SINK, sink["id"], sink["name"], sink)
+        for source in source_list:
+            graph.add_node(SOURCE, source["id"], source["name"], source)
+
+        for source in source_list:
+            monitor_of_sink = source.get("monitor_of_sink")
+            if monitor_of_sink is not None and (SINK, monitor_of_sink) in graph.order:
+                graph.add_existing_edge((SINK, monitor_of_sink), (SOURCE, source["id"]))
+
+        for module in module_list:
+            attributes = module["attributes"]
+            if module["name"] == "module-remap-source":
+                master = graph.resolve(SOURCE, attributes.get("master"))
+                remapped = graph.resolve(SOURCE, attributes.get("source_name"))
+                if master is not None and remapped is not None:
+                    graph.add_existing_edge(master, remapped)
+            elif module["name"] == "module-loopback":
+                source = graph.resolve(SOURCE, attributes.get("source"))
+                sink = graph.resolve(SINK, attributes.get("sink"))
+                if source is not None and sink is not None:
+                    graph.add_existing_edge(source, sink)
+        return graph
+
+    def add_node(self, kind: str, index: int, name: str, device: Optional[Dict] = None) -> Node:
+        node = (kind, index)
+        if node not in self.order:
+            self.order[node] = len(self.order)
+            self.edges[node] = set()
+            self.reverse_edges[node] = set()
+        self.names[node] = name
+        if device is not None:
+            self.devices[node] = device
+        self._nodes_by_name[(kind, name)] = node
+        return node
+
+    def resolve(self, kind: str, reference: Optional[Union[int, str]]) -> Optional[Node]:
+        """
+        :param kind: SINK or SOURCE.
+        :param reference: Index or name of a device, as given to a module argument.
+        :return: The node, or None if no such device is known.
+        """
+        if reference is None:
+            return None
+        reference = str(reference)
+        if reference.isdigit() and (kind, int(reference)) in self.order:
+            return kind, int(reference)
+        return self._nodes_by_name.get((kind, reference))
+
+    def add_existing_edge(self, from_node: Node, to_node: Node):
+        """
+        Adds an edge that already exists on the server. A loop found here was made outside this program, so it is only
+        reported.
+        """
+        cycle = self.add_edge(from_node, to_node)
+        if cycle is not None:
+            self.cyclic_edges.append((from_node, to_node))
+            logger.warning("Existing routing already contains a feedback loop: {}".format(self.format_path(cycle)))
+
+    def add_edge(self, from_node: Node, to_node: Node) -> Optional[List[Node]]:
+        """
+        Adds an edge unless it would close a loop.
+        :param from_node:
+        :param to_node:
+        :return: None if the edge was added, otherwise the loop it would have closed, starting and ending at from_node.
+        """
+        if to_node in self.edges[from_node]:
+            return None
+        lower_bound, upper_bound = self.order[to_node], self.order[from_node]
+        if lower_bound <= upper_bound:
+            # The edge goes against the current order, so the nodes between the two ends may need to be reordered.
+            forward = self._search(to_node, self.edges, lambda node: self.order[node] <= upper_bound, from_node)
+            if isinstance(forward, list):
+                return [from_node] + forward
+            backward = self._search(from_node, self.reverse_edges, lambda node: self.order[node] >= lower_bound)
+            self._reorder(backward, forward)
+
+        self.edges[from_node].add(to_node)
+        self.reverse_edges[to_node].add(from_node)
+        return None
+
+    def remove_edge(self, from_node: Node, to_node: Node):
+        # Removing an edge never invalidates the order, so nothing else needs to change.
+        self.edges[from_node].discard(to_node)
+        self.reverse_edges[to_node].discard(from_node)
+
+    def would_create_cycle(self, from_node: Node, to_node: Node) -> Optional[List[Node]]:
+        """
+        Checks an edge without adding it.
+        :return: The loop the edge would close, or None.
+        """
+        if self.order[to_node] > self.order[from_node]:
+            return None
+        upper_bound = self.order[from_node]
+        path = self._search(to_node, self.edges, lambda node: self.order[node] <= upper_bound, from_node)
+        return [from_node] + path if isinstance(path, list) else None
+
+    @staticmethod
+    def _search(start: Node, edges: Dict[Node, Set[Node]], inside, target: Optional[Node] = None):
+        """
+        Depth first search from start through the nodes accepted by inside.
+        :return: The path from start to target if target was reached, otherwise the set of visited nodes.
+        """
+        parents: Dict[Node, Optional[Node]] = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path[::-1]
+            for next_node in edges[node]:
+                if next_node not in parents and inside(next_node):
+                    parents[next_node] = node
+                    stack.append(next_node)
+        return set(parents)
+
+    def _reorder(self, backward: Set[Node], forward: Set[Node]):
+        """
+        Gives the nodes that reach the new edge's start the lowest of their joint positions and the nodes reached from
+        its end the highest, keeping the relative order within each group.
+        """
+        backward_nodes = sorted(backward, key=self.order.__getitem__)
+        forward_nodes = sorted(forward, key=self.order.__getitem__)
+        positions = sorted(self.order[node] for node in backward_nodes + forward_nodes)
+        for node, position in zip(backward_nodes + forward_nodes, positions):
+            self.order[node] = position
+
+    def format_path(self, path: List[Node]) -> str:
+        return " -> ".join("{} {}".format(kind, self.names.get((kind, index), index)) for kind, index in path)
@@ -0,0 +1,106 @@
+"""
+Token index behind the filter boxes of the GUI lists.
+Every item is split into lower case alphanumeric tokens taken from its id, name, description and module attributes.
+Each query token matches the tokens it is a prefix of, and an item matches a query when all of the query's tokens
+match one of its tokens. The index is updated per changed item, so a keystroke never rescans the whole list.
+"""
+import bisect
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def item_tokens(item: Dict) -> Set[str]:
+    """
+    :param item: Sink, source or module dictionary as made by program_logic.
+    :return: Tokens the item can be found by.
+    """
+    texts = [str(item["id"]), item.get("name", ""), item.get("description") or "", item.get("nice_name", "")]
+    for key, value in item.get("attributes", {}).items():
+        texts.append(key)
+        texts.append(value)
+    tokens = set()
+    for text in texts:
+        tokens.update(tokenize(text))
+    return tokens
+
+
+class SearchIndex:
+    def __init__(self):
+        self._items: Dict[int, Dict] = {}
+        self._tokens_of_id: Dict[int, Set[str]] = {}
+        self._ids_of_token: Dict[str, Set[int]] = {}
+        # Every indexed token in order, so the tokens sharing a prefix form one contiguous slice.
+        self._sorted_tokens: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def update(self, item_list: Iterable[Dict]):
+        """
+        Brings the index in line with item_list, re-indexing only the items that were added, removed or changed.
+        :param item_list:
+        :return:
+        """
+        new_items = {item["id"]: item for item in item_list}
+        for item_id in [item_id for item_id in self._items if item_id not in new_items]:
+            self._remove(item_id)
+        for item_id, item in new_items.items():
+            old_item = self._items.get(item_id)
+            if old_item is item or old_item == item:
+                continue
+            if old_item is not None:
+                self._remove(item_id)
+            self._add(item)
+
+    def _add(self, item: Dict):
+        tokens = item_tokens(item)
+        self._items[item["id"]] = item
+        self._tokens_of_id[item["id"]] = tokens
+        for token in tokens:
+            ids = self._ids_of_token.get(token)
+            if ids is None:
+                ids = self._ids_of_token[token] = set()
+                bisect.insort(self._sorted_tokens, token)
+            ids.add(item["id"])
+
+    def _remove(self, item_id: int):
+        del self._items[item_id]
+        for token in self._tokens_of_id.pop(item_id):
+            ids = self._ids_of_token[token]
+            ids.discard(item_id)
+            if not ids:
+                del self._ids_of_token[token]
+                del self._sorted_tokens[bisect.bisect_left(self._sorted_tokens, token)]
+
+    def _prefix_matches(self, prefix: str) -> Set[int]:
+        start = bisect.bisect_left(self._sorted_tokens, prefix)
+        # Every token starting with prefix sorts below prefix followed by the highest code point.
+        end = bisect.bisect_left(self._sorted_tokens, prefix + "\uffff", start)
+        if end - start == 1:
+            return self._ids_of_token[self._sorted_tokens[start]]
+        matches = set()
+        for token in self._sorted_tokens[start:end]:
+            matches.update(self._ids_of_token[token])
+        return matches
+
+    def search(self, query: str) -> Optional[Set[int]]:
+        """
+        :param query: Text typed into a filter box.
+        :return: Ids of the matching items, or None when the query has no tokens and everything matches.
+        """
+        query_tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not query_tokens:
+            return None
+        # Longer tokens usually match fewer items, so starting with them keeps the intersection small.
+        matches = set(self._prefix_matches(query_tokens[0]))
+        for token in query_tokens[1:]:
+            if not matches:
+                break
+            matches.intersection_update(self._prefix_matches(token))
+        return matches
@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
-import Pulseaudio_Loopback_Tool
 from datetime import datetime
-import gui_logic
 import traceback
 import logging
 import argparse
@@ -21,7 +19,7 @@ def log_exception_handler(error_type, value, tb):
                         "Traceback:\n {}".format(str(error_type), str(value), "".join(traceback.format_tb(tb))))
 
 
-def setup_logging():
+def setup_logging(console_stream=sys.stdout):
     setup_logger = logging.getLogger("Main")
     log_format = logging.Formatter(FORMAT, style="{")
 
@@ -32,7 +30,7 @@ def setup_logging():
 
     # log_file_handler.setFormatter(log_format)
     log_latest_handler.setFormatter(log_format)
-    log_console_handler = logging.StreamHandler(sys.stdout)
+    log_console_handler = logging.StreamHandler(console_stream)
     log_console_handler.setFormatter(log_format)
 
     # setup_logger.addHandler(log_file_handler)
@@ -43,24 +41,146 @@ def setup_logging():
     sys.excepthook = log_exception_handler
 
 
-try:
+def build_parser() -> argparse.ArgumentParser:
+    import backends
     text = 'This program gives a GUI to help users create loopbacks, create virtual sinks, remap sources, and delete ' \
-           'relevent modules.'
+           'relevent modules. Given a command, it runs headless and prints the result as JSON instead.'
     parser = argparse.ArgumentParser(description=text)
     parser.add_argument("-o", "--old", help="Use old version", action="store_true")
+    parser.add_argument("--backend", choices=backends.BACKEND_NAMES,
+                        help="How to talk to the server: pulsectl (native, the default), pactl (runs pactl), pacmd "
+                             "(one pacmd process, only for the --old GUI and its default) or fake (in-memory server "
+                             "for testing)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile startup, refreshes and actions with cProfile and tracemalloc into logs/")
+    metrics_group = parser.add_mutually_exclusive_group()
+    metrics_group.add_argument("--metrics-port", dest="metrics_port", type=int, metavar="PORT",
+                               help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    metrics_group.add_argument("--metrics-socket", dest="metrics_socket", metavar="PATH",
+                               help="Serve Prometheus metrics over HTTP on this Unix domain socket")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    list_parser = subparsers.add_parser("list", help="List sinks, sources and relevant modules")
+    list_parser.add_argument("kind", nargs="?",
+                             choices=["sinks", "sources", "modules", "sink-inputs", "source-outputs"],
+                             help="Only list this kind of object")
+
+    create_sink_parser = subparsers.add_parser("create-sink", help="Create a virtual/null sink")
+    create_sink_parser.add_argument("sink_name")
+
+    loopback_parser = subparsers.add_parser("loopback", help="Create a loopback from a source to a sink")
+    loopback_parser.add_argument("source")
+    loopback_parser.add_argument("sink")
+    loopback_parser.add_argument("--preset", default="default",
+                                 help="Starting point for the options: default, low-latency or low-CPU")
+    loopback_parser.add_argument("--latency-msec", dest="latency_msec", type=int)
+    loopback_parser.add_argument("--max-latency-msec", dest="max_latency_msec", type=int)
+    loopback_parser.add_argument("--adjust-time", dest="adjust_time", type=int,
+                                 help="Seconds between latency adjustments, 0 to disable them")
+    loopback_parser.add_argument("--resample-method", dest="resample_method")
+    loopback_parser.add_argument("--channels", type=int)
+    loopback_parser.add_argument("--channel-map", dest="channel_map")
+
+    remap_parser = subparsers.add_parser("remap", help="Create a remapped source")
+    remap_parser.add_argument("source_name")
+    remap_parser.add_argument("master")
+
+    remove_parser = subparsers.add_parser("remove", help="Unload one or more modules")
+    remove_parser.add_argument("module_ids", nargs="+", metavar="module_id")
+
+    move_parser = subparsers.add_parser("move", help="Move streams to another sink or source")
+    move_parser.add_argument("kind", choices=["sink-inputs", "source-outputs"])
+    move_parser.add_argument("destination", help="Sink or source to move the streams to")
+    move_streams_group = move_parser.add_mutually_exclusive_group(required=True)
+    move_streams_group.add_argument("--from", dest="from_device", metavar="DEVICE",
+                                    help="Move every stream of this sink or source")
+    move_streams_group.add_argument("--streams", nargs="+", metavar="STREAM", help="Move these streams")
+
+    apply_parser = subparsers.add_parser("apply", help="Apply a topology file")
+    apply_parser.add_argument("topology_file")
+
+    supervise_parser = subparsers.add_parser("supervise", help="Keep the modules of a topology file loaded")
+    supervise_parser.add_argument("topology_file")
+
+    health_parser = subparsers.add_parser("health", help="Sample loopback latency and report unhealthy loopbacks")
+    health_parser.add_argument("--interval", type=float, default=1.0, help="Seconds between samples")
+    health_parser.add_argument("--duration", type=float, help="Seconds to run for, until interrupted by default")
+
+    serve_parser = subparsers.add_parser("serve", help="Take commands as JSON lines on a Unix domain socket")
+    serve_parser.add_argument("socket_path", nargs="?", metavar="SOCKET",
+                              help="Path of the socket, $XDG_RUNTIME_DIR/pulseaudio-loopback-tool.sock by default")
+
+    return parser
+
+
+def start_metrics_server(args: argparse.Namespace):
+    if args.metrics_port is None and args.metrics_socket is None:
+        return None
+    import metrics
+    try:
+        return metrics.serve(port=args.metrics_port, socket_path=args.metrics_socket)
+    except OSError as error:
+        # A port in use, or a metrics socket path taken by a live server or another file.
+        logging.getLogger("Main").error("Cannot serve metrics: {}".format(error))
+        sys.exit(1)
+
+
+metrics_server = None
+try:
+    parser = build_parser()
     args = parser.parse_args()
+    if args.backend == "pacmd" and (not args.old or args.command):
+        # Everything but the old GUI may need events, which pacmd cannot subscribe to.
+        parser.error("--backend pacmd can only be used for the --old GUI.")
+    import backends
+    backends.select_backend(args.backend or (backends.PACMD if args.old and not args.command
+                                             else backends.DEFAULT_BACKEND))
+
+    # Modules are imported only on the path that needs them, so headless commands never load tkinter.
+    if args.command:
+        # stdout is reserved for the JSON result.
+        setup_logging(sys.stderr)
+        metrics_server = start_metrics_server(args)
+        import profiling
+        if args.profile:
+            profiling.enable()
+        import cli
+        if args.command in cli.LONG_RUNNING_COMMANDS:
+            # These run until stopped, so they are not profiled as a whole: serve profiles each request on its worker
+            # thread and supervise each reconcile.
+            exit_code = cli.run_command(args)
+        else:
+            with profiling.profile(args.command):
+                exit_code = cli.run_command(args)
+        sys.exit(exit_code)
 
     setup_logging()
     logger = logging.getLogger("Main")
+    metrics_server = start_metrics_server(args)
+    import profiling
+    if args.profile:
+        profiling.enable()
 
     if args.old:
+        import Pulseaudio_Loopback_Tool
+        if args.profile:
+            logger.warning("The deprecated version is not profiled.")
         logger.info("Starting up deprecated version.")
         Pulseaudio_Loopback_Tool.setup_window()
         logger.info("Window appears to have been closed.")
     else:
-        gui_logic.run_gui()
+        # Startup covers importing the GUI and building every tab; loading the server state happens on the worker
+        # thread and is profiled there as "connect".
+        with profiling.profile("startup"):
+            import gui_logic
+            palt_gui = gui_logic.PaltGui()
+        palt_gui.run_gui()
         logger.info("Window appears to have been closed.")
 except KeyboardInterrupt:
     setup_logging()
     logger = logging.getLogger("Main")
     logger.info("Found KeyboardInterrupt, doing things.")
+finally:
+    if metrics_server is not None:
+        metrics_server.stop()
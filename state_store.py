@@ -0,0 +1,156 @@
+import logging
+from typing import Dict, List, Set, Tuple
+
+import pulsectl
+
+import metrics
+import program_logic
+
+logger = logging.getLogger("Main")
+
+SINK = "sink"
+SOURCE = "source"
+MODULE = "module"
+SINK_INPUT = "sink_input"
+SOURCE_OUTPUT = "source_output"
+ALL_KINDS = {SINK, SOURCE, MODULE, SINK_INPUT, SOURCE_OUTPUT}
+
+# Converts a fetched info object of each kind into the dictionary form used by the tabs.
+_CONVERTERS = {
+    SINK: program_logic._audio_device_to_dict,
+    SOURCE: program_logic._audio_device_to_dict,
+    MODULE: program_logic._module_to_dict,
+    SINK_INPUT: program_logic._sink_input_to_dict,
+    SOURCE_OUTPUT: program_logic._source_output_to_dict,
+}
+
+
+class StateStore:
+    """
+    Local copy of the sinks, sources, relevant modules and streams on the server.
+    It is filled once with load() and afterwards kept current by subscription events, so only the objects named in an
+    event are fetched again.
+    """
+    def __init__(self):
+        self.sinks: Dict[int, Dict] = {}
+        self.sources: Dict[int, Dict] = {}
+        self.modules: Dict[int, Dict] = {}
+        self.sink_inputs: Dict[int, Dict] = {}
+        self.source_outputs: Dict[int, Dict] = {}
+
+        # Events are coalesced per object; only the latest event type of an object matters.
+        self._pending_events: Dict[Tuple[str, int], str] = {}
+
+        self._tables: Dict[str, Dict[int, Dict]] = {
+            SINK: self.sinks,
+            SOURCE: self.sources,
+            MODULE: self.modules,
+            SINK_INPUT: self.sink_inputs,
+            SOURCE_OUTPUT: self.source_outputs,
+        }
+
+    def subscribe(self, pulseaudio: pulsectl.Pulse):
+        """
+        Subscribes the connection to sink, source, module and stream events and routes them into this store.
+        :param pulseaudio: Connection to the server.
+        :return:
+        """
+        pulseaudio.event_mask_set(SINK, SOURCE, MODULE, SINK_INPUT, SOURCE_OUTPUT)
+        pulseaudio.event_callback_set(self.on_event)
+
+    def on_event(self, event: pulsectl.PulseEventInfo):
+        """
+        Event callback. No server calls may be made from here, so the event is only remembered.
+        :param event: Event from pulsectl.
+        :return:
+        """
+        facility = event.facility._value
+        if facility not in self._tables:
+            return
+        self._pending_events[(facility, event.index)] = event.t._value
+
+    def has_pending_events(self) -> bool:
+        return len(self._pending_events) > 0
+
+    def load(self, pulseaudio: pulsectl.Pulse) -> Set[str]:
+        """
+        Replaces the whole store with a fresh listing from the server.
+        :param pulseaudio: Connection to the server.
+        :return: The kinds of objects that were reloaded.
+        """
+        with metrics.REFRESH_SECONDS.time("full"):
+            self._pending_events.clear()
+            for table, items in (
+                    (self.sinks, program_logic.get_sink_list(pulseaudio)),
+                    (self.sources, program_logic.get_source_list(pulseaudio)),
+                    (self.modules, program_logic.get_module_list(pulseaudio)),
+                    (self.sink_inputs, program_logic.get_sink_input_list(pulseaudio)),
+                    (self.source_outputs, program_logic.get_source_output_list(pulseaudio)),
+            ):
+                table.clear()
+                table.update((item["id"], item) for item in items)
+        return set(ALL_KINDS)
+
+    def apply_pending(self, pulseaudio: pulsectl.Pulse) -> Set[str]:
+        """
+        Applies the events received since the last call, fetching only the objects they refer to.
+        :param pulseaudio: Connection to the server.
+        :return: The kinds of objects that actually changed.
+        """
+        changed: Set[str] = set()
+        pending_events = self._pending_events
+        self._pending_events = {}
+
+        with metrics.REFRESH_SECONDS.time("events"):
+            for (facility, index), event_type in pending_events.items():
+                table = self._tables[facility]
+                item = None
+                if event_type != "remove":
+                    item = self._fetch(pulseaudio, facility, index)
+
+                if item is None:
+                    if facility == MODULE:
+                        program_logic.forget_module(index)
+                    if table.pop(index, None) is not None:
+                        changed.add(facility)
+                elif table.get(index) != item:
+                    table[index] = item
+                    changed.add(facility)
+
+        if changed:
+            logger.debug("Applied {} events, changed: {}".format(len(pending_events), ", ".join(sorted(changed))))
+        return changed
+
+    @staticmethod
+    def _fetch(pulseaudio: pulsectl.Pulse, facility: str, index: int):
+        """
+        Fetches a single object and converts it to the dictionary form used by the tabs.
+        :return: The dictionary, or None if the object is gone or not interesting to the program.
+        """
+        try:
+            info = getattr(pulseaudio, "{}_info".format(facility))(index)
+        except pulsectl.PulseIndexError:
+            return None
+
+        if facility == MODULE and info.name not in program_logic.LISTABLE_MODULE_NAMES:
+            return None
+        return _CONVERTERS[facility](info)
+
+    @staticmethod
+    def _sorted_values(table: Dict[int, Dict]) -> List[Dict]:
+        return [table[index] for index in sorted(table)]
+
+    def get_sink_list(self) -> List[Dict]:
+        return self._sorted_values(self.sinks)
+
+    def get_source_list(self) -> List[Dict]:
+        return self._sorted_values(self.sources)
+
+    def get_module_list(self) -> List[Dict]:
+        return self._sorted_values(self.modules)
+
+    def get_sink_input_list(self) -> List[Dict]:
+        return self._sorted_values(self.sink_inputs)
+
+    def get_source_output_list(self) -> List[Dict]:
+        return self._sorted_values(self.source_outputs)
@@ -0,0 +1,93 @@
+"""
+Headless mode that keeps the modules of a topology loaded.
+The supervisor sleeps in event_listen() until the server reports a removed module or a new sink or source, then
+reconciles the server with the topology once. Loopbacks and remapped sources whose devices are missing wait until a
+later event reports the device, so routes come back as soon as their hardware does without any polling.
+"""
+import logging
+
+import pulsectl
+
+import connection
+import profiling
+import program_logic
+import topology
+
+logger = logging.getLogger("Main")
+
+
+class Supervisor:
+    def __init__(self, wanted_topology: topology.Topology, client_name: str = "pulseaudio-loopback-tool"):
+        self.topology = wanted_topology
+        self.connection = connection.ConnectionManager(client_name)
+        self.connection.on_connect = self._on_connect
+        self._reconcile_needed = False
+
+    def run(self):
+        """
+        Supervises until stop() is called, surviving server restarts.
+        :return:
+        """
+        logger.info("Supervising {} modules.".format(len(self.topology.modules)))
+        self.connection.run(self._serve)
+
+    def stop(self):
+        self.connection.stop()
+
+    def _on_connect(self, pulseaudio: pulsectl.Pulse):
+        pulseaudio.event_mask_set("sink", "source", "module")
+        pulseaudio.event_callback_set(self._on_event)
+        self.reconcile(pulseaudio)
+
+    def _on_event(self, event: pulsectl.PulseEventInfo):
+        facility, event_type = event.facility._value, event.t._value
+        if (facility == "module" and event_type == "remove") or (facility in ("sink", "source") and
+                                                                event_type == "new"):
+            self._reconcile_needed = True
+            raise pulsectl.PulseLoopStop
+
+    def _serve(self, pulseaudio: pulsectl.Pulse):
+        while not self.connection.stopped:
+            pulseaudio.event_listen()
+            if self._reconcile_needed:
+                self._reconcile_needed = False
+                self.reconcile(pulseaudio)
+
+    def reconcile(self, pulseaudio: pulsectl.Pulse):
+        """
+        Loads every wanted module that is missing and can be loaded now, and replaces modules that differ from the
+        topology. A module that fails to load is retried on the next event.
+        :param pulseaudio: Connection to the server.
+        :return:
+        """
+        with profiling.profile("reconcile"):
+            self._reconcile(pulseaudio)
+
+    def _reconcile(self, pulseaudio: pulsectl.Pulse):
+        try:
+            plan = topology.plan_topology(self.topology, program_logic.get_module_list(pulseaudio),
+                                          topology.get_device_names(pulseaudio))
+        except topology.TopologyError as error:
+            # Modules loaded outside the topology would close a feedback loop with it; nothing changes until they go.
+            logger.warning("Supervisor cannot reconcile: {}".format(error))
+            return
+        if plan.is_empty():
+            return
+
+        for module in plan.unload:
+            try:
+                program_logic.delete_module(pulseaudio, module["id"])
+            except program_logic.ModuleError as error:
+                logger.warning("Supervisor could not unload module {}: {}".format(module["id"], error))
+
+        routing_graph = None
+        for spec in plan.load:
+            if spec.name == "module-loopback" and routing_graph is None:
+                routing_graph = program_logic.get_routing_graph(pulseaudio)
+            try:
+                topology.load_spec(pulseaudio, spec, routing_graph)
+            except program_logic.ModuleError as error:
+                logger.warning("Supervisor could not load {}: {}".format(spec.name, error))
+
+        logger.info("Supervisor reconciled: {} unloaded, {} loaded, {} waiting for devices.".format(
+            len(plan.unload), len(plan.load), len(plan.deferred)))
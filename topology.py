@@ -0,0 +1,320 @@
+"""
+Declarative description of the null sinks, remapped sources and loopbacks that should exist, and the engine that
+brings the server in line with it.
+
+A topology file is JSON of the following form, where every entry may carry extra module arguments:
+{
+    "exclusive": false,
+    "null_sinks": [{"sink_name": "Stream", "rate": 48000}],
+    "remapped_sources": [{"source_name": "Stream_Mic", "master": "Stream.monitor"}],
+    "loopbacks": [{"source": "Stream.monitor", "sink": "alsa_output.pci-0000_00_1f.3.analog-stereo"}]
+}
+With "exclusive" set, modules of these kinds that are not described in the file are unloaded.
+"""
+import json
+import logging
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import pulsectl
+
+import program_logic
+import routing
+
+logger = logging.getLogger("Main")
+
+
+class TopologyError(Exception):
+    """
+    Raised when a topology file cannot be read or does not describe a valid topology.
+    """
+
+
+class ModuleSpec(NamedTuple):
+    name: str
+    arguments: Dict[str, str]
+
+
+class Section(NamedTuple):
+    module_name: str
+    required_arguments: Tuple[str, ...]
+    # Arguments that identify a module; two modules with the same identity are versions of the same thing.
+    identity_arguments: Tuple[str, ...]
+
+
+# Sections in load order; modules are unloaded in the reverse order so nothing is left pointing at a removed device.
+SECTIONS: Dict[str, Section] = {
+    "null_sinks": Section("module-null-sink", ("sink_name",), ("sink_name",)),
+    "remapped_sources": Section("module-remap-source", ("source_name", "master"), ("source_name",)),
+    "loopbacks": Section("module-loopback", ("source", "sink"), ("source", "sink")),
+}
+
+MODULE_ORDER = [section.module_name for section in SECTIONS.values()]
+IDENTITY_ARGUMENTS = {section.module_name: section.identity_arguments for section in SECTIONS.values()}
+MONITOR_SUFFIX = ".monitor"
+
+
+class Topology(NamedTuple):
+    modules: List[ModuleSpec]
+    exclusive: bool = False
+
+
+class Plan(NamedTuple):
+    unload: List[Dict]
+    load: List[ModuleSpec]
+    # Modules that are missing but cannot be loaded yet because a device they attach to does not exist.
+    deferred: List[ModuleSpec] = []
+
+    def is_empty(self) -> bool:
+        return not self.unload and not self.load
+
+
+def _description_property(name: str) -> str:
+    if any(character.isspace() for character in name):
+        name = "'{}'".format(name)
+    return "device.description={}".format(name)
+
+
+def _spec_from_entry(section_name: str, entry: Dict) -> ModuleSpec:
+    section = SECTIONS[section_name]
+    if not isinstance(entry, dict):
+        raise TopologyError("Entries of \"{}\" must be objects, got {!r}.".format(section_name, entry))
+    missing = [name for name in section.required_arguments if name not in entry]
+    if missing:
+        raise TopologyError("Entry {!r} in \"{}\" is missing {}.".format(entry, section_name, ", ".join(missing)))
+
+    arguments = {name: str(value) for name, value in entry.items()}
+    if section.module_name == "module-null-sink":
+        arguments.setdefault("sink_properties", _description_property(arguments["sink_name"]))
+    elif section.module_name == "module-remap-source":
+        arguments.setdefault("source_properties", _description_property(arguments["source_name"]))
+    return ModuleSpec(section.module_name, arguments)
+
+
+def parse_topology(data: Dict) -> Topology:
+    """
+    Builds a topology from the decoded contents of a topology file.
+    :param data: Decoded JSON object.
+    :return: The described topology.
+    """
+    if not isinstance(data, dict):
+        raise TopologyError("A topology must be a JSON object.")
+    unknown = set(data) - set(SECTIONS) - {"exclusive"}
+    if unknown:
+        raise TopologyError("Unknown topology keys: {}".format(", ".join(sorted(unknown))))
+
+    modules = []
+    for section_name in SECTIONS:
+        for entry in data.get(section_name, []):
+            modules.append(_spec_from_entry(section_name, entry))
+    check_feedback_loops(modules)
+    return Topology(modules, bool(data.get("exclusive", False)))
+
+
+def load_topology(path: str) -> Topology:
+    """
+    Reads a topology file.
+    :param path: Path to a JSON topology file.
+    :return: The described topology.
+    """
+    try:
+        with open(path) as topology_file:
+            data = json.load(topology_file)
+    except (OSError, ValueError) as error:
+        raise TopologyError("Could not read topology file {}: {}".format(path, error)) from error
+    return parse_topology(data)
+
+
+def _identity(name: str, arguments: Dict[str, str]) -> Tuple:
+    return (name,) + tuple(arguments.get(argument) for argument in IDENTITY_ARGUMENTS[name])
+
+
+def _matches(spec: ModuleSpec, module: Dict) -> bool:
+    attributes = module["attributes"]
+    return all(attributes.get(name) == value for name, value in spec.arguments.items())
+
+
+def _required_devices(spec: ModuleSpec) -> List[str]:
+    if spec.name == "module-loopback":
+        return [spec.arguments["source"], spec.arguments["sink"]]
+    if spec.name == "module-remap-source":
+        return [spec.arguments["master"]]
+    return []
+
+
+def _created_devices(spec: ModuleSpec) -> List[str]:
+    if spec.name == "module-null-sink":
+        return [spec.arguments["sink_name"], spec.arguments["sink_name"] + MONITOR_SUFFIX]
+    if spec.name == "module-remap-source":
+        return [spec.arguments["source_name"]]
+    return []
+
+
+def check_feedback_loops(specs: List[ModuleSpec], existing_specs: List[ModuleSpec] = ()):
+    """
+    Refuses modules that would route a device's audio back into itself. Devices are matched by name, a sink's monitor
+    being the source named after it with ".monitor" appended, as PulseAudio names them. Devices given by index cannot
+    be matched here and are left to the check made when a loopback is loaded.
+    :param specs: Modules to be loaded.
+    :param existing_specs: Modules that are already loaded and stay. A loop among these alone was made elsewhere, so
+    it is only logged, like routing.RoutingGraph does.
+    :return:
+    :raises TopologyError: The modules to be loaded close a feedback loop.
+    """
+    graph = routing.RoutingGraph()
+
+    def node(kind: str, name: Optional[str]) -> Optional[routing.Node]:
+        # A loaded module may leave out a device, which then is the default one.
+        if name is None or name.isdigit():
+            return None
+        existing = graph.resolve(kind, name)
+        if existing is not None:
+            return existing
+        new_node = graph.add_node(kind, len(graph.order), name)
+        # The new node has no other edges yet, so linking it to its sink or monitor cannot close a loop.
+        if kind == routing.SINK and graph.resolve(routing.SOURCE, name + MONITOR_SUFFIX) is not None:
+            graph.add_edge(new_node, graph.resolve(routing.SOURCE, name + MONITOR_SUFFIX))
+        elif kind == routing.SOURCE and name.endswith(MONITOR_SUFFIX) and \
+                graph.resolve(routing.SINK, name[:-len(MONITOR_SUFFIX)]) is not None:
+            graph.add_edge(graph.resolve(routing.SINK, name[:-len(MONITOR_SUFFIX)]), new_node)
+        return new_node
+
+    def edges(spec: ModuleSpec) -> List[Tuple[Optional[routing.Node], Optional[routing.Node]]]:
+        if spec.name == "module-null-sink":
+            node(routing.SINK, spec.arguments.get("sink_name"))
+        elif spec.name == "module-remap-source":
+            return [(node(routing.SOURCE, spec.arguments.get("master")),
+                     node(routing.SOURCE, spec.arguments.get("source_name")))]
+        elif spec.name == "module-loopback":
+            return [(node(routing.SOURCE, spec.arguments.get("source")),
+                     node(routing.SINK, spec.arguments.get("sink")))]
+        return []
+
+    for spec in existing_specs:
+        for from_node, to_node in edges(spec):
+            if from_node is not None and to_node is not None:
+                graph.add_existing_edge(from_node, to_node)
+    for spec in specs:
+        for from_node, to_node in edges(spec):
+            if from_node is None or to_node is None:
+                continue
+            cycle = graph.add_edge(from_node, to_node)
+            if cycle is not None:
+                raise TopologyError("Loading {} would create the feedback loop {}".format(
+                    spec.name, graph.format_path(cycle)))
+
+
+def get_device_names(pulseaudio: pulsectl.Pulse) -> Set[str]:
+    """
+    Every name and index by which a sink or source can be referred to in module arguments.
+    :param pulseaudio: Connection to the server.
+    :return:
+    """
+    devices = program_logic.list_sinks(pulseaudio) + program_logic.list_sources(pulseaudio)
+    return {device.name for device in devices} | {str(device.index) for device in devices}
+
+
+def plan_topology(topology: Topology, module_list: List[Dict], device_names: Optional[Set[str]] = None) -> Plan:
+    """
+    Computes the smallest set of unloads and loads that turns the current modules into the described topology.
+    Modules that already match their description are left alone.
+    :param topology: The wanted topology.
+    :param module_list: Module dictionaries as returned by program_logic.get_module_list.
+    :param device_names: If given, names of the existing sinks and sources; modules attaching to a device that
+    neither exists nor is created earlier in the plan are deferred instead of loaded.
+    :return: The modules to unload and the modules to load, both in a safe order.
+    :raises TopologyError: The modules to load would close a feedback loop with each other or the ones kept.
+    """
+    existing: Dict[Tuple, List[Dict]] = {}
+    for module in module_list:
+        if module["name"] in MODULE_ORDER:
+            existing.setdefault(_identity(module["name"], module["attributes"]), []).append(module)
+
+    unload: List[Dict] = []
+    load: List[ModuleSpec] = []
+    for spec in topology.modules:
+        candidates = existing.pop(_identity(spec.name, spec.arguments), [])
+        matching = [module for module in candidates if _matches(spec, module)]
+        if matching:
+            # Keep one matching module; any other module with this identity is a duplicate.
+            candidates.remove(matching[0])
+        else:
+            load.append(spec)
+        unload.extend(candidates)
+
+    if topology.exclusive:
+        for modules in existing.values():
+            unload.extend(modules)
+
+    unload.sort(key=lambda module: -MODULE_ORDER.index(module["name"]))
+    load.sort(key=lambda spec: MODULE_ORDER.index(spec.name))
+    unloaded_ids = {module["id"] for module in unload}
+    check_feedback_loops(load, [ModuleSpec(module["name"], module["attributes"]) for module in module_list
+                                if module["name"] in MODULE_ORDER and module["id"] not in unloaded_ids])
+
+    deferred: List[ModuleSpec] = []
+    if device_names is not None:
+        device_names = set(device_names)
+        loadable: List[ModuleSpec] = []
+        for spec in load:
+            if all(device in device_names for device in _required_devices(spec)):
+                loadable.append(spec)
+                device_names.update(_created_devices(spec))
+            else:
+                deferred.append(spec)
+        load = loadable
+    return Plan(unload, load, deferred)
+
+
+def apply_plan(pulseaudio: pulsectl.Pulse, plan: Plan) -> List[int]:
+    """
+    Executes a plan over the given connection.
+    :param pulseaudio: Connection to the server.
+    :param plan: Plan from plan_topology.
+    :return: Indices of the loaded modules.
+    """
+    for module in plan.unload:
+        program_logic.delete_module(pulseaudio, module["id"])
+    loaded = []
+    routing_graph = None
+    for spec in plan.load:
+        if spec.name == "module-loopback" and routing_graph is None:
+            # Fetched once the sinks and sources of the plan exist, since they are loaded before any loopback.
+            routing_graph = program_logic.get_routing_graph(pulseaudio)
+        loaded.append(load_spec(pulseaudio, spec, routing_graph))
+    return loaded
+
+
+def load_spec(pulseaudio: pulsectl.Pulse, spec: ModuleSpec,
+              routing_graph: Optional[routing.RoutingGraph] = None) -> int:
+    """
+    Loads the module a spec describes. A loopback is added to the routing graph first, so one that would close a
+    feedback loop raises program_logic.FeedbackLoopError instead of being loaded.
+    :param pulseaudio: Connection to the server.
+    :param spec:
+    :param routing_graph: Current routing, which is needed for loopbacks only.
+    :return: Index of the loaded module.
+    """
+    arguments = program_logic.format_module_arguments(spec.arguments)
+    if spec.name != "module-loopback":
+        return program_logic.load_module(pulseaudio, spec.name, arguments)
+
+    new_edge = program_logic.check_loopback(routing_graph, spec.arguments["source"], spec.arguments["sink"])
+    try:
+        return program_logic.load_module(pulseaudio, spec.name, arguments)
+    except program_logic.ModuleLoadError:
+        if new_edge is not None:
+            routing_graph.remove_edge(*new_edge)
+        raise
+
+
+def apply_topology(pulseaudio: pulsectl.Pulse, topology: Topology) -> Plan:
+    """
+    Brings the server in line with the topology. Applying an unchanged topology a second time does nothing.
+    :param pulseaudio: Connection to the server.
+    :param topology: The wanted topology.
+    :return: The plan that was applied.
+    """
+    plan = plan_topology(topology, program_logic.get_module_list(pulseaudio))
+    logger.info("Applying topology: {} modules to unload, {} to load.".format(len(plan.unload), len(plan.load)))
+    apply_plan(pulseaudio, plan)
+    return plan
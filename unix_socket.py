@@ -0,0 +1,67 @@
+"""
+Listening on Unix domain sockets without trampling on what is already at the path.
+Default socket paths may be in a shared directory like /tmp, so a path is only taken over when it holds a socket that
+nobody listens on any more: a regular file is never deleted, and a live server is never replaced.
+"""
+import logging
+import os
+import socket
+import stat
+
+logger = logging.getLogger("Main")
+
+# Seconds to wait for a server that may be listening on an existing socket.
+PROBE_TIMEOUT = 1.0
+
+
+class SocketPathError(OSError):
+    """
+    Raised when the path of a socket to listen on is taken by something that must not be replaced.
+    """
+
+
+def remove_stale_socket(path: str):
+    """
+    Makes way for a new socket at path by removing a socket left behind by a server that is gone.
+    :param path:
+    :return:
+    :raises SocketPathError: Something other than a socket is at path, or a server still answers on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise SocketPathError("{} exists and is not a socket, refusing to replace it.".format(path))
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(PROBE_TIMEOUT)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Nobody listens on it any more.
+        pass
+    except OSError as error:
+        raise SocketPathError("Cannot tell whether a server is listening on {}: {}".format(path, error)) from error
+    else:
+        raise SocketPathError("Another server is listening on {}.".format(path))
+    finally:
+        probe.close()
+
+    logger.info("Removing the stale socket {}.".format(path))
+    os.unlink(path)
+
+
+def bind_private(unix_socket: socket.socket, path: str):
+    """
+    Binds a Unix domain socket so that only the owner can connect to it, from the moment it appears. The umask is
+    process-wide, so it is only changed for the bind itself.
+    :param unix_socket:
+    :param path:
+    :return:
+    """
+    old_umask = os.umask(0o177)
+    try:
+        unix_socket.bind(path)
+    finally:
+        os.umask(old_umask)